@@ -0,0 +1,72 @@
+# coding: utf-8
+"""Throughput of Spec.evaluate as the number of fixture-style cases grows.
+
+    python benchmarks/case_dispatch.py
+"""
+from __future__ import print_function, unicode_literals
+
+import os.path
+import random
+import sys
+import time
+
+# run from a checkout: the bqspec next to benchmarks is imported, without installing it or setting PYTHONPATH.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bqspec.spec import from_dict
+
+ROWS = 2000
+
+
+def make_spec(n_cases):
+    cases = []
+    for i in range(n_cases):
+        if i % 2:
+            cases.append({"where": ["id == {}".format(i)], "expected": ["total == a + b"]})
+        else:
+            cases.append({"where": ["region == 'r{}'".format(i % 7), "day == {}".format(i)], "expected": ["a >= 0"]})
+    return from_dict({"query_path": "query.sql", "cases": cases})
+
+
+def make_rows(n_rows, n_cases):
+    rng = random.Random(0)
+    rows = []
+    for _ in range(n_rows):
+        a, b = rng.randint(0, 10), rng.randint(0, 10)
+        rows.append({
+            "id": rng.randint(0, n_cases),
+            "region": "r{}".format(rng.randint(0, 6)),
+            "day": rng.randint(0, n_cases),
+            "a": a,
+            "b": b,
+            "total": a + b,
+        })
+    return rows
+
+
+def scan(spec, rows):
+    """The dispatch before the case index, every case's where is evaluated for every row."""
+    for row in rows:
+        for case in spec.cases:
+            if all(condition(**row) for condition in case.where):
+                [condition.expr for condition in case.expected if not condition(**row)]
+
+
+def throughput(f, spec, rows):
+    start = time.time()
+    f(spec, rows)
+    return len(rows) / (time.time() - start)
+
+
+def main():
+    print("{:>8} {:>16} {:>16}".format("cases", "indexed rows/s", "scan rows/s"))
+    for n_cases in (1, 10, 100, 1000):
+        spec = make_spec(n_cases)
+        rows = make_rows(ROWS, n_cases)
+        indexed = throughput(lambda spec, rows: spec.evaluate(rows), spec, rows)
+        scanned = throughput(scan, spec, rows)
+        print("{:>8} {:>16.0f} {:>16.0f}".format(n_cases, indexed, scanned))
+
+
+if __name__ == "__main__":
+    main()
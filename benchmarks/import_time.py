@@ -0,0 +1,58 @@
+# coding: utf-8
+"""Time to import bqspec.cli, which bqspec check pays before validating anything.
+
+    python benchmarks/import_time.py [--max-ms 300]
+
+Exits with 1 if the import loads the BigQuery client, tqdm or numpy, or takes longer than --max-ms.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+
+RUNS = 10
+# the checkout the bqspec imported by the measured processes is in, without installing it or setting PYTHONPATH.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["google.cloud.bigquery", "google.cloud.exceptions", "tqdm", "numpy"]
+
+SCRIPT = """
+import json, sys, time
+start = time.time()
+import bqspec.cli
+elapsed = time.time() - start
+print(json.dumps({"ms": elapsed * 1000, "loaded": [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def measure():
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT], cwd=ROOT)
+    return json.loads(output.decode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--max-ms", type=float)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    median = sorted(result["ms"] for result in results)[len(results) // 2]
+    loaded = results[0]["loaded"]
+    print("import bqspec.cli: {:.1f}ms (median of {} runs)".format(median, len(results)))
+
+    failed = False
+    if loaded:
+        print("heavy modules imported at startup: {}".format(", ".join(loaded)))
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print("slower than {:.1f}ms".format(args.max_ms))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
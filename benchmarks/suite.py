@@ -0,0 +1,257 @@
+# coding: utf-8
+"""Benchmarks of the verification pipeline, written as JSON to compare against a baseline.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline results.json
+
+Spec.verify runs on a synthetic row source instead of BigQuery, sweeping the number of columns, invariants,
+cases and the ratio of failing rows one at a time around a default. Each verify benchmark reports rows per
+second, the peak memory traced while verifying, and that peak per row. Loading reports specs per second for
+load_yaml, validate_schema, validate_values and from_struct over a directory of generated spec files, and for
+loading them again through a SpecCache.
+
+With --baseline, exits with 1 if a benchmark is slower than the baseline, or its peak memory higher, by more than
+--tolerance.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import io
+import json
+import os
+import os.path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# run from a checkout: the bqspec next to benchmarks is imported, without installing it or setting PYTHONPATH.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bqspec.__version__ import __version__
+from bqspec.backend import Backend, Job
+from bqspec.loader import load_yaml
+from bqspec.rstruct import RawSpec
+from bqspec.spec import from_dict, from_struct
+from bqspec.speccache import SpecCache, validate_spec
+from bqspec.validator import validate_schema, validate_values
+
+ROWS = 20000
+SPECS = 2000
+# timings are the best of this many runs, after one run warming up.
+REPEAT = 3
+DEFAULT = {"columns": 10, "invariants": 5, "cases": 10, "failure_ratio": 0.01}
+SWEEPS = {
+    "columns": [5, 20, 50],
+    "invariants": [1, 20, 50],
+    "cases": [0, 100, 1000],
+    "failure_ratio": [0.0, 0.1, 0.5],
+}
+# the metrics compared against the baseline, with whether higher is better.
+METRICS = (("rows_per_second", True), ("specs_per_second", True), ("peak_bytes", False), ("peak_bytes_per_row", False))
+
+
+class SyntheticJob(Job):
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self._rows = rows
+
+    def rows(self):
+        return iter(self._rows)
+
+
+class SyntheticBackend(Backend):
+    """Returns the same generated rows for every query."""
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+
+    def submit(self, query, params, dry_run=False, maximum_bytes_billed=None):
+        return SyntheticJob(self.fields, [] if dry_run else self.rows)
+
+
+def make_rows(n_rows, n_columns, failure_ratio):
+    """Rows of non-negative integers, except the failing ones, which are -1 in every column."""
+    rng = random.Random(0)
+    rows = []
+    for i in range(n_rows):
+        if rng.random() < failure_ratio:
+            rows.append((-1, ) * n_columns)
+        else:
+            rows.append((i % 1000, ) + tuple(rng.randint(0, 100) for _ in range(n_columns - 1)))
+    return rows
+
+
+def make_spec(query_path, n_columns, n_invariants, n_cases):
+    columns = ["c{}".format(i) for i in range(n_columns)]
+    invariants = ["c{} >= 0".format(i % n_columns) for i in range(n_invariants)]
+    cases = [{"where": ["c0 == {}".format(i)], "expected": ["c{} >= 0".format(i % n_columns)]} for i in range(n_cases)]
+    return from_dict({"query_path": query_path, "columns": columns, "invariants": invariants, "cases": cases})
+
+
+def best_time(f, repeat):
+    # the first run fills caches, e.g. of compiled conditions, which the later runs would not time.
+    f()
+    elapsed = []
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        elapsed.append(time.time() - start)
+    return min(elapsed)
+
+
+def bench_verify(query_path, n_rows, repeat, columns, invariants, cases, failure_ratio):
+    fields = ["c{}".format(i) for i in range(columns)]
+    backend = SyntheticBackend(fields, make_rows(n_rows, columns, failure_ratio))
+    spec = make_spec(query_path, columns, invariants, cases)
+
+    elapsed = best_time(lambda: spec.verify(backend, progress=False), repeat)
+
+    # traced separately, tracing slows the evaluation down.
+    tracemalloc.start()
+    try:
+        spec.verify(backend, progress=False)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "rows_per_second": n_rows / elapsed,
+        "peak_bytes": peak,
+        "peak_bytes_per_row": peak / n_rows,
+    }
+
+
+SPEC_TEMPLATE = """\
+query_path: {query_path}
+params:
+  - type: DATE
+    name: date
+    value: 2017-11-30
+columns: [id, a, b, total]
+invariants:
+  - total >= 0
+  - a + b == total
+cases:
+  - where: [id == {i}]
+    expected: [total == {total}, a >= 0]
+"""
+
+
+def load_specs(paths):
+    for path in paths:
+        with io.open(path, encoding="utf-8") as f:
+            obj = load_yaml(f)
+        assert not validate_schema(obj)
+        raw_spec = RawSpec(**obj)
+        assert not validate_values(raw_spec)
+        from_struct(raw_spec)
+
+
+def load_cached_specs(paths, cache_path):
+    spec_cache = SpecCache(cache_path)
+    for path in paths:
+        raw_spec, errors = validate_spec(path, spec_cache)
+        assert not errors
+        from_struct(raw_spec)
+    spec_cache.save()
+
+
+def bench_load(n_specs, repeat, cached=False):
+    spec_dir = tempfile.mkdtemp()
+    try:
+        query_path = os.path.join(spec_dir, "query.sql")
+        with io.open(query_path, "w", encoding="utf-8") as f:
+            f.write("SELECT 1 AS id, 2 AS a, 3 AS b, 5 AS total")
+        paths = []
+        for i in range(n_specs):
+            path = os.path.join(spec_dir, "spec{}.yaml".format(i))
+            with io.open(path, "w", encoding="utf-8") as f:
+                f.write(SPEC_TEMPLATE.format(query_path=query_path, i=i, total=i * 2))
+            paths.append(path)
+
+        if cached:
+            cache_path = os.path.join(spec_dir, "specs.cache")
+            load_cached_specs(paths, cache_path)
+            elapsed = best_time(lambda: load_cached_specs(paths, cache_path), repeat)
+        else:
+            elapsed = best_time(lambda: load_specs(paths), repeat)
+    finally:
+        shutil.rmtree(spec_dir)
+    return {"specs_per_second": n_specs / elapsed}
+
+
+def run(n_rows, n_specs, repeat):
+    benchmarks = []
+    with tempfile.NamedTemporaryFile(suffix=".sql") as f:
+        configs = [dict(DEFAULT)]
+        for key, values in sorted(SWEEPS.items()):
+            configs.extend(dict(DEFAULT, **{key: value}) for value in values)
+        for config in configs:
+            name = "verify/" + ",".join("{}={}".format(key, config[key]) for key in sorted(config))
+            result = bench_verify(f.name, n_rows, repeat, **config)
+            benchmarks.append(dict(name=name, params=config, **result))
+            print("{:<70} {:>12.0f} rows/s {:>12} peak bytes".format(name, result["rows_per_second"],
+                                                                    result["peak_bytes"]))
+
+    for cached in (False, True):
+        name = "load/{}specs={}".format("cached," if cached else "", n_specs)
+        result = bench_load(n_specs, repeat, cached)
+        benchmarks.append(dict(name=name, params={"specs": n_specs, "cached": cached}, **result))
+        print("{:<70} {:>12.0f} specs/s".format(name, result["specs_per_second"]))
+
+    return {
+        "bqspec": __version__,
+        "python": platform.python_version(),
+        "rows": n_rows,
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change of each benchmark from the baseline, and returns False if one regressed."""
+    base = {benchmark["name"]: benchmark for benchmark in baseline["benchmarks"]}
+    ok = True
+    for benchmark in results["benchmarks"]:
+        previous = base.get(benchmark["name"])
+        if previous is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            if metric not in benchmark or not previous.get(metric):
+                continue
+            change = benchmark[metric] / previous[metric] - 1
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print("{:<70} {:<18} {:>+8.1%}{}".format(benchmark["name"], metric, change,
+                                                     " REGRESSED" if regressed else ""))
+            ok = ok and not regressed
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=ROWS)
+    parser.add_argument("--specs", type=int, default=SPECS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="write the results as JSON.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown, or growth of peak memory, allowed before failing.")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.specs, args.repeat)
+    if args.output:
+        with io.open(args.output, "w", encoding="utf-8") as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+    if args.baseline:
+        with io.open(args.baseline, encoding="utf-8") as f:
+            baseline = json.loads(f.read())
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
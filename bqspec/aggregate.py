@@ -0,0 +1,98 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import ast
+import copy
+from typing import List, Text, Tuple
+
+from .astutil import is_column, parse_condition
+from .pushdown import Untranslatable, translate
+
+VALUE_PREFIX = "_bqspec_value_"
+RESULT_PREFIX = "_bqspec_aggregate_"
+
+# count takes no or one argument, the others exactly one.
+FUNCTIONS = {
+    "avg": "AVG({})",
+    "count_distinct": "COUNT(DISTINCT {})",
+    "countif": "COUNTIF({})",
+    "max": "MAX({})",
+    "min": "MIN({})",
+    "sum": "SUM({})",
+}
+
+
+class InvalidAggregate(Exception):
+    def __init__(self, message):  # type: (Text) -> None
+        super(InvalidAggregate, self).__init__(message)
+        self.message = message  # type: Text
+
+
+class _ValueExtractor(ast.NodeTransformer):
+    """Replaces the aggregate function calls of a condition with names of the values they compute."""
+
+    def __init__(self, values):  # type: (List[Text]) -> None
+        self.values = values  # type: List[Text]
+        self.found = False
+
+    def visit_Call(self, node):  # type: (ast.Call) -> ast.AST
+        sql = _aggregate_sql(node)
+        if sql not in self.values:
+            self.values.append(sql)
+        self.found = True
+        return ast.copy_location(ast.Name(id=VALUE_PREFIX + str(self.values.index(sql)), ctx=ast.Load()), node)
+
+    def visit_Name(self, node):  # type: (ast.Name) -> ast.AST
+        if is_column(node):
+            raise InvalidAggregate("{} is used outside of an aggregate function".format(node.id))
+        return node
+
+
+def to_sql(aggregate, values):  # type: (Text, List[Text]) -> Text
+    """Translates an aggregate condition to a BigQuery boolean expression over the aggregate values.
+
+    The aggregate function calls of the condition are appended to values, unless they are already in it.
+    """
+    try:
+        # the extractor replaces the calls in place, and parsed trees are shared.
+        node = copy.deepcopy(parse_condition(aggregate))
+    except SyntaxError:
+        raise InvalidAggregate("invalid syntax")
+    extractor = _ValueExtractor(values)
+    node = extractor.visit(node)
+    if not extractor.found:
+        raise InvalidAggregate("no aggregate function is used")
+    try:
+        return translate(node)
+    except Untranslatable:
+        raise InvalidAggregate("can not be translated to BigQuery")
+
+
+def build_query(query, aggregates):  # type: (Text, List[Text]) -> Tuple[Text, List[Text]]
+    """Builds a query computing every aggregate of a spec in one row.
+
+    The row has the aggregate values, and whether each aggregate holds. Returns the query and the values.
+    """
+    values = []  # type: List[Text]
+    conditions = [to_sql(aggregate, values) for aggregate in aggregates]
+    outer = ["`{0}{1}`".format(VALUE_PREFIX, i) for i in range(len(values))]
+    outer.extend("({}) IS TRUE AS `{}{}`".format(condition, RESULT_PREFIX, i) for i, condition in enumerate(conditions))
+    inner = ["{} AS `{}{}`".format(value, VALUE_PREFIX, i) for i, value in enumerate(values)]
+    return "SELECT {} FROM (\nSELECT {} FROM (\n{}\n)\n)".format(", ".join(outer), ", ".join(inner),
+                                                               query.strip().rstrip(";")), values
+
+
+def _aggregate_sql(node):  # type: (ast.Call) -> Text
+    name = node.func.id if isinstance(node.func, ast.Name) else None
+    if node.keywords or getattr(node, "starargs", None) or getattr(node, "kwargs", None):
+        raise InvalidAggregate("{} takes only positional arguments".format(name))
+    try:
+        if name == "count" and not node.args:
+            return "COUNT(*)"
+        if name == "count" and len(node.args) == 1:
+            return "COUNT({})".format(translate(node.args[0]))
+        if name in FUNCTIONS and len(node.args) == 1:
+            return FUNCTIONS[name].format(translate(node.args[0]))
+    except Untranslatable:
+        raise InvalidAggregate("the argument of {} can not be translated to BigQuery".format(name))
+    raise InvalidAggregate("unsupported aggregate function: {}".format(name))
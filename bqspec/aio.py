@@ -0,0 +1,233 @@
+# coding: utf-8
+"""Coroutines verifying specs in an asyncio event loop, for services embedding bqspec. Requires Python 3.6.
+
+The query jobs are submitted, waited for and read a batch of rows at a time in the threads of a Limiter, and
+the batches are evaluated there too, so the event loop is never blocked. The Limiter bounds the jobs running at
+once, which is also the number of its threads, and the rate at which jobs are submitted::
+
+    bqspec.aio.set_limits(concurrency=32, rate=10)
+    results = await asyncio.gather(*[bqspec.aio.verify(spec) for spec in specs])
+
+pushdown, projection, workers, vectorized evaluation, profiles and the result cache are left to Spec.verify.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Text, Tuple
+
+from .backend import Job, as_backend
+from .failures import FIRST, FailureCollector
+from .pushdown import limit_query
+from .spec import Failure, Results, Spec, to_dict, to_dicts
+
+if TYPE_CHECKING:
+    from .backend import Client
+
+DEFAULT_CONCURRENCY = 16
+
+# a failure found by iter_failures, with its case, or None for the invariants.
+Found = Tuple[Optional[int], Failure]
+
+
+class Limiter(object):
+    """Limits the query jobs of the coroutines: at most concurrency of them at once, and at most rate submitted
+    per second, in bursts of up to burst jobs. Without rate, jobs are submitted as soon as they may run.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=None, burst=1):
+        # type: (int, Optional[float], int) -> None
+        self.concurrency = concurrency  # type: int
+        self.rate = rate  # type: Optional[float]
+        self.burst = burst  # type: int
+        self.executor = ThreadPoolExecutor(concurrency)
+        # the semaphore and the lock of each event loop using the limiter, since they can only be used in one loop,
+        # e.g. when asyncio.run is called again. Those of closed loops are dropped.
+        self._primitives = {}  # type: Dict[asyncio.AbstractEventLoop, Tuple[asyncio.Semaphore, asyncio.Lock]]
+        self._tokens = float(burst)  # type: float
+        self._updated = None  # type: Optional[float]
+
+    def _loop_primitives(self):  # type: () -> Tuple[asyncio.Semaphore, asyncio.Lock]
+        loop = asyncio.get_event_loop()
+        primitives = self._primitives.get(loop)
+        if primitives is None:
+            for closed in [other for other in self._primitives if other.is_closed()]:
+                del self._primitives[closed]
+            primitives = self._primitives[loop] = (asyncio.Semaphore(self.concurrency), asyncio.Lock())
+        return primitives
+
+    async def __aenter__(self):  # type: () -> Limiter
+        semaphore, lock = self._loop_primitives()
+        await semaphore.acquire()
+        try:
+            await self._wait_rate(lock)
+        except BaseException:
+            semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):  # type: (*Any) -> None
+        self._loop_primitives()[0].release()
+
+    async def _wait_rate(self, lock):  # type: (asyncio.Lock) -> None
+        if self.rate is None:
+            return
+        async with lock:
+            while True:
+                now = time.monotonic()
+                if self._updated is not None:
+                    self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def run(self, func, *args):  # type: (Callable[..., Any], *Any) -> Any
+        """Calls func with args in a thread of the limiter."""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+
+_limiter = Limiter()
+
+
+def set_limits(concurrency=DEFAULT_CONCURRENCY, rate=None, burst=1):  # type: (int, Optional[float], int) -> None
+    """Replaces the Limiter shared by the coroutines which are not given their own."""
+    global _limiter
+    _limiter = Limiter(concurrency, rate, burst)
+
+
+class StreamingCollector(FailureCollector):
+    """Collects failures like FailureCollector, and keeps those found since take was last called."""
+
+    def __init__(self, n_cases, max_examples=None, sampling=FIRST, max_failures=None):
+        # type: (int, Optional[int], Text, Optional[int]) -> None
+        super(StreamingCollector, self).__init__(n_cases, max_examples, sampling, max_failures)
+        self.found = []  # type: List[Found]
+
+    def add_invariants(self, failure):  # type: (Failure) -> None
+        super(StreamingCollector, self).add_invariants(failure)
+        self.found.append((None, failure))
+
+    def add_case(self, i, failure):  # type: (int, Failure) -> None
+        super(StreamingCollector, self).add_case(i, failure)
+        self.found.append((i, failure))
+
+    def take(self):  # type: () -> List[Found]
+        found, self.found = self.found, []
+        return found
+
+
+async def _batches(spec, client, limiter, limit=None):
+    # type: (Spec, Optional[Client], Limiter, Optional[int]) -> AsyncIterator[Tuple[List[Text], List[tuple]]]
+    """Reads the spec's rows, or the first limit of them, yielding their fields with each batch of them.
+    The job is cancelled if it is abandoned.
+
+    Like Spec.fetch, the rows are materialized first if the spec has a destination, and the rows of a table,
+    unless sampled or limited, are read from it without running a query.
+    """
+    async with limiter:
+        await limiter.run(spec.materialize, client)
+        table = None  # type: Optional[Text]
+        if limit is not None:
+            query = limit_query(spec.read_query(), limit)
+        else:
+            query = spec.row_query()
+            if spec.sample is None:
+                table = spec.result_table()
+        if table is not None:
+            job = await limiter.run(as_backend(client).read_table, table)  # type: Job
+        else:
+            job = await limiter.run(spec.run_query, client, query)
+        batches = job.batches()
+        done = False
+        try:
+            while True:
+                batch = await limiter.run(next, batches, None)
+                if batch is None:
+                    done = True
+                    return
+                yield job.fields, batch
+        finally:
+            if not done:
+                await limiter.run(job.cancel)
+
+
+async def iter_failures(spec, client=None, limiter=None, collector=None):
+    # type: (Spec, Optional[Client], Optional[Limiter], Optional[StreamingCollector]) -> AsyncIterator[Found]
+    """Runs the spec's query, yielding every failure as it is found, with its case, or None for the invariants.
+
+    The failures are also collected in collector, which stops the query once it has max_failures of them.
+    With a sample, the rows of the sample are counted in spec.sampled.
+    """
+    if spec.matrix:
+        raise ValueError("a spec with a parameter matrix is verified per combination, see Spec.expand")
+    if limiter is None:
+        limiter = _limiter
+    if collector is None:
+        collector = StreamingCollector(len(spec.cases), max_examples=0)
+
+    if not spec.invariants and not spec.cases:
+        if spec.columns:
+            batches = _batches(spec, client, limiter, 1)
+            try:
+                async for fields, batch in batches:
+                    unknown = spec.unknown_columns(to_dict(fields, batch[0]))
+                    if unknown:
+                        collector.add_invariants(unknown)
+                    break
+            finally:
+                await batches.aclose()
+        for found in collector.take():
+            yield found
+        return
+
+    sampled = 0
+    batches = _batches(spec, client, limiter)
+    try:
+        async for fields, batch in batches:
+            await limiter.run(spec.evaluate_tuples, fields, batch, collector, sampled == 0)
+            sampled += len(batch)
+            for found in collector.take():
+                yield found
+            if collector.stopped:
+                break
+    finally:
+        await batches.aclose()
+        spec.sampled = sampled if spec.sample is not None else None
+
+
+async def verify(spec, client=None, limiter=None, max_examples=None, sampling=FIRST, max_failures=None):
+    # type: (Spec, Optional[Client], Optional[Limiter], Optional[int], Text, Optional[int]) -> Results
+    """Same as Spec.verify, as a coroutine."""
+    collector = StreamingCollector(len(spec.cases), max_examples, sampling, max_failures)
+    async for _ in iter_failures(spec, client, limiter, collector):
+        pass
+    return collector.results()
+
+
+async def verify_aggregates(spec, client=None, limiter=None):
+    # type: (Spec, Optional[Client], Optional[Limiter]) -> List[Failure]
+    """Same as Spec.verify_aggregates, as a coroutine."""
+    if limiter is None:
+        limiter = _limiter
+    if not spec.aggregates:
+        return []
+    async with limiter:
+        return await limiter.run(spec.verify_aggregates, client)
+
+
+async def execute_query(spec, client=None, limiter=None):
+    # type: (Spec, Optional[Client], Optional[Limiter]) -> AsyncIterator[dict]
+    """Same as Spec.execute_query, as an asynchronous iterator."""
+    if limiter is None:
+        limiter = _limiter
+    batches = _batches(spec, client, limiter)
+    try:
+        async for fields, batch in batches:
+            for row in to_dicts(fields, batch):
+                yield row
+    finally:
+        await batches.aclose()
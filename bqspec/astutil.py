@@ -0,0 +1,53 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import ast
+from typing import Any, Dict, FrozenSet, Set, Text
+
+# python2 parses these as names.
+NAME_CONSTANTS = {"True": True, "False": False, "None": None}
+
+
+class NotConstant(Exception):
+    pass
+
+
+# the trees of the conditions parsed so far, by their text. They are shared, so they must not be modified.
+_parsed = {}  # type: Dict[Text, ast.AST]
+_names = {}  # type: Dict[Text, FrozenSet[Text]]
+
+
+def parse_condition(condition):  # type: (Text) -> ast.AST
+    node = _parsed.get(condition)
+    if node is None:
+        node = _parsed.setdefault(condition, ast.parse(condition.strip(), mode="eval").body)
+    return node
+
+
+def constant_value(node):  # type: (ast.AST) -> Any
+    if isinstance(node, ast.Name) and node.id in NAME_CONSTANTS:
+        return NAME_CONSTANTS[node.id]
+    for name, attr in (("Constant", "value"), ("NameConstant", "value"), ("Num", "n"), ("Str", "s")):
+        if hasattr(ast, name) and isinstance(node, getattr(ast, name)):
+            return getattr(node, attr)
+    raise NotConstant()
+
+
+def is_constant(node):  # type: (ast.AST) -> bool
+    try:
+        constant_value(node)
+        return True
+    except NotConstant:
+        return False
+
+
+def is_column(node):  # type: (ast.AST) -> bool
+    return isinstance(node, ast.Name) and node.id not in NAME_CONSTANTS
+
+
+def referenced_names(condition):  # type: (Text) -> Set[Text]
+    names = _names.get(condition)
+    if names is None:
+        names = frozenset(node.id for node in ast.walk(parse_condition(condition)) if is_column(node))
+        names = _names.setdefault(condition, names)
+    return set(names)
@@ -0,0 +1,509 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import os.path
+import re
+import sqlite3
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Text, Tuple, Union
+
+import six
+
+from .parallel import batches, windowed
+
+if TYPE_CHECKING:
+    import google.cloud.bigquery as bq
+    from google.cloud.exceptions import GoogleCloudError
+
+# rows per batch when a backend has no batches of its own.
+BATCH_SIZE = 1000
+# rows per page when BigQuery result pages are read in parallel.
+PAGE_SIZE = 10000
+# seconds a materialized result must have left before it expires to be reused, so that it outlasts the run.
+EXPIRATION_MARGIN = 600
+# project.dataset.table or dataset.table, the project of the client by default.
+TABLE = re.compile(r"^(?:[^`\s]+\.)?[^`.\s]+\.[^`.\s]+$")
+
+
+class QueryError(Exception):
+    def __init__(self, message):  # type: (Text) -> None
+        super(QueryError, self).__init__(message)
+        self.message = message  # type: Text
+
+
+class InvalidQuery(QueryError):
+    """The query is rejected before it runs, e.g. it does not type check."""
+
+
+class Job(object):
+    """A query submitted to a backend."""
+
+    # the field names of the result.
+    fields = []  # type: List[Text]
+    # bytes the query processes, or None if the backend does not know.
+    total_bytes_processed = None  # type: Optional[int]
+
+    def rows(self):  # type: () -> Iterator[tuple]
+        raise NotImplementedError()
+
+    def batches(self, size=BATCH_SIZE):  # type: (int) -> Iterator[List[tuple]]
+        return batches(self.rows(), size)
+
+    def cancel(self):  # type: () -> None
+        """Stops the query. Called when its rows are no longer needed."""
+
+    def statistics(self):  # type: () -> Dict[Text, Any]
+        """Returns what the backend knows of the query: e.g. cache_hit, slot_millis, pages and their timings."""
+        return {"total_bytes_processed": self.total_bytes_processed}
+
+
+class Backend(object):
+    """Runs the queries of specs."""
+
+    def submit(self, query, params, dry_run=False, maximum_bytes_billed=None):
+        # type: (Text, List[bq.ScalarQueryParameter], bool, Optional[int]) -> Job
+        """Runs a query in standard SQL, or raises QueryError.
+
+        A dry run only resolves the fields and the bytes the query would process, its job has no rows.
+        """
+        raise NotImplementedError()
+
+    def read_table(self, table):  # type: (Text) -> Job
+        """Reads the rows of table, with a query of all of them unless the backend can read them directly."""
+        return self.submit(table_query(table), [])
+
+    def materialize(self, query, params, table, expiration, maximum_bytes_billed=None):
+        # type: (Text, List[bq.ScalarQueryParameter], Text, float, Optional[int]) -> Optional[Job]
+        """Writes the result of a query to table, expiring in expiration seconds, and returns its finished job.
+
+        If table already holds the result of the same query and params, and expires in more than
+        EXPIRATION_MARGIN seconds, it is kept and None is returned.
+        """
+        raise NotImplementedError()
+
+
+class BigQueryJob(Job):
+    """A BigQuery query job, whose result pages are read by page_readers threads at once if it is more than one."""
+
+    def __init__(self, query_job, page_readers=1, page_size=PAGE_SIZE):  # type: (Any, int, int) -> None
+        self.query_job = query_job
+        self.page_readers = page_readers  # type: int
+        self.page_size = page_size  # type: int
+        self.pages = 0  # type: int
+        self._rows = None  # type: Any
+
+    @property
+    def fields(self):  # type: () -> List[Text]
+        return [field.name for field in self.query_job.schema]
+
+    @property
+    def total_bytes_processed(self):  # type: () -> Optional[int]
+        return self.query_job.total_bytes_processed
+
+    def rows(self):  # type: () -> Iterator[tuple]
+        from google.cloud.exceptions import GoogleCloudError
+
+        try:
+            if self.page_readers > 1 and getattr(self.query_job, "total_rows", None) is not None:
+                for page in self._read_pages():
+                    for row in page:
+                        yield row
+                return
+            self._rows = self.query_job.rows
+            for row in self._rows:
+                yield row
+        except GoogleCloudError as e:
+            six.raise_from(_bigquery_error(e), e)
+
+    def _read_pages(self):  # type: () -> Iterator[List[tuple]]
+        pool = ThreadPool(self.page_readers)
+        try:
+            starts = range(0, self.query_job.total_rows, self.page_size)
+            for _, page in windowed(pool, self._read_page, starts, 2 * self.page_readers):
+                self.pages += 1
+                yield page
+        finally:
+            pool.terminate()
+
+    def _read_page(self, start):  # type: (int) -> List[tuple]
+        return list(self.query_job.fetch_data(max_results=self.page_size, start_index=start))
+
+    def cancel(self):  # type: () -> None
+        self.query_job.cancel()
+
+    def statistics(self):  # type: () -> Dict[Text, Any]
+        # the attributes differ between versions of google-cloud-bigquery, missing ones are left out.
+        statistics = super(BigQueryJob, self).statistics()
+        for name in ("cache_hit", "slot_millis"):
+            value = getattr(self.query_job, name, None)
+            if value is not None:
+                statistics[name] = value
+        pages = self.pages or getattr(self._rows, "page_number", None)
+        if pages:
+            statistics["pages"] = pages
+        created, started, ended = (getattr(self.query_job, name, None) for name in ("created", "started", "ended"))
+        if created is not None and started is not None:
+            statistics["queued_seconds"] = (started - created).total_seconds()
+        if started is not None and ended is not None:
+            statistics["running_seconds"] = (ended - started).total_seconds()
+        return statistics
+
+
+class BigQueryTableJob(Job):
+    """Reads the rows of a BigQuery table with tabledata.list, which runs no query and bills no bytes."""
+
+    total_bytes_processed = 0
+
+    def __init__(self, table):  # type: (bq.Table) -> None
+        self.table = table  # type: bq.Table
+        self._rows = None  # type: Any
+
+    @property
+    def fields(self):  # type: () -> List[Text]
+        return [field.name for field in self.table.schema]
+
+    def rows(self):  # type: () -> Iterator[tuple]
+        from google.cloud.exceptions import GoogleCloudError
+
+        try:
+            self._rows = self.table.fetch_data()
+            for row in self._rows:
+                yield row
+        except GoogleCloudError as e:
+            six.raise_from(_bigquery_error(e), e)
+
+    def statistics(self):  # type: () -> Dict[Text, Any]
+        statistics = super(BigQueryTableJob, self).statistics()
+        pages = getattr(self._rows, "page_number", None)
+        if pages:
+            statistics["pages"] = pages
+        return statistics
+
+
+class BigQueryBackend(Backend):
+    """Runs queries in BigQuery, with client or with a new default client per query.
+
+    Reading result pages in parallel, with more than one page_readers, needs a client which can be shared by
+    threads, such as a pooled_client.
+    """
+
+    def __init__(self, client=None, page_readers=1):  # type: (Optional[bq.Client], int) -> None
+        self.client = client  # type: Optional[bq.Client]
+        self.page_readers = page_readers  # type: int
+
+    def submit(self, query, params, dry_run=False, maximum_bytes_billed=None):
+        # type: (Text, List[bq.ScalarQueryParameter], bool, Optional[int]) -> Job
+        from google.cloud.exceptions import GoogleCloudError
+
+        query_job = self.connect().query(query)
+        query_job.use_legacy_sql = False
+        query_job.query_parameters = params
+        if dry_run:
+            query_job.dry_run = True
+        elif maximum_bytes_billed is not None:
+            query_job.maximum_bytes_billed = maximum_bytes_billed
+        try:
+            query_job.run()
+        except GoogleCloudError as e:
+            six.raise_from(_bigquery_error(e), e)
+        return BigQueryJob(query_job, self.page_readers)
+
+    def read_table(self, table):  # type: (Text) -> Job
+        from google.cloud.exceptions import GoogleCloudError
+
+        bq_table = self.table(table)
+        try:
+            bq_table.reload()
+        except GoogleCloudError as e:
+            six.raise_from(_bigquery_error(e), e)
+        return BigQueryTableJob(bq_table)
+
+    def materialize(self, query, params, table, expiration, maximum_bytes_billed=None):
+        # type: (Text, List[bq.ScalarQueryParameter], Text, float, Optional[int]) -> Optional[Job]
+        from google.cloud.exceptions import GoogleCloudError
+
+        description = result_description(query, params)
+        bq_table = self.table(table)
+        try:
+            if bq_table.exists():
+                bq_table.reload()
+                if bq_table.description == description and not _expires_soon(bq_table.expires):
+                    return None
+
+            query_job = self.connect().query(query)
+            query_job.use_legacy_sql = False
+            query_job.query_parameters = params
+            query_job.destination = bq_table
+            query_job.write_disposition = "WRITE_TRUNCATE"
+            query_job.allow_large_results = True
+            if maximum_bytes_billed is not None:
+                query_job.maximum_bytes_billed = maximum_bytes_billed
+            query_job.run()
+            expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=expiration)
+            bq_table.patch(description=description, expires=expires)
+        except GoogleCloudError as e:
+            six.raise_from(_bigquery_error(e), e)
+        return BigQueryJob(query_job)
+
+    def connect(self):  # type: () -> bq.Client
+        if self.client is not None:
+            return self.client
+        import google.cloud.bigquery as bq
+        return bq.Client()
+
+    def table(self, table):  # type: (Text) -> bq.Table
+        project, dataset, name = split_table(table)
+        return self.connect().dataset(dataset, project=project).table(name)
+
+
+def _expires_soon(expires):  # type: (Optional[datetime.datetime]) -> bool
+    if expires is None:
+        return False
+    if expires.tzinfo is not None:
+        expires = expires.replace(tzinfo=None) - expires.utcoffset()
+    return expires <= datetime.datetime.utcnow() + datetime.timedelta(seconds=EXPIRATION_MARGIN)
+
+
+def _bigquery_error(e):  # type: (GoogleCloudError) -> QueryError
+    from google.cloud.exceptions import BadRequest
+
+    if isinstance(e, BadRequest):
+        return InvalidQuery(str(e))
+    return QueryError(str(e))
+
+
+class LocalJob(Job):
+    def __init__(self, cursor, lock):  # type: (sqlite3.Cursor, threading.Lock) -> None
+        self.cursor = cursor  # type: sqlite3.Cursor
+        self.fields = [column[0] for column in cursor.description]  # type: List[Text]
+        self.pages = 0  # type: int
+        self._lock = lock
+
+    def batches(self, size=BATCH_SIZE):  # type: (int) -> Iterator[List[tuple]]
+        while True:
+            with self._lock:
+                try:
+                    batch = self.cursor.fetchmany(size)
+                except sqlite3.Error as e:
+                    six.raise_from(QueryError(str(e)), e)
+            if not batch:
+                return
+            self.pages += 1
+            yield batch
+
+    def rows(self):  # type: () -> Iterator[tuple]
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def cancel(self):  # type: () -> None
+        with self._lock:
+            self.cursor.close()
+
+    def statistics(self):  # type: () -> Dict[Text, Any]
+        return {"pages": self.pages}
+
+
+class LocalBackend(Backend):
+    """Runs queries in an in-process SQLite database, with tables loaded from fixture files.
+
+    Every ``<table>.jsonl`` (a JSON object per line) and ``<table>.csv`` (with a header) in fixtures_dir is
+    loaded as a table named after the file, so ``project.dataset.events.jsonl`` is the table the queries refer
+    to as ```project.dataset.events```. BigQuery string literals, comments and type names are rewritten for
+    SQLite, everything else runs with SQLite semantics. Byte limits do not apply.
+    """
+
+    def __init__(self, fixtures_dir):  # type: (Text) -> None
+        self.fixtures_dir = fixtures_dir  # type: Text
+        self._connection = None  # type: Optional[sqlite3.Connection]
+        # the connection is shared by the threads running specs, one statement at a time.
+        self._lock = threading.Lock()
+        # the description and the expiration time of each table written by materialize.
+        self._materialized = {}  # type: Dict[Text, Tuple[Text, float]]
+
+    def connect(self):  # type: () -> sqlite3.Connection
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(":memory:", check_same_thread=False)
+                connection.create_aggregate("COUNTIF", 1, _CountIf)
+                for filename in sorted(os.listdir(self.fixtures_dir)):
+                    table, ext = os.path.splitext(filename)
+                    if ext in LOADERS:
+                        _create_table(connection, table, LOADERS[ext](os.path.join(self.fixtures_dir, filename)))
+                self._connection = connection
+            return self._connection
+
+    def submit(self, query, params, dry_run=False, maximum_bytes_billed=None):
+        # type: (Text, List[bq.ScalarQueryParameter], bool, Optional[int]) -> Job
+        connection = self.connect()
+        query = to_sqlite(query)
+        if dry_run:
+            # resolves the fields without reading any row.
+            query = "SELECT * FROM (\n{}\n) LIMIT 0".format(query.strip().rstrip(";"))
+        values = {param_name(param): _param_value(param.value) for param in params}
+        with self._lock:
+            try:
+                cursor = connection.execute(query, values)
+            except sqlite3.Error as e:
+                six.raise_from(InvalidQuery(str(e)), e)
+        return LocalJob(cursor, self._lock)
+
+    def materialize(self, query, params, table, expiration, maximum_bytes_billed=None):
+        # type: (Text, List[bq.ScalarQueryParameter], Text, float, Optional[int]) -> Optional[Job]
+        connection = self.connect()
+        description = result_description(query, params)
+        values = {param_name(param): _param_value(param.value) for param in params}
+        with self._lock:
+            materialized = self._materialized.get(table)
+            if materialized is not None and materialized[0] == description and \
+                    materialized[1] > time.time() + EXPIRATION_MARGIN:
+                return None
+            try:
+                connection.execute("DROP TABLE IF EXISTS {}".format(_quote(table)))
+                connection.execute("CREATE TABLE {} AS {}".format(_quote(table), to_sqlite(query)), values)
+            except sqlite3.Error as e:
+                six.raise_from(InvalidQuery(str(e)), e)
+            self._materialized[table] = (description, time.time() + expiration)
+        return Job()
+
+
+class _CountIf(object):
+    def __init__(self):
+        self.count = 0
+
+    def step(self, value):
+        if value:
+            self.count += 1
+
+    def finalize(self):
+        return self.count
+
+
+def _load_jsonl(path):  # type: (Text) -> List[Dict[Text, Any]]
+    with io.open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _load_csv(path):  # type: (Text) -> List[Dict[Text, Any]]
+    with io.open(path, encoding="utf-8", newline="") as f:
+        return [{column: _csv_value(value) for column, value in row.items()} for row in csv.DictReader(f)]
+
+
+LOADERS = {".jsonl": _load_jsonl, ".csv": _load_csv}
+
+
+def _csv_value(value):  # type: (Text) -> Any
+    if value == "":
+        return None
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _create_table(connection, table, rows):  # type: (sqlite3.Connection, Text, List[Dict[Text, Any]]) -> None
+    columns = []  # type: List[Text]
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    if not columns:
+        return
+    connection.execute("CREATE TABLE {} ({})".format(_quote(table), ", ".join(_quote(column) for column in columns)))
+    connection.executemany(
+        "INSERT INTO {} VALUES ({})".format(_quote(table), ", ".join("?" * len(columns))),
+        [[_sqlite_value(row.get(column)) for column in columns] for row in rows],
+    )
+
+
+def _quote(name):  # type: (Text) -> Text
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _sqlite_value(value):  # type: (Any) -> Any
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def param_name(param):  # type: (bq.ScalarQueryParameter) -> Text
+    name = param.name
+    return name.decode("latin-1") if isinstance(name, bytes) else name
+
+
+def is_table(table):  # type: (Text) -> bool
+    return TABLE.match(table) is not None
+
+
+def split_table(table):  # type: (Text) -> Tuple[Optional[Text], Text, Text]
+    """Splits project.dataset.table, or dataset.table, into the project, None if omitted, dataset and table."""
+    parts = table.rsplit(".", 2)
+    if len(parts) == 2:
+        return None, parts[0], parts[1]
+    return parts[0], parts[1], parts[2]
+
+
+def table_query(table):  # type: (Text) -> Text
+    return "SELECT * FROM `{}`".format(table)
+
+
+def result_digest(query, params):  # type: (Text, List[bq.ScalarQueryParameter]) -> Text
+    """The SHA-256 of query and its params, identifying their result."""
+    h = hashlib.sha256(query.encode("utf-8"))
+    for param in params:
+        h.update(json.dumps(param.to_api_repr(), sort_keys=True, default=repr).encode("utf-8"))
+    return h.hexdigest()
+
+
+def result_description(query, params):  # type: (Text, List[bq.ScalarQueryParameter]) -> Text
+    """Describes a table holding the result of query with params, so that it is only reused for them."""
+    return "bqspec result {}".format(result_digest(query, params))
+
+
+def _param_value(value):  # type: (Any) -> Any
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+# string literals, quoted identifiers and comments, which are rewritten or kept as a whole.
+TOKEN = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`|--[^\n]*|#[^\n]*|/\*.*?\*/)""", re.S)
+_ESCAPE = re.compile(r"\\(.)", re.S)
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+_TYPE = re.compile(r"\b(STRING|INT64|FLOAT64|BOOL)\b", re.I)
+TYPES = {"STRING": "TEXT", "INT64": "INTEGER", "FLOAT64": "REAL", "BOOL": "INTEGER"}
+
+
+def to_sqlite(query):  # type: (Text) -> Text
+    """Rewrites the string literals, comments and type names of a BigQuery query to their SQLite forms."""
+    parts = []  # type: List[Text]
+    for i, part in enumerate(TOKEN.split(query)):
+        if i % 2 == 0:
+            parts.append(_TYPE.sub(lambda m: TYPES[m.group(1).upper()], part))
+        elif part[0] in "'\"":
+            value = _ESCAPE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), part[1:-1])
+            parts.append("'{}'".format(value.replace("'", "''")))
+        elif part[0] == "#":
+            parts.append("--" + part[1:])
+        else:
+            parts.append(part)
+    return "".join(parts)
+
+
+if TYPE_CHECKING:
+    # what specs take to run their queries with: a backend, or a BigQuery client.
+    Client = Union[Backend, bq.Client]
+
+
+def as_backend(client):  # type: (Optional[Client]) -> Backend
+    if isinstance(client, Backend):
+        return client
+    return BigQueryBackend(client)
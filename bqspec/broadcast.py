@@ -0,0 +1,121 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import itertools
+import sys
+import threading
+from typing import Any, Iterable, Iterator, List
+
+import six
+from six.moves import queue
+
+# rows are passed in chunks, to keep the locking off the per row path.
+CHUNK_SIZE = 1000
+# chunks each stream may hold before the slowest stream makes the others wait.
+MAX_CHUNKS = 8
+
+_END = object()
+
+
+class _Error(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class Broadcast(object):
+    """Streams the rows of one iterator to several consumers, each iterating its own stream in its own thread.
+
+    Every stream holds at most MAX_CHUNKS chunks, so the rows in memory do not grow with the result. A stream
+    which is closed no longer receives rows, and once every stream is closed the source is closed too.
+    """
+
+    def __init__(self, rows, n, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        # type: (Iterable[tuple], int, int, int) -> None
+        self.rows = rows  # type: Iterable[tuple]
+        self.chunk_size = chunk_size  # type: int
+        self.streams = [Stream(max_chunks) for _ in range(n)]  # type: List[Stream]
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+
+    def start(self):  # type: () -> List[Stream]
+        self._thread.start()
+        return self.streams
+
+    def _produce(self):  # type: () -> None
+        end = _END  # type: Any
+        try:
+            it = iter(self.rows)
+            while not all(stream.closed.is_set() for stream in self.streams):
+                chunk = list(itertools.islice(it, self.chunk_size))
+                if not chunk:
+                    break
+                self.put(chunk)
+        except BaseException:
+            end = _Error(sys.exc_info())
+        finally:
+            # cancels the query job if no stream needs the rest of the rows.
+            close = getattr(self.rows, "close", None)
+            if close is not None:
+                close()
+        for stream in self.streams:
+            stream.put(end)
+
+    def put(self, chunk):  # type: (List[tuple]) -> None
+        for stream in self.streams:
+            stream.put(chunk)
+
+
+class Partition(Broadcast):
+    """Streams the rows of one iterator to several consumers, each row to the stream at the index it starts with.
+
+    The rows are streamed without their first value.
+    """
+
+    def put(self, chunk):  # type: (List[tuple]) -> None
+        parts = [[] for _ in self.streams]  # type: List[List[tuple]]
+        for row in chunk:
+            parts[row[0]].append(tuple(row)[1:])
+        for stream, part in zip(self.streams, parts):
+            if part:
+                stream.put(part)
+
+
+class Stream(object):
+    """One consumer's iterator over the rows of a Broadcast."""
+
+    def __init__(self, max_chunks):  # type: (int) -> None
+        self.queue = queue.Queue(max_chunks)  # type: queue.Queue
+        self.closed = threading.Event()
+        self._chunk = iter(())  # type: Iterator[tuple]
+
+    def __iter__(self):  # type: () -> Stream
+        return self
+
+    def __next__(self):  # type: () -> tuple
+        while True:
+            for row in self._chunk:
+                return row
+            if self.closed.is_set():
+                raise StopIteration()
+            chunk = self.queue.get()
+            if chunk is _END:
+                self.closed.set()
+                raise StopIteration()
+            if isinstance(chunk, _Error):
+                self.closed.set()
+                six.reraise(*chunk.exc_info)
+            self._chunk = iter(chunk)
+
+    next = __next__
+
+    def put(self, chunk):  # type: (Any) -> None
+        while not self.closed.is_set():
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):  # type: () -> None
+        self.closed.set()
+        self._chunk = iter(())
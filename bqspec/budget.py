@@ -0,0 +1,25 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import threading
+
+
+class Budget(object):
+    """Bytes the queries of a run may process, shared by the specs running concurrently."""
+
+    def __init__(self, limit):  # type: (int) -> None
+        self.limit = limit  # type: int
+        self.used = 0  # type: int
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):  # type: () -> int
+        return self.limit - self.used
+
+    def reserve(self, size):  # type: (int) -> bool
+        """Takes size bytes from the budget, or returns False if not enough are left."""
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
@@ -0,0 +1,197 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import decimal
+import gzip
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+import six
+
+SUFFIX = ".jsonl.gz"
+# entries written as pickles by earlier versions. They are listed and pruned, but never read.
+PICKLE_SUFFIX = ".rows.gz"
+
+
+class CacheMissError(Exception):
+    def __init__(self, key):  # type: (Text) -> None
+        super(CacheMissError, self).__init__("query result is not cached: {}".format(key))
+        self.key = key  # type: Text
+
+
+class CacheEntry(object):
+    def __init__(self, key, path, size, last_used):  # type: (Text, Text, int, float) -> None
+        self.key = key  # type: Text
+        self.path = path  # type: Text
+        self.size = size  # type: int
+        self.last_used = last_used  # type: float
+
+
+class ResultCache(object):
+    """On-disk store of query results.
+
+    Each entry is a gzip compressed file of JSON lines: the field names followed by one array per row, so entries
+    are written and replayed without holding the whole result in memory. Values JSON has no type for, such as
+    dates and bytes, are written as objects tagged with their type, see _encode. Unlike pickles, reading an entry
+    can not run code, so the cache directory may be shared, e.g. by CI jobs.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, token=None, offline=False):
+        # type: (Text, Optional[int], Optional[Text], bool) -> None
+        self.cache_dir = cache_dir  # type: Text
+        self.max_bytes = max_bytes  # type: Optional[int]
+        self.token = token  # type: Optional[Text]
+        self.offline = offline  # type: bool
+
+    def key(self, query, params):  # type: (Text, List[Any]) -> Text
+        h = hashlib.sha256()
+        h.update(query.encode("utf-8"))
+        for param in params:
+            h.update(b"\0")
+            h.update(json.dumps(param.to_api_repr(), sort_keys=True, default=repr).encode("utf-8"))
+        if self.token is not None:
+            h.update(b"\0\0")
+            h.update(self.token.encode("utf-8"))
+        return h.hexdigest()
+
+    def path(self, key):  # type: (Text) -> Text
+        return os.path.join(self.cache_dir, key + SUFFIX)
+
+    def load(self, key):  # type: (Text) -> Optional[Tuple[List[Text], Iterator[tuple]]]
+        path = self.path(key)
+        try:
+            f = gzip.open(path, "rb")
+        except IOError:
+            return None
+        os.utime(path, None)
+        fields = _decode(f.readline())
+        return fields, _replay(f)
+
+    def store(self, key, fields, rows):  # type: (Text, List[Text], Iterable[tuple]) -> Iterator[tuple]
+        """Passes rows through, writing them to the cache. The entry is committed once rows are exhausted."""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self.path(key)
+        # unique per entry being written: threads of a run may miss the same key at once.
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path) + ".", dir=self.cache_dir)
+        os.close(fd)
+        with gzip.open(tmp_path, "wb") as f:
+            try:
+                f.write(_encode(fields))
+                for row in rows:
+                    f.write(_encode(row))
+                    yield row
+            except BaseException:
+                f.close()
+                os.remove(tmp_path)
+                # an abandoned entry abandons the rows it was reading, too.
+                close = getattr(rows, "close", None)
+                if close is not None:
+                    close()
+                raise
+        os.rename(tmp_path, path)
+        if self.max_bytes is not None:
+            self.prune(self.max_bytes)
+
+    def entries(self):  # type: () -> List[CacheEntry]
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            suffix = next((suffix for suffix in (SUFFIX, PICKLE_SUFFIX) if filename.endswith(suffix)), None)
+            if suffix is None:
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            stat = os.stat(path)
+            entries.append(CacheEntry(filename[:-len(suffix)], path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry.last_used, reverse=True)
+        return entries
+
+    def prune(self, max_bytes=None, max_age=None):  # type: (Optional[int], Optional[float]) -> List[CacheEntry]
+        """Removes entries unused for max_age seconds and the least recently used ones beyond max_bytes."""
+        now = time.time()
+        total = 0
+        removed = []
+        for entry in self.entries():
+            too_large = max_bytes is not None and total + entry.size > max_bytes
+            too_old = max_age is not None and now - entry.last_used > max_age
+            if too_large or too_old:
+                os.remove(entry.path)
+                removed.append(entry)
+            else:
+                total += entry.size
+        return removed
+
+
+def _replay(f):  # type: (Any) -> Iterator[tuple]
+    with f:
+        for line in f:
+            yield tuple(_decode(line))
+
+
+class _Offset(datetime.tzinfo):
+    """The fixed UTC offset of a replayed TIMESTAMP."""
+
+    def __init__(self, seconds):  # type: (int) -> None
+        self.offset = datetime.timedelta(seconds=seconds)
+
+    def utcoffset(self, dt):  # type: (Any) -> datetime.timedelta
+        return self.offset
+
+    def dst(self, dt):  # type: (Any) -> datetime.timedelta
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):  # type: (Any) -> Text
+        return "UTC" if not self.offset else "UTC{:+}s".format(int(self.offset.total_seconds()))
+
+
+def _tag(value):  # type: (Any) -> Dict[Text, Any]
+    """Writes a value JSON has no type for as an object with one key, its type after a "$". BigQuery field names
+    can not start with "$", so the objects of STRUCT values are never taken for a tag.
+    """
+    if isinstance(value, datetime.datetime):
+        offset = value.utcoffset()
+        return {"$datetime": [value.year, value.month, value.day, value.hour, value.minute, value.second,
+                              value.microsecond, int(offset.total_seconds()) if offset is not None else None]}
+    if isinstance(value, datetime.date):
+        return {"$date": [value.year, value.month, value.day]}
+    if isinstance(value, datetime.time):
+        return {"$time": [value.hour, value.minute, value.second, value.microsecond]}
+    if isinstance(value, decimal.Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, six.binary_type):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    raise TypeError("{!r} can not be cached".format(value))
+
+
+def _untag(obj):  # type: (Dict[Text, Any]) -> Any
+    if len(obj) != 1:
+        return obj
+    (tag, value), = obj.items()
+    if tag == "$datetime":
+        offset = value[7]
+        return datetime.datetime(*value[:7], tzinfo=_Offset(offset) if offset is not None else None)
+    if tag == "$date":
+        return datetime.date(*value)
+    if tag == "$time":
+        return datetime.time(*value)
+    if tag == "$decimal":
+        return decimal.Decimal(value)
+    if tag == "$bytes":
+        return base64.b64decode(value)
+    return obj
+
+
+def _encode(value):  # type: (Any) -> bytes
+    return (json.dumps(value, default=_tag) + "\n").encode("utf-8")
+
+
+def _decode(line):  # type: (bytes) -> Any
+    return json.loads(line.decode("utf-8"), object_hook=_untag)
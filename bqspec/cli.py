@@ -1,16 +1,55 @@
 # coding: utf-8
+import datetime
+import functools
+import io
+import json
 import os
 import os.path
 import sys
-from typing import List, Text, Tuple
+import time
+from importlib import import_module
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Text, Tuple
 
 import click
 
+from bqspec.backend import BigQueryBackend, LocalBackend, QueryError, as_backend
+from bqspec.broadcast import Broadcast, Partition
+from bqspec.budget import Budget
+from bqspec.cache import CacheMissError, ResultCache
+from bqspec.client import pooled_client
+from bqspec.destination import DestinationDataset
 from bqspec.error import SpecError
-from bqspec.loader import load_yaml
-from bqspec.rstruct import RawSpec
-from bqspec.spec import from_struct
-from bqspec.validator import validate_schema, validate_values
+from bqspec.failures import FIRST, RESERVOIR, failed_rows, total
+from bqspec.matrix import SETS_PER_QUERY, describe
+from bqspec.profile import JsonLinesHook, Profile, ProfilingBackend, add_hook, run_hooks
+from bqspec.rcpath import resource_val
+from bqspec.reporter import REPORTERS, JsonLinesReporter, Verified
+from bqspec.sample import CONFIDENCE, Sample, upper_bound
+from bqspec.shard import Cost, MeteredBackend, Timings, assign
+from bqspec.speccache import SpecCache, validate_spec
+from bqspec.spec import Spec, from_struct
+from bqspec.state import State, spec_digest
+from bqspec.vectorized import available as vectorized_available
+
+if TYPE_CHECKING:
+    from bqspec.backend import Client
+    from bqspec.broadcast import Stream
+    from bqspec.reporter import Reporter
+    from bqspec.rstruct import RawSpec
+    from bqspec.spec import Failure, Results
+
+Group = List[Tuple[Text, Optional[Spec], List[SpecError]]]
+# the results of specs, with their paths.
+VerifiedPaths = List[Tuple[Text, Verified]]
+# the results of specs, with the cost of each path.
+Measured = Tuple[VerifiedPaths, Dict[Text, Cost]]
+
+# dry runs are cheap, so they run concurrently even without --jobs.
+DRY_RUN_JOBS = 8
+# seconds between checks of the spec files in --watch.
+WATCH_INTERVAL = 1.0
 
 
 def report_error(path, errors):  # type: (Text, List[SpecError]) -> None
@@ -19,33 +58,455 @@ def report_error(path, errors):  # type: (Text, List[SpecError]) -> None
         click.echo("    {} {}: {}".format(error.error_type, ">".join(error.resource_path), error.message))
 
 
-def run(path):  # type: (Text) -> bool
-    with click.open_file(path, encoding="utf-8") as f:
-        obj = load_yaml(f)
-
-    errors = validate_schema(obj)
+def load(
+        path,  # type: Text
+        sample=None,  # type: Optional[Sample]
+        spec_cache=None,  # type: Optional[SpecCache]
+        destinations=None,  # type: Optional[DestinationDataset]
+):  # type: (...) -> Tuple[Optional[Spec], List[SpecError]]
+    """Loads a spec. sample, if given, replaces the spec's own sample. With destinations, the result of the
+    spec's query is materialized to its table in their dataset.
+    """
+    raw_spec, errors = validate(path, spec_cache)
     if errors:
+        return None, errors
+    spec = from_struct(raw_spec)
+    if sample is not None:
+        spec.sample = sample
+    if destinations is not None:
+        spec.destination = destinations.destination(spec)
+    return spec, []
+
+
+def validate(path, spec_cache=None):
+    # type: (Text, Optional[SpecCache]) -> Tuple[Optional[RawSpec], List[SpecError]]
+    return validate_spec(path, spec_cache)
+
+
+def report_all(verified, state=None, reporter=None):
+    # type: (VerifiedPaths, Optional[State], Optional[Reporter]) -> bool
+    """Reports verified specs, recording in state whether all the results of each path passed."""
+    failed = {}  # type: Dict[Text, bool]
+    for path, result in verified:
+        failed[path] = report_verified(path, result, reporter=reporter) or failed.get(path, False)
+    if state is not None:
+        for path, path_failed in failed.items():
+            state.record(path, not path_failed)
+    return any(failed.values())
+
+
+def report_verified(path, verified, reporter=None):
+    # type: (Text, Verified, Optional[Reporter]) -> bool
+    """Reports a verified spec, as text or with reporter. With several results for a path, e.g. of a matrix,
+    use report_all.
+    """
+    spec, errors, results, aggregates = verified
+    if reporter is not None:
+        failed = reporter.verified(path, verified)
+        if spec is not None and spec.profile is not None:
+            run_hooks(path, spec.profile)
+    elif errors:
         report_error(path, errors)
-        return True
+        failed = True
+    else:
+        failed = report(spec, results, aggregates)
+        if spec.profile is not None:
+            run_hooks(path, spec.profile)
+    return failed
+
+
+def verify_spec(spec, client=None, progress=True, max_bytes_billed=None, budget=None, profile=False, **options):
+    # type: (Spec, Optional[Client], bool, Optional[int], Optional[Budget], bool, **Any) -> Verified
+    """Verifies a spec and its aggregates. options are passed through to Spec.verify.
+
+    A spec whose dry runs exceed max_bytes_billed, or the bytes left in budget, is not run.
+    With profile, its queries and conditions are recorded in spec.profile.
+    """
+    if not profile:
+        return _verify_spec(spec, client, progress, max_bytes_billed, budget, **options)
+    start = default_timer()
+    options["profile"] = Profile()
+    try:
+        return _verify_spec(spec, ProfilingBackend(as_backend(client), options["profile"]), progress,
+                            max_bytes_billed, budget, **options)
+    finally:
+        options["profile"].seconds = default_timer() - start
+
+
+def _verify_spec(spec, client, progress, max_bytes_billed, budget, **options):
+    # type: (Spec, Optional[Client], bool, Optional[int], Optional[Budget], **Any) -> Verified
+    cache = options.get("cache")
+    if (max_bytes_billed is not None or budget is not None) and not (cache is not None and cache.offline):
+        # Spec.verify does not project the rows of failures it passes on.
+        projection = options.get("projection", False) and options.get("on_failure") is None
+        errors = check_budget([spec], client, max_bytes_billed, budget, options.get("pushdown", False), projection)
+        if errors:
+            return None, errors, ([], []), []
+        spec.max_bytes_billed = max_bytes_billed
+
+    try:
+        aggregates = spec.verify_aggregates(client, cache)
+        return spec, [], spec.verify(client, progress=progress, **options), aggregates
+    except CacheMissError as e:
+        return None, [cache_miss_error(e)], ([], []), []
+    except QueryError as e:
+        # e.g. a job which would bill more than max_bytes_billed.
+        return None, [query_error(e)], ([], []), []
+
+
+def verify_group(group, client=None, progress=True, max_bytes_billed=None, budget=None, reporter=None, **options):
+    # type: (Group, Optional[Client], bool, Optional[int], Optional[Budget], Optional[Reporter], **Any) -> VerifiedPaths
+    """Verifies loaded specs with the same query. The query runs once, and its rows stream to every spec.
+
+    With reporter, the failures of each spec are passed to it as they are found.
+    """
+    if len(group) == 1:
+        path, spec, errors = group[0]
+        if errors:
+            return [(path, (None, errors, ([], []), []))]
+        if spec.matrix:
+            return verify_matrix(path, spec, client, max_bytes_billed, budget, reporter=reporter, **options)
+        return [(path, verify_spec(spec, client, progress, max_bytes_billed, budget,
+                                   on_failure=on_failure(reporter, path, spec), **options))]
+
+    verified = {}  # type: Dict[Text, Verified]
+    sharing = [(path, spec) for path, spec, _ in group]  # type: List[Tuple[Text, Spec]]
+    cache = options.get("cache")
+    if (max_bytes_billed is not None or budget is not None) and not (cache is not None and cache.offline):
+        # the specs share the query of their rows, whose bytes are reserved once.
+        errors = check_budget([spec for _, spec in sharing], client, max_bytes_billed, budget)
+        if errors:
+            return [(path, (None, errors, ([], []), [])) for path, _, _ in group]
+        for _, spec in sharing:
+            spec.max_bytes_billed = max_bytes_billed
+
+    try:
+        fields, rows = sharing[0][1].fetch(client, cache)
+    except CacheMissError as e:
+        errors = [cache_miss_error(e)]
+    except QueryError as e:
+        errors = [query_error(e)]
+    else:
+        errors = []
+        streams = Broadcast(rows, len(sharing)).start()
+
+        def verify_stream(args):  # type: (Tuple[Text, Spec, Stream]) -> Verified
+            path, spec, stream = args
+            return verify_spec(spec, client, False, fetched=(fields, stream),
+                               on_failure=on_failure(reporter, path, spec), **options)
+
+        pool = ThreadPool(len(sharing))
+        try:
+            shared = pool.map(verify_stream, [(path, spec, stream) for (path, spec), stream in zip(sharing, streams)])
+        finally:
+            for stream in streams:
+                stream.close()
+            pool.terminate()
+        for (path, _), result in zip(sharing, shared):
+            verified[path] = result
 
-    raw_spec = RawSpec(**obj)
-    errors = validate_values(raw_spec)
     if errors:
-        report_error(path, errors)
-        return True
+        for path, _ in sharing:
+            verified[path] = (None, errors, ([], []), [])
+
+    return [(path, verified[path]) for path, _, _ in group]
+
+
+def verify_matrix(path, spec, client=None, max_bytes_billed=None, budget=None, profile=False, **options):
+    # type: (Text, Spec, Optional[Client], Optional[int], Optional[Budget], bool, **Any) -> VerifiedPaths
+    """Verifies a spec for every combination of its parameter matrix, returning the results of each combination.
+
+    One query runs SETS_PER_QUERY combinations, and its rows stream to the spec of their combination, like the
+    rows of a group. options are passed through to Spec.verify, without pushdown and projection, and the failures
+    of every combination are passed to the reporter in options as they are found.
+    """
+    cache = options.get("cache")
+    if (max_bytes_billed is not None or budget is not None) and not (cache is not None and cache.offline):
+        errors = check_budget([spec], client, max_bytes_billed, budget)
+        if errors:
+            return [(path, (None, errors, ([], []), []))]
+        spec.max_bytes_billed = max_bytes_billed
+
+    options.pop("pushdown", None)
+    options.pop("projection", None)
+    reporter = options.pop("reporter", None)  # type: Optional[Reporter]
+    specs = spec.expand()
+    results = [([], []) for _ in specs]  # type: List[Results]
+
+    def verify_stream(args):  # type: (Tuple[Spec, Stream, List[Text]]) -> Results
+        combination, stream, fields = args
+        start = default_timer()
+        try:
+            return combination.verify(client, progress=False, fetched=(fields, stream),
+                                      profile=Profile() if profile else None,
+                                      on_failure=on_failure(reporter, path, combination), **options)
+        finally:
+            if combination.profile is not None:
+                combination.profile.seconds = default_timer() - start
+
+    try:
+        aggregates = spec.verify_matrix_aggregates(client, cache)
+        if spec.invariants or spec.cases or spec.columns:
+            queries = spec.matrix_queries(spec.row_query())
+            for start, (query, params) in zip(range(0, len(specs), SETS_PER_QUERY), queries):
+                fields, rows = spec.fetch(client, cache, query, params)
+                chunk = specs[start:start + SETS_PER_QUERY]
+                streams = Partition(rows, len(chunk)).start()
+                pool = ThreadPool(len(chunk))
+                try:
+                    args = [(combination, stream, fields[1:]) for combination, stream in zip(chunk, streams)]
+                    results[start:start + len(chunk)] = pool.map(verify_stream, args)
+                finally:
+                    for stream in streams:
+                        stream.close()
+                    pool.terminate()
+    except CacheMissError as e:
+        return [(path, (None, [cache_miss_error(e)], ([], []), []))]
+    except QueryError as e:
+        return [(path, (None, [query_error(e)], ([], []), []))]
+
+    return [(path, (combination, [], result, failures))
+            for combination, result, failures in zip(specs, results, aggregates)]
+
+
+def on_failure(reporter, path, spec):
+    # type: (Optional[Reporter], Text, Spec) -> Optional[Callable[[Optional[int], Failure], None]]
+    if reporter is None:
+        return None
+    return functools.partial(reporter.failure, path, spec)
+
+
+def group_specs(paths, share=True, sample=None, spec_cache=None, destinations=None):
+    # type: (List[Text], bool, Optional[Sample], Optional[SpecCache], Optional[DestinationDataset]) -> List[Group]
+    """Loads the specs at paths, grouping the specs with the same query and params if share."""
+    groups = []  # type: List[Group]
+    by_query = {}  # type: Dict[Tuple[Text, Tuple[Text, ...]], Group]
+    for path in paths:
+        spec, errors = load(path, sample, spec_cache, destinations)
+        if not share or spec is None or spec.matrix or not (spec.invariants or spec.cases):
+            groups.append([(path, spec, errors)])
+            continue
+        key = spec.query_key()
+        if key in by_query:
+            by_query[key].append((path, spec, errors))
+        else:
+            by_query[key] = [(path, spec, errors)]
+            groups.append(by_query[key])
+    if spec_cache is not None:
+        spec_cache.save()
+    return groups
+
+
+def cache_miss_error(e):  # type: (CacheMissError) -> SpecError
+    return SpecError("CacheMissError", str(e), ["query_path", resource_val])
+
+
+def check_budget(specs, client, max_bytes_billed, budget, pushdown=False, projection=False):
+    # type: (List[Spec], Optional[Client], Optional[int], Optional[Budget], bool, bool) -> List[SpecError]
+    """Estimates the bytes specs with the same query would process, counting the query of their rows once.
+    pushdown and projection are those the specs are verified with, see Spec.estimate.
+    """
+    try:
+        estimated = sum(spec.estimate(client, i == 0, pushdown, projection) for i, spec in enumerate(specs))
+    except QueryError as e:
+        return [query_error(e)]
+
+    if max_bytes_billed is not None and estimated > max_bytes_billed:
+        message = "would process {} bytes, over the limit of {} bytes".format(estimated, max_bytes_billed)
+        return [SpecError("BudgetError", message, ["query_path", resource_val])]
+    if budget is not None and not budget.reserve(estimated):
+        message = "skipped, would process {} bytes, {} bytes are left in the budget".format(estimated, budget.remaining)
+        return [SpecError("BudgetError", message, ["query_path", resource_val])]
+    return []
+
+
+def query_error(e):  # type: (QueryError) -> SpecError
+    return SpecError("QueryError", str(e), ["query_path", resource_val])
+
+
+def estimate(path, client=None, sample=None, pushdown=False, projection=False):
+    # type: (Text, Optional[Client], Optional[Sample], bool, bool) -> Tuple[List[SpecError], Optional[int]]
+    spec, errors = load(path, sample)
+    if errors:
+        return errors, None
+
+    try:
+        return [], spec.estimate(client, pushdown=pushdown, projection=projection)
+    except QueryError as e:
+        return [query_error(e)], None
+
+
+def report_estimates(paths, jobs, client=None, sample=None, pushdown=False, projection=False):
+    # type: (List[Text], int, Optional[Client], Optional[Sample], bool, bool) -> bool
+    """Reports the bytes the specs would process, sampled, pushed down and projected as they would run.
+    Only dry run jobs are submitted, so nothing is billed.
+    """
+    pool = ThreadPool(jobs)
+    try:
+        failed = False
+        estimated_total = 0
+        worker = functools.partial(estimate, client=client if client is not None else pooled_client(), sample=sample,
+                                   pushdown=pushdown, projection=projection)
+        for path, (errors, estimated) in zip(paths, pool.imap(worker, paths)):
+            if errors:
+                report_error(path, errors)
+                failed = True
+                continue
+            estimated_total += estimated
+            click.echo("{}: {} bytes".format(path, estimated))
+        click.echo("total: {} bytes".format(estimated_total))
+        return failed
+    finally:
+        pool.terminate()
+
+
+def measure_group(group, client=None, **options):
+    # type: (Group, Optional[Client], **Any) -> Tuple[VerifiedPaths, Dict[Text, Cost]]
+    """Same as verify_group, also returning the cost of each path. Specs sharing a query share its cost."""
+    meter = MeteredBackend(as_backend(client))
+    start = default_timer()
+    verified = verify_group(group, meter, **options)
+    seconds = (default_timer() - start) / len(group)
+    bytes_processed = meter.bytes_processed // len(group)
+    return verified, {path: Cost(seconds, bytes_processed) for path, _, _ in group}
+
+
+def report_group(measured, state=None, reporter=None, timings=None):
+    # type: (Tuple[VerifiedPaths, Dict[Text, Cost]], Optional[State], Optional[Reporter], Optional[Timings]) -> bool
+    """Reports a group measured by measure_group, recording the cost of each path in timings."""
+    verified, costs = measured
+    for path, cost in sorted(costs.items()):
+        if timings is not None:
+            timings.record(path, cost)
+        if reporter is not None:
+            reporter.timing(path, cost)
+    return report_all(verified, state, reporter)
+
+
+def in_order(paths, measured):
+    # type: (List[Text], Iterable[Measured]) -> Iterator[Measured]
+    """Splits groups measured by measure_group per path, yielding each path once the paths before it in paths
+    were, so that specs sharing a query are reported in the same order as when they run one by one.
+    """
+    done = {}  # type: Dict[Text, Measured]
+    position = 0
+    for verified, costs in measured:
+        for path, cost in costs.items():
+            done[path] = ([(p, result) for p, result in verified if p == path], {path: cost})
+        while position < len(paths) and paths[position] in done:
+            yield done.pop(paths[position])
+            position += 1
+    for path in paths[position:]:
+        if path in done:
+            yield done.pop(path)
+
+
+def run_concurrently(paths, groups, jobs, state=None, timings=None, **options):
+    # type: (List[Text], List[Group], int, Optional[State], Optional[Timings], **Any) -> bool
+    cache = options.get("cache")
+    client = options.pop("client", None)
+    if client is None and not (cache is not None and cache.offline):
+        client = pooled_client()
+    pool = ThreadPool(jobs)
+    try:
+        failed = False
+        worker = functools.partial(measure_group, client=client, progress=False, **options)
+        for measured in in_order(paths, pool.imap(worker, groups)):
+            if report_group(measured, state, options.get("reporter"), timings):
+                failed = True
+        return failed
+    finally:
+        pool.terminate()
 
-    spec = from_struct(raw_spec)
+
+def run_all(paths, jobs=1, dry_run=False, run_max_bytes_billed=None, state=None, timings=None, **options):
+    # type: (List[Text], int, bool, Optional[int], Optional[State], Optional[Timings], **Any) -> bool
+    """Runs the specs at paths as one run, recording in state whether each of them passed, and in timings the
+    cost of each of them.
+    """
+    if dry_run:
+        return report_estimates(paths, max(jobs, DRY_RUN_JOBS), options.get("client"), options.get("sample"),
+                                options.get("pushdown", False), options.get("projection", False))
+    if run_max_bytes_billed is not None:
+        options["budget"] = Budget(run_max_bytes_billed)
+    # pushdown and projection change each spec's query, and a profile is of a spec's own queries.
+    share = not options.get("pushdown") and not options.get("projection") and not options.get("profile")
+    groups = group_specs(paths, share=share, sample=options.pop("sample", None),
+                         spec_cache=options.pop("spec_cache", None), destinations=options.pop("destinations", None))
+    try:
+        if jobs > 1:
+            return run_concurrently(paths, groups, jobs, state=state, timings=timings, **options)
+
+        failed = False
+        for measured in in_order(paths, (measure_group(group, **options) for group in groups)):
+            if report_group(measured, state, options.get("reporter"), timings):
+                failed = True
+        return failed
+    finally:
+        if state is not None:
+            state.save()
+        if timings is not None:
+            timings.save()
+
+
+def find_specs(f, d):  # type: (Optional[Text], Text) -> List[Text]
+    if f:
+        return [f]
+    return [
+        os.path.join(dirname, filename) for dirname, _, filenames in os.walk(d) for filename in filenames
+        if filename.endswith((".yaml", ".yml"))
+    ]
+
+
+def watch_specs(find, run_paths, changed=None, interval=WATCH_INTERVAL):
+    # type: (Callable[[], List[Text]], Callable[[List[Text]], bool], Optional[Callable[[Text], bool]], float) -> None
+    """Runs the specs whose inputs changed since they last ran, until interrupted.
+
+    At first every spec runs, or only those for which changed returns True.
+    """
+    digests = {}  # type: Dict[Text, Text]
+    try:
+        while True:
+            paths = find()
+            current = {path: spec_digest(path) for path in paths}
+            if changed is not None:
+                digests = {path: current[path] for path in paths if not changed(path)}
+                changed = None
+            targets = [path for path in paths if digests.get(path) != current[path]]
+            digests = current
+            if targets:
+                run_paths(targets)
+                click.echo("watching {} specs for changes...".format(len(paths)))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def report(spec, verified, aggregates=None):  # type: (Spec, Results, Optional[List[Failure]]) -> bool
+    cases_results, invariants_results = verified
+    if spec.combination is not None and (aggregates or total(invariants_results) or any(map(total, cases_results))):
+        click.echo("Params: {}".format(describe(spec.combination)))
+    if spec.projection is not None:
+        report_projection(spec)
+    if spec.profile is not None:
+        report_profile(spec)
+    if spec.sampled is not None:
+        report_sample(spec, verified)
 
     failed = False
-    cases_results, invariants_results = spec.verify()
-    if invariants_results:
+    if aggregates:
+        failed = True
+        click.echo("Aggregates Failed::")
+        _print_results(aggregates)
+
+    if total(invariants_results):
         failed = True
         click.echo("Invariants Failed Cases::")
         _print_results(invariants_results)
 
     for i, case in enumerate(spec.cases):
         results = cases_results[i]
-        if not results:
+        if not total(results):
             continue
 
         failed = True
@@ -57,35 +518,457 @@ def run(path):  # type: (Text) -> bool
     return failed
 
 
+def report_projection(spec):  # type: (Spec) -> None
+    projection = spec.projection
+    message = "{}: fetched {} of {} columns".format(spec.source, len(projection.columns), len(projection.fields))
+    if projection.saved_bytes is not None:
+        message += ", {} of {} bytes processed".format(projection.projected_bytes, projection.total_bytes)
+        if projection.refetched_bytes is not None:
+            message += ", {} more to fetch the full rows of failures".format(projection.refetched_bytes)
+        message += " ({} bytes saved)".format(projection.saved_bytes)
+    click.echo(message)
+
+
+def report_sample(spec, verified):  # type: (Spec, Results) -> None
+    """Reports the size of the sample, and bounds on the violation rates of the invariants and the cases."""
+    n = spec.sampled
+    click.echo("{}: sampled {} rows ({})".format(spec.source, n, spec.sample))
+    cases_results, invariants_results = verified
+    # the row reported with unknown columns is not a violation.
+    rates = [("invariants", failed_rows(invariants_results))]
+    rates.extend(("case {}".format(i), total(results)) for i, results in enumerate(cases_results) if total(results))
+    for name, failed in rates:
+        click.echo("    {}: {} failed rows, violation rate {:.4%}, at most {:.4%} ({} confidence)".format(
+            name, failed, float(failed) / n if n else 0.0, upper_bound(failed, n), CONFIDENCE))
+
+
+def report_profile(spec):  # type: (Spec) -> None
+    click.echo("{}: profile".format(spec.source))
+    for line in spec.profile.table():
+        click.echo("    " + line)
+
+
 def _print_results(results):  # type: (List[Tuple[dict, List[Text]]]) -> None
     for row, messages in results:
-        click.echo("===========================")
-        click.echo(row)
-        click.echo("[failed]")
-        for message in messages:
-            click.echo("{} #==> False".format(message))
+        # one write per failed row, which matters with thousands of them.
+        lines = ["===========================", "{}".format(row), "[failed]"]
+        lines.extend("{} #==> False".format(message) for message in messages)
+        lines.append("")
+        click.echo("\n".join(lines))
+    omitted = total(results) - len(results)
+    if omitted:
+        click.echo("({} more failed rows)".format(omitted))
         click.echo("")
 
 
-@click.command()
+class SampleSize(click.ParamType):
+    name = "sample"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, Sample):
+            return value
+        text = value.strip()
+        try:
+            if text.endswith("%"):
+                fraction = float(text[:-1]) / 100
+            elif "." in text:
+                fraction = float(text)
+            else:
+                rows = int(text)
+                if rows < 1:
+                    self.fail("{} is not a positive number of rows".format(value), param, ctx)
+                return Sample(rows=rows)
+        except ValueError:
+            self.fail("{} is not a fraction, a percentage or a number of rows".format(value), param, ctx)
+        if not 0 < fraction <= 1:
+            self.fail("{} is not a fraction of rows in (0, 1]".format(value), param, ctx)
+        return Sample(fraction=fraction)
+
+
+class ByteSize(click.ParamType):
+    name = "size"
+    units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        text = value.strip().upper().rstrip("B")
+        unit = text[-1:] if text[-1:] in self.units else ""
+        try:
+            return int(float(text[:len(text) - len(unit)]) * self.units[unit])
+        except ValueError:
+            self.fail("{} is not a valid size".format(value), param, ctx)
+
+
+class ShardIndex(click.ParamType):
+    name = "INDEX/COUNT"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+        index, _, count = value.partition("/")
+        try:
+            index, count = int(index), int(count)
+        except ValueError:
+            self.fail("{} is not INDEX/COUNT".format(value), param, ctx)
+        if not 1 <= index <= count:
+            self.fail("{} is not a shard from 1/{} to {}/{}".format(value, count, count, count), param, ctx)
+        return index, count
+
+
+class Duration(click.ParamType):
+    name = "duration"
+    units = {"": 1, "s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, (int, float)):
+            return value
+        text = value.strip().lower()
+        unit = text[-1:] if text[-1:] in self.units else ""
+        try:
+            seconds = float(text[:len(text) - len(unit)]) * self.units[unit]
+        except ValueError:
+            self.fail("{} is not a duration, e.g. 90s, 30m, 12h or 7d".format(value), param, ctx)
+        if seconds <= 0:
+            self.fail("{} is not a positive duration".format(value), param, ctx)
+        return seconds
+
+
+BYTE_SIZE = ByteSize()
+DURATION = Duration()
+SAMPLE_SIZE = SampleSize()
+SHARD = ShardIndex()
+
+
+@click.group(invoke_without_command=True)
 @click.option("-f", type=click.Path(dir_okay=False, exists=True))
 @click.option("-d", default=".", type=click.Path(file_okay=False, exists=True))
-def cli(f, d):
-    if f:
-        failed = run(f)
-    else:
-        paths = [
-            os.path.join(dirname, filename) for dirname, _, filenames in os.walk(d) for filename in filenames
-            if filename.endswith((".yaml", ".yml"))
-        ]
-        failed = False
-        for path in paths:
-            if run(path):
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), help="number of specs to run concurrently.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), envvar="BQSPEC_CACHE_DIR", help="cache query results.")
+@click.option("--cache-max-size", type=BYTE_SIZE, help="evict least recently used results beyond this size.")
+@click.option("--freshness-token", help="cached results and passes made with another token are not reused.")
+@click.option("--offline", is_flag=True, help="replay cached results without querying BigQuery.")
+@click.option("--spec-cache", type=click.Path(dir_okay=False), envvar="BQSPEC_SPEC_CACHE",
+              help="keep validated specs and compiled conditions in this file for later runs.")
+@click.option("--fixtures", type=click.Path(file_okay=False, exists=True), help="run queries locally on these tables.")
+@click.option("--destination-dataset", envvar="BQSPEC_DESTINATION_DATASET",
+              help="write query results to tables in this dataset, and read them there while they last.")
+@click.option("--destination-expiration", default="1d", type=DURATION, help="keep the tables of results this long.")
+@click.option("--pushdown", is_flag=True, help="evaluate conditions in BigQuery and download only failing rows.")
+@click.option("--vectorized", is_flag=True, help="evaluate conditions column-wise with numpy.")
+@click.option("-w", "--workers", default=1, type=click.IntRange(min=1), help="processes evaluating each spec's rows.")
+@click.option("--page-readers", default=1, type=click.IntRange(min=1), help="BigQuery result pages read at once.")
+@click.option("--dry-run", is_flag=True, help="report the bytes each spec would process without running them.")
+@click.option("--max-bytes-billed", type=BYTE_SIZE, help="fail specs which would process more than this.")
+@click.option("--run-max-bytes-billed", type=BYTE_SIZE, help="skip specs once the run would process more than this.")
+@click.option("--projection", is_flag=True, help="fetch only the columns the conditions refer to.")
+@click.option("--sample", type=SAMPLE_SIZE, help="evaluate a fraction (0.01, 1%) or a number of rows of each result.")
+@click.option("--max-examples", type=click.IntRange(min=0), help="failed rows to keep per case, all are counted.")
+@click.option("--reservoir", is_flag=True, help="keep a uniform sample of failed rows instead of the first ones.")
+@click.option("--max-failures", type=click.IntRange(min=1), help="stop a spec's query after this many failed rows.")
+@click.option("--fail-fast", is_flag=True, help="stop a spec's query at its first failed row.")
+@click.option("--state-file", type=click.Path(dir_okay=False), envvar="BQSPEC_STATE_FILE", help="record spec results.")
+@click.option("--shard", type=SHARD, envvar="BQSPEC_SHARD", help="run one shard of the specs, e.g. 3/10 of 10 nodes.")
+@click.option("--timings-file", type=click.Path(dir_okay=False), envvar="BQSPEC_TIMINGS_FILE",
+              help="the run time and bytes of each spec, which --shard balances.")
+@click.option("--record-timings", is_flag=True, help="write the run time and bytes of each spec to --timings-file.")
+@click.option("--changed-only", is_flag=True, help="skip specs which passed with the same inputs in the state file.")
+@click.option("--watch", is_flag=True, help="run the specs again whenever their files change.")
+@click.option("--reporter", type=click.Choice(sorted(REPORTERS)), help="report as each failure is found, not as text.")
+@click.option("--report-file", default="-", type=click.Path(dir_okay=False, allow_dash=True),
+              help="write the --reporter report to this file instead of stdout.")
+@click.option("--profile", is_flag=True, help="report the time of each query and condition.")
+@click.option("--profile-file", type=click.Path(dir_okay=False), help="append the profiles to a JSON Lines file.")
+@click.option("--profile-hook", multiple=True, help="module:function called with each spec path and profile.")
+@click.pass_context
+def cli(
+        ctx,
+        f,
+        d,
+        jobs,
+        cache_dir,
+        cache_max_size,
+        freshness_token,
+        offline,
+        spec_cache,
+        fixtures,
+        destination_dataset,
+        destination_expiration,
+        pushdown,
+        vectorized,
+        workers,
+        page_readers,
+        dry_run,
+        max_bytes_billed,
+        run_max_bytes_billed,
+        projection,
+        sample,
+        max_examples,
+        reservoir,
+        max_failures,
+        fail_fast,
+        state_file,
+        shard,
+        timings_file,
+        record_timings,
+        changed_only,
+        watch,
+        reporter,
+        report_file,
+        profile,
+        profile_file,
+        profile_hook,
+):
+    if ctx.invoked_subcommand is not None:
+        return
+
+    cache = None
+    if cache_dir:
+        cache = ResultCache(cache_dir, max_bytes=cache_max_size, token=freshness_token, offline=offline)
+    elif offline:
+        raise click.UsageError("--offline requires --cache-dir")
+    if dry_run and offline:
+        raise click.UsageError("--dry-run can not be used with --offline")
+    if vectorized and not vectorized_available():
+        raise click.UsageError("--vectorized requires numpy")
+    if vectorized and workers > 1:
+        raise click.UsageError("--vectorized can not be used with --workers")
+    state = State(state_file, freshness_token) if state_file is not None else None
+    if changed_only and state is None:
+        raise click.UsageError("--changed-only requires --state-file")
+    timings = Timings(timings_file) if timings_file is not None else None
+    if record_timings and timings is None:
+        raise click.UsageError("--record-timings requires --timings-file")
+    if fail_fast:
+        max_failures = 1
+    if reporter is not None and reservoir:
+        raise click.UsageError("--reservoir can not be used with --reporter, failures are reported as they are found")
+    if reporter is not None and projection:
+        raise click.UsageError("--projection can not be used with --reporter, failures are reported as they are found, "
+                               "before their full rows are fetched")
+    client = None  # type: Optional[Client]
+    if fixtures is not None:
+        client = LocalBackend(fixtures)
+    elif page_readers > 1 and not offline:
+        client = BigQueryBackend(pooled_client(), page_readers)
+    if profile_file is not None:
+        add_hook(JsonLinesHook(profile_file))
+    for hook in profile_hook:
+        module_name, _, function_name = hook.partition(":")
+        try:
+            add_hook(getattr(import_module(module_name), function_name))
+        except (ImportError, AttributeError, ValueError):
+            raise click.BadParameter("can not import {}".format(hook), param_hint="--profile-hook")
+    options = dict(
+        jobs=jobs,
+        dry_run=dry_run,
+        run_max_bytes_billed=run_max_bytes_billed,
+        state=state,
+        timings=timings if record_timings else None,
+        client=client,
+        max_bytes_billed=max_bytes_billed,
+        cache=cache,
+        pushdown=pushdown,
+        vectorized=vectorized,
+        workers=workers,
+        projection=projection,
+        sample=sample,
+        spec_cache=SpecCache(spec_cache) if spec_cache is not None else None,
+        destinations=DestinationDataset(destination_dataset, destination_expiration) if destination_dataset else None,
+        max_examples=max_examples,
+        sampling=RESERVOIR if reservoir else FIRST,
+        max_failures=max_failures,
+        profile=profile or profile_file is not None or bool(profile_hook),
+    )
+    if reporter is not None:
+        options["reporter"] = REPORTERS[reporter](click.open_file(report_file, "w", encoding="utf-8", lazy=False),
+                                                  shard)
+
+    def find():  # type: () -> List[Text]
+        paths = find_specs(f, d)
+        if shard is not None:
+            index, count = shard
+            paths = assign(paths, count, timings)[index - 1]
+        return paths
+
+    run_paths = functools.partial(run_all, **options)
+    changed = state.changed if changed_only else None
+    try:
+        if watch:
+            watch_specs(find, run_paths, changed)
+            return
+
+        paths = find()
+        if changed is not None:
+            targets = [path for path in paths if changed(path)]
+            if len(targets) < len(paths):
+                click.echo("skipped {} specs which passed with the same inputs".format(len(paths) - len(targets)),
+                           err=reporter is not None)
+            paths = targets
+        failed = run_paths(paths)
+    finally:
+        if reporter is not None:
+            options["reporter"].close()
+
+    if failed:
+        sys.exit(1)
+
+
+@cli.command("check")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True))
+@click.option("--spec-cache", type=click.Path(dir_okay=False), envvar="BQSPEC_SPEC_CACHE",
+              help="keep validated specs and compiled conditions in this file for later runs.")
+def check_command(paths, spec_cache):
+    """Validate specs without running them.
+
+    PATHS are spec files and directories of specs, the current directory by default.
+    """
+    cache = SpecCache(spec_cache) if spec_cache is not None else None
+    failed = False
+    for path in paths or ["."]:
+        for spec_path in find_specs(None, path) if os.path.isdir(path) else [path]:
+            _, errors = validate(spec_path, cache)
+            if errors:
+                report_error(spec_path, errors)
                 failed = True
+    if cache is not None:
+        cache.save()
+
+    if failed:
+        sys.exit(1)
+
+
+@cli.command("reduce")
+@click.argument("reports", nargs=-1, required=True, type=click.Path(dir_okay=False, exists=True))
+@click.option("--report-file", type=click.Path(dir_okay=False, allow_dash=True),
+              help="merge the reports into this file.")
+@click.option("--timings-file", type=click.Path(dir_okay=False), envvar="BQSPEC_TIMINGS_FILE",
+              help="write the run time and bytes of every spec of the reports to this file.")
+def reduce_command(reports, report_file, timings_file):
+    """Merge the reports of the shards of a run into one result.
+
+    REPORTS are the --reporter jsonl reports of the shards. Exits with 1 if a spec failed, or if a report is
+    incomplete or missing.
+    """
+    timings = Timings(timings_file) if timings_file is not None else None
+    merged = None
+    if report_file is not None:
+        merged = JsonLinesReporter(click.open_file(report_file, "w", encoding="utf-8", lazy=False))
+    try:
+        failed = reduce_reports(reports, merged, timings)
+    finally:
+        if merged is not None:
+            merged.close()
+    if timings is not None:
+        timings.save()
 
     if failed:
         sys.exit(1)
 
 
+def reduce_reports(paths, merged=None, timings=None):
+    # type: (List[Text], Optional[JsonLinesReporter], Optional[Timings]) -> bool
+    """Reports the failed specs of the JSON Lines reports at paths, writing their lines to merged and their costs
+    to timings. Returns True if a spec failed, or if a report or the report of a shard is missing.
+    """
+    failed = False
+    specs = 0
+    failed_specs = 0
+    shards = {}  # type: Dict[int, List[Text]]
+    counts = set()
+    for path in paths:
+        complete = False
+        with io.open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                event = record.get("event")
+                if event == "run" and record.get("shard"):
+                    index, count = record["shard"]
+                    shards.setdefault(index, []).append(path)
+                    counts.add(count)
+                elif event == "end":
+                    complete = True
+                elif event == "timing" and timings is not None:
+                    timings.record(record["path"], Cost(record["seconds"], record["bytes_processed"]))
+                elif event == "spec":
+                    specs += 1
+                    if not record["passed"]:
+                        failed_specs += 1
+                        report_record(record)
+                if merged is not None and event not in ("run", "end"):
+                    merged.write_line(line)
+        if not complete:
+            click.echo("{}: incomplete report, its run did not finish".format(path))
+            failed = True
+
+    if len(counts) > 1:
+        click.echo("reports of runs split into {} shards".format(" and ".join(map(str, sorted(counts)))))
+        failed = True
+    for count in counts:
+        missing = [index for index in range(1, count + 1) if index not in shards]
+        if missing:
+            click.echo("missing reports of shards {} of {}".format(", ".join(map(str, missing)), count))
+            failed = True
+    for index, shard_paths in sorted(shards.items()):
+        if len(shard_paths) > 1:
+            click.echo("shard {} is reported by {}".format(index, ", ".join(shard_paths)))
+            failed = True
+
+    click.echo("{} specs, {} failed".format(specs, failed_specs))
+    return failed or failed_specs > 0
+
+
+def report_record(record):  # type: (Dict[Text, Any]) -> None
+    """Reports a failed spec of a JSON Lines report, without its failed rows."""
+    click.echo("{}:".format(record["path"]))
+    if record.get("params"):
+        click.echo("    Params: {}".format(", ".join("{}={}".format(name, value)
+                                                     for name, value in sorted(record["params"].items()))))
+    for error in record["errors"]:
+        click.echo("    {} {}: {}".format(error["type"], ">".join(error["path"]), error["message"]))
+    if record.get("invariants", {}).get("failed_rows"):
+        click.echo("    Invariants Failed: {} rows".format(record["invariants"]["failed_rows"]))
+    for case in record.get("cases", []):
+        if case["failed_rows"]:
+            click.echo("    Failed Case: {} ({} rows)".format(case["case"], case["failed_rows"]))
+            for condition in case["where"]:
+                click.echo("    - {}".format(condition))
+    for aggregate in record.get("aggregates", []):
+        for condition in aggregate["failed"]:
+            click.echo("    Aggregate Failed: {}".format(condition))
+
+
+@cli.group("cache")
+def cache_command():
+    """Manage cached query results."""
+
+
+@cache_command.command("list")
+@click.option("--cache-dir", required=True, type=click.Path(file_okay=False), envvar="BQSPEC_CACHE_DIR")
+def cache_list(cache_dir):
+    total_size = 0
+    for entry in ResultCache(cache_dir).entries():
+        total_size += entry.size
+        last_used = datetime.datetime.fromtimestamp(entry.last_used).strftime("%Y-%m-%d %H:%M:%S")
+        click.echo("{}  {:>12}  {}".format(entry.key, entry.size, last_used))
+    click.echo("total: {} bytes".format(total_size))
+
+
+@cache_command.command("prune")
+@click.option("--cache-dir", required=True, type=click.Path(file_okay=False), envvar="BQSPEC_CACHE_DIR")
+@click.option("--max-size", type=BYTE_SIZE, help="keep the most recently used results up to this size.")
+@click.option("--max-days", type=float, help="remove results unused for this many days.")
+def cache_prune(cache_dir, max_size, max_days):
+    """Remove cached results. Without options, removes all of them."""
+    if max_size is None and max_days is None:
+        max_size = 0
+    max_age = max_days * 24 * 60 * 60 if max_days is not None else None
+    removed = ResultCache(cache_dir).prune(max_size, max_age)
+    click.echo("removed {} entries ({} bytes)".format(len(removed), sum(entry.size for entry in removed)))
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,44 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import google.auth.credentials
+    import google.cloud.bigquery as bq
+    import google_auth_httplib2
+
+
+class ThreadLocalHttp(object):
+    """httplib2 compatible transport which gives every thread its own connection.
+
+    ``httplib2.Http`` is not thread-safe, so a client shared between worker threads
+    routes each request through a connection owned by the calling thread.
+    """
+
+    def __init__(self, credentials):  # type: (google.auth.credentials.Credentials) -> None
+        self.credentials = credentials
+        self._local = threading.local()
+
+    @property
+    def http(self):  # type: () -> google_auth_httplib2.AuthorizedHttp
+        http = getattr(self._local, "http", None)
+        if http is None:
+            import google_auth_httplib2
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials)
+            self._local.http = http
+        return http
+
+    def request(self, *args, **kwargs):
+        return self.http.request(*args, **kwargs)
+
+
+def pooled_client():  # type: () -> bq.Client
+    import google.auth
+    import google.auth.credentials
+    import google.cloud.bigquery as bq
+
+    credentials, _ = google.auth.default()
+    credentials = google.auth.credentials.with_scopes_if_required(credentials, bq.Client.SCOPE)
+    return bq.Client(credentials=credentials, _http=ThreadLocalHttp(credentials))
@@ -0,0 +1,70 @@
+# coding: utf-8
+"""Conditions parsed once per text.
+
+Validating a spec parses its conditions, and the spec is built from the same parsed conditions. Identical
+condition texts across specs share one Condition, and the code of a Condition can be marshalled to be loaded
+again without parsing, see SpecCache.
+"""
+from __future__ import unicode_literals
+
+import marshal
+import threading
+import types
+from typing import Dict, Optional, Text
+
+import embexpr
+
+
+class Condition(embexpr.Expr):
+    """An embexpr.Expr with its code compiled up front, or marshalled and loaded when it is first evaluated."""
+
+    def __init__(self, expr, code=None, marshalled=None):
+        # type: (Text, Optional[types.CodeType], Optional[bytes]) -> None
+        super(Condition, self).__init__(expr)
+        self._code = code  # type: Optional[types.CodeType]
+        self._marshalled = marshalled  # type: Optional[bytes]
+
+    @property
+    def code(self):  # type: () -> types.CodeType
+        if self._code is None:
+            self._code = marshal.loads(self._marshalled)
+        return self._code
+
+    def purge_cache(self):  # type: () -> None
+        pass
+
+    def marshal(self):  # type: () -> bytes
+        if self._marshalled is None:
+            self._marshalled = marshal.dumps(self.code)
+        return self._marshalled
+
+
+_interned = {}  # type: Dict[Text, Condition]
+_lock = threading.Lock()
+
+
+def parse(text):  # type: (Text) -> Condition
+    """Returns the Condition of text, parsed the first time it is seen. Raises embexpr.ParseError if invalid."""
+    condition = _interned.get(text)
+    if condition is not None:
+        return condition
+    condition = Condition(text, embexpr.parse(text))
+    with _lock:
+        return _interned.setdefault(text, condition)
+
+
+def to_condition(text):  # type: (Text) -> embexpr.Expr
+    """Same as parse, but an invalid condition is returned as an embexpr.Expr failing when it is evaluated."""
+    try:
+        return parse(text)
+    except Exception:
+        # not only ParseError: embexpr fails on syntax errors with an AttributeError on Python 3.
+        return embexpr.Expr(text)
+
+
+def preload(text, marshalled):  # type: (Text, bytes) -> None
+    """Interns the condition of text with its marshalled code, unless it is already interned."""
+    if text in _interned:
+        return
+    with _lock:
+        _interned.setdefault(text, Condition(text, marshalled=marshalled))
@@ -0,0 +1,44 @@
+# coding: utf-8
+"""Tables holding the results of spec queries, which later runs read instead of running the queries again."""
+from __future__ import unicode_literals
+
+from typing import TYPE_CHECKING, Optional, Text
+
+from .backend import result_digest
+
+if TYPE_CHECKING:
+    from .spec import Spec
+
+# seconds a destination table is kept, a day by default.
+DEFAULT_EXPIRATION = 24 * 60 * 60
+# the prefix of the tables named by DestinationDataset.
+TABLE_PREFIX = "bqspec_"
+
+
+class Destination(object):
+    """A table the result of a spec's query is written to, and read from until it expires."""
+
+    def __init__(self, table, expiration=DEFAULT_EXPIRATION):  # type: (Text, float) -> None
+        # project.dataset.table or dataset.table.
+        self.table = table  # type: Text
+        # seconds after which BigQuery deletes the table.
+        self.expiration = expiration  # type: float
+
+
+class DestinationDataset(object):
+    """Names a destination table in dataset for each spec, after its query and params.
+
+    Specs with the same query and params share a table, and a changed query gets a new one.
+    """
+
+    def __init__(self, dataset, expiration=DEFAULT_EXPIRATION):  # type: (Text, float) -> None
+        # project.dataset or dataset.
+        self.dataset = dataset  # type: Text
+        self.expiration = expiration  # type: float
+
+    def destination(self, spec):  # type: (Spec) -> Optional[Destination]
+        """Returns the destination of spec, or None for a spec with a table or a matrix of params."""
+        if spec.table is not None or spec.matrix:
+            return None
+        digest = result_digest(spec.read_query(), spec.params)
+        return Destination("{}.{}{}".format(self.dataset, TABLE_PREFIX, digest[:32]), self.expiration)
@@ -0,0 +1,96 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import ast
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Text, Tuple
+
+from .astutil import constant_value, is_column, is_constant, parse_condition
+from .row import evaluate
+
+if TYPE_CHECKING:
+    from .spec import Case
+
+
+def equality_term(condition):  # type: (Text) -> Optional[Tuple[Text, Any]]
+    """Returns (column, constant) if the condition is `column == constant` or `constant == column`."""
+    try:
+        node = parse_condition(condition)
+    except SyntaxError:
+        return None
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1 or not isinstance(node.ops[0], ast.Eq):
+        return None
+
+    left, right = node.left, node.comparators[0]
+    if is_column(left) and is_constant(right):
+        column, value = left.id, constant_value(right)
+    elif is_constant(left) and is_column(right):
+        column, value = right.id, constant_value(left)
+    else:
+        return None
+
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return column, value
+
+
+def equality_key(case):  # type: (Case) -> Optional[Dict[Text, Any]]
+    """Returns the column values a row must have to match the case, if its where is only made of equality terms."""
+    if not case.where:
+        return None
+    key = {}  # type: Dict[Text, Any]
+    for condition in case.where:
+        term = equality_term(condition.expr)
+        if term is None:
+            return None
+        column, value = term
+        if column in key and key[column] != value:
+            return None
+        key[column] = value
+    return key
+
+
+class CaseIndex(object):
+    """Finds the cases whose where holds for a row.
+
+    Cases keyed by column == constant terms are looked up in a hash table per set of key columns,
+    the others are evaluated one by one.
+    """
+
+    def __init__(self, cases):  # type: (List[Case]) -> None
+        self.cases = cases  # type: List[Case]
+        self.tables = []  # type: List[Tuple[Tuple[Text, ...], Dict[tuple, List[int]], List[int]]]
+        self.generic = []  # type: List[int]
+
+        tables = {}  # type: Dict[Tuple[Text, ...], Tuple[Dict[tuple, List[int]], List[int]]]
+        for i, case in enumerate(cases):
+            key = equality_key(case)
+            if key is None:
+                self.generic.append(i)
+                continue
+            columns = tuple(sorted(key))
+            table, indices = tables.setdefault(columns, ({}, []))
+            table.setdefault(tuple(key[column] for column in columns), []).append(i)
+            indices.append(i)
+
+        for columns in sorted(tables):
+            table, indices = tables[columns]
+            self.tables.append((columns, table, indices))
+
+    def matches(self, row):  # type: (Mapping[Text, Any]) -> Iterator[int]
+        for columns, table, indices in self.tables:
+            try:
+                matched = table.get(tuple([row[column] for column in columns]), ())
+            except (KeyError, TypeError):
+                # a missing column or an unhashable value, let the conditions decide.
+                matched = [i for i in indices if self.holds(i, row)]
+            for i in matched:
+                yield i
+
+        for i in self.generic:
+            if self.holds(i, row):
+                yield i
+
+    def holds(self, i, row):  # type: (int, Mapping[Text, Any]) -> bool
+        return all(evaluate(condition, row) for condition in self.cases[i].where)
@@ -0,0 +1,107 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import functools
+import random
+from typing import TYPE_CHECKING, Callable, List, Optional, Text
+
+if TYPE_CHECKING:
+    from .spec import Failure, Results
+
+FIRST = "first"
+RESERVOIR = "reservoir"
+SAMPLINGS = (FIRST, RESERVOIR)
+# the failure of a column missing from the columns of a spec, reported with the first row of the query.
+UNKNOWN_COLUMN = '"{}" is unknown column'
+_UNKNOWN_PREFIX, _UNKNOWN_SUFFIX = UNKNOWN_COLUMN.split("{}")
+
+
+class FailureList(list):
+    """Failures of a case or of the invariants.
+
+    Counts every failure in total, but keeps at most limit of them: the first ones, or a uniform
+    sample of all of them with reservoir sampling. With on_failure, the first ones are passed to it
+    instead of being kept. The failures reporting unknown columns are also counted in unknown_columns.
+    """
+
+    def __init__(self, limit=None, sampling=FIRST, rng=None, on_failure=None):
+        # type: (Optional[int], Text, Optional[random.Random], Optional[Callable[[Failure], None]]) -> None
+        super(FailureList, self).__init__()
+        self.limit = limit  # type: Optional[int]
+        self.sampling = sampling  # type: Text
+        self.rng = rng or random.Random(0)  # type: random.Random
+        self.on_failure = on_failure  # type: Optional[Callable[[Failure], None]]
+        self.total = 0  # type: int
+        self.unknown_columns = 0  # type: int
+
+    def add(self, failure):  # type: (Failure) -> None
+        self.total += 1
+        if is_unknown_columns(failure[1]):
+            self.unknown_columns += 1
+        if self.on_failure is not None:
+            if self.limit is None or self.total <= self.limit:
+                self.on_failure(failure)
+            return
+        if self.limit is None or len(self) < self.limit:
+            self.append(failure)
+        elif self.sampling == RESERVOIR:
+            i = self.rng.randrange(self.total)
+            if i < self.limit:
+                self[i] = failure
+
+
+class FailureCollector(object):
+    """Collects the failures of a spec, and tells the evaluation when enough of them are found.
+
+    With on_failure, failures are streamed to it with their case, or None for the invariants, as they are found.
+    """
+
+    def __init__(self, n_cases, max_examples=None, sampling=FIRST, max_failures=None, on_failure=None):
+        # type: (int, Optional[int], Text, Optional[int], Optional[Callable[[Optional[int], Failure], None]]) -> None
+        # seeded, so the same result is sampled the same way on every run.
+        rng = random.Random(0)
+        self.cases = [
+            FailureList(max_examples, sampling, rng, _bind(on_failure, i)) for i in range(n_cases)
+        ]  # type: List[FailureList]
+        self.invariants = FailureList(max_examples, sampling, rng, _bind(on_failure, None))  # type: FailureList
+        self.max_failures = max_failures  # type: Optional[int]
+        self.failures = 0  # type: int
+
+    @property
+    def stopped(self):  # type: () -> bool
+        return self.max_failures is not None and self.failures >= self.max_failures
+
+    def add_invariants(self, failure):  # type: (Failure) -> None
+        self.failures += 1
+        self.invariants.add(failure)
+
+    def add_case(self, i, failure):  # type: (int, Failure) -> None
+        self.failures += 1
+        self.cases[i].add(failure)
+
+    def results(self):  # type: () -> Results
+        return self.cases, self.invariants
+
+
+def _bind(on_failure, case):
+    # type: (Optional[Callable[[Optional[int], Failure], None]], Optional[int]) -> Optional[Callable[[Failure], None]]
+    if on_failure is None:
+        return None
+    return functools.partial(on_failure, case)
+
+
+def total(failures):  # type: (List[Failure]) -> int
+    return getattr(failures, "total", len(failures))
+
+
+def failed_rows(failures):  # type: (List[Failure]) -> int
+    """Counts the failures of rows, leaving out those reporting unknown columns, which no condition failed."""
+    if isinstance(failures, FailureList):
+        return failures.total - failures.unknown_columns
+    return sum(1 for _, failed in failures if not is_unknown_columns(failed))
+
+
+def is_unknown_columns(failed):  # type: (List[Text]) -> bool
+    """Returns whether the failed conditions of a row are the unknown columns of a spec."""
+    return bool(failed) and all(message.startswith(_UNKNOWN_PREFIX) and message.endswith(_UNKNOWN_SUFFIX)
+                                for message in failed)
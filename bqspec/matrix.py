@@ -0,0 +1,95 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import datetime
+import re
+from typing import TYPE_CHECKING, List, Text
+
+from .backend import TOKEN, param_name
+from .rstruct import RawParam, Value
+
+if TYPE_CHECKING:
+    import google.cloud.bigquery as bq
+
+# the column of a matrix query with the index of the set of params each row was computed with.
+SET_COLUMN = "_bqspec_set"
+# sets of params run in one query job, the rest run in further jobs.
+SETS_PER_QUERY = 100
+MAX_COMBINATIONS = 1000
+RANGE_TYPES = {"INT64", "DATE"}
+
+_PARAM = re.compile(r"(?<!@)@(\w+)")
+
+
+def is_matrix(raw_params):  # type: (List[RawParam]) -> bool
+    return any(raw_param.values is not None or raw_param.range is not None for raw_param in raw_params)
+
+
+def param_values(raw_param):  # type: (RawParam) -> List[Value]
+    """Returns the values a param takes: its value, its values, or every value of its range."""
+    if raw_param.values is not None:
+        return raw_param.values
+    r = raw_param.range
+    if r is None:
+        return [raw_param.value]
+    if raw_param.type.upper() == "DATE":
+        return [r.start + datetime.timedelta(days=days) for days in range(0, (r.end - r.start).days + 1, r.step)]
+    return list(range(r.start, r.end + 1, r.step))
+
+
+def combinations(raw_params):  # type: (List[RawParam]) -> int
+    """Counts the combinations of the param values, without listing the values of the ranges."""
+    n = 1
+    for raw_param in raw_params:
+        r = raw_param.range
+        if r is None:
+            n *= len(param_values(raw_param))
+        elif raw_param.type.upper() == "DATE":
+            n *= (r.end - r.start).days // r.step + 1
+        else:
+            n *= (r.end - r.start) // r.step + 1
+    return n
+
+
+def set_param_name(name, i):  # type: (Text, int) -> Text
+    return "{}_bqspec_{}".format(name.lower(), i)
+
+
+def rename_params(query, names, i):  # type: (Text, List[Text], int) -> Text
+    """Renames the references to the params names in query to their names in set i.
+
+    String literals, quoted identifiers and comments are left as they are.
+    """
+    renamed = {name.lower() for name in names}
+
+    def rename(m):
+        if m.group(1).lower() not in renamed:
+            return m.group(0)
+        return "@" + set_param_name(m.group(1), i)
+
+    return "".join(part if j % 2 else _PARAM.sub(rename, part) for j, part in enumerate(TOKEN.split(query)))
+
+
+def build_query(query, names, n_sets):  # type: (Text, List[Text], int) -> Text
+    """Builds one query returning the rows of query for n_sets sets of the params names.
+
+    Each row starts with SET_COLUMN, the index of the set it was computed with.
+    """
+    query = query.strip().rstrip(";")
+    selects = ["SELECT {} AS `{}`, * FROM (\n{}\n)".format(i, SET_COLUMN, rename_params(query, names, i))
+               for i in range(n_sets)]
+    return "\nUNION ALL\n".join(selects)
+
+
+def set_params(sets):  # type: (List[List[bq.ScalarQueryParameter]]) -> List[bq.ScalarQueryParameter]
+    """Returns the params of every set, renamed as build_query refers to them."""
+    import google.cloud.bigquery as bq
+
+    return [
+        bq.ScalarQueryParameter(set_param_name(param_name(param), i).encode("latin-1"), param.type_, param.value)
+        for i, params in enumerate(sets) for param in params
+    ]
+
+
+def describe(params):  # type: (List[bq.ScalarQueryParameter]) -> Text
+    return ", ".join("{}={}".format(param_name(param), param.value) for param in params)
@@ -0,0 +1,141 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import multiprocessing
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+from .failures import FailureCollector
+from .row import RowView
+from .row import evaluate as evaluate_condition
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+    from .spec import Results, Spec
+
+BATCH_SIZE = 10000
+
+# a failed row: its index in the batch, the failed invariants, and the failed expected conditions of each case.
+FailedRow = Tuple[int, List[Text], List[Tuple[int, List[Text]]]]
+Definition = Tuple[Text, List[Text], List[Text], List[Tuple[List[Text], List[Text]]]]
+
+# the spec a worker process evaluates, built once by _init.
+_spec = None  # type: Optional[Spec]
+_bound = {}  # type: Dict[Tuple[Text, ...], Optional[Callable[[tuple], List[int]]]]
+
+
+def batches(rows, size):  # type: (Iterable[tuple], int) -> Iterator[List[tuple]]
+    """Splits rows into lists of size rows, the last one shorter."""
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def windowed(pool, func, items, window):
+    # type: (Pool, Callable[[Any], Any], Iterable[Any], int) -> Iterator[Tuple[Any, Any]]
+    """Maps func over items in pool, yielding each item with its result in order.
+
+    Unlike Pool.imap, at most window items are submitted ahead of the one being yielded, so items are read from
+    the iterable only as fast as they are consumed.
+    """
+    pending = collections.deque()  # type: Deque[Tuple[Any, Any]]
+    for item in items:
+        pending.append((item, pool.apply_async(func, (item, ))))
+        if len(pending) >= window:
+            item, result = pending.popleft()
+            yield item, result.get()
+    while pending:
+        item, result = pending.popleft()
+        yield item, result.get()
+
+
+def definition(spec):  # type: (Spec) -> Definition
+    """The conditions of the spec, which the workers compile again."""
+    cases = [([c.expr for c in case.where], [c.expr for c in case.expected]) for case in spec.cases]
+    return spec.query_path, spec.columns, [invariant.expr for invariant in spec.invariants], cases
+
+
+def _init(d):  # type: (Definition) -> None
+    from .spec import Case, Spec, to_conditions
+
+    global _spec
+    query_path, columns, invariants, cases = d
+    _spec = Spec(query_path, None, columns, to_conditions(invariants),
+                 [Case(to_conditions(where), to_conditions(expected)) for where, expected in cases])
+    _bound.clear()
+
+
+def _evaluate(args):  # type: (Tuple[List[Text], List[tuple]]) -> List[FailedRow]
+    fields, rows = args
+    spec = _spec
+    key = tuple(fields)
+    if key not in _bound:
+        _bound[key] = spec.bind(fields)
+    check = _bound[key]
+
+    index = {field: i for i, field in enumerate(fields)}
+    failed_rows = []  # type: List[FailedRow]
+    for i, row in enumerate(rows):
+        if check is not None:
+            invariants = []  # type: List[Text]
+            unexpected = {}  # type: Dict[int, List[Text]]
+            for k in check(row):
+                case, expr = spec.compiled.conditions[k]
+                if case is None:
+                    invariants.append(expr)
+                else:
+                    unexpected.setdefault(case, []).append(expr)
+            cases = sorted(unexpected.items())
+        else:
+            view = RowView(index, row)
+            invariants = [invariant.expr for invariant in spec.invariants if not evaluate_condition(invariant, view)]
+            cases = []
+            for j in spec.case_index.matches(view):
+                expected = spec.cases[j].expected
+                failed = [condition.expr for condition in expected if not evaluate_condition(condition, view)]
+                if failed:
+                    cases.append((j, failed))
+        if invariants or cases:
+            failed_rows.append((i, invariants, cases))
+    return failed_rows
+
+
+def evaluate(spec, fields, rows, workers, collector=None, batch_size=BATCH_SIZE, check_columns=True):
+    # type: (Spec, List[Text], Iterable[tuple], int, Optional[FailureCollector], int, bool) -> Results
+    """Same as Spec.evaluate_tuples, but evaluates batches of rows in workers processes.
+
+    Each worker compiles the conditions once. The failed rows come back with their index in the batch, and are
+    collected in row order, so the results are the same as evaluating the rows in this process.
+    """
+    from .spec import to_dict
+
+    if collector is None:
+        collector = FailureCollector(len(spec.cases))
+    pool = multiprocessing.Pool(workers, _init, (definition(spec), ))
+    try:
+        first = check_columns
+        tasks = ((fields, batch) for batch in batches(rows, batch_size))
+        for (_, batch), failed_rows in windowed(pool, _evaluate, tasks, 2 * workers):
+            if first and spec.columns:
+                unknown = spec.unknown_columns(to_dict(fields, batch[0]))
+                if unknown:
+                    collector.add_invariants(unknown)
+            first = False
+
+            for i, invariants, cases in failed_rows:
+                if collector.stopped:
+                    break
+                record = to_dict(fields, batch[i])
+                if invariants:
+                    collector.add_invariants((record, invariants))
+                for case, unexpected in cases:
+                    collector.add_case(case, (record, unexpected))
+            if collector.stopped:
+                break
+    finally:
+        pool.terminate()
+    return collector.results()
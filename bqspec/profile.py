@@ -0,0 +1,234 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import json
+from timeit import default_timer
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Text
+
+import embexpr
+
+from .backend import Backend, Job, table_query
+from .row import evaluate
+
+INVARIANT = "invariant"
+WHERE = "where"
+EXPECTED = "expected"
+
+# called with the path and the profile of every profiled spec, once it is verified.
+HOOKS = []  # type: List[Callable[[Text, Profile], None]]
+
+
+class ConditionStats(object):
+    """How often a condition was evaluated, how often it held, and the time spent evaluating it."""
+
+    def __init__(self, kind, expr, case=None):  # type: (Text, Text, Optional[int]) -> None
+        self.kind = kind  # type: Text
+        self.expr = expr  # type: Text
+        self.case = case  # type: Optional[int]
+        self.evaluations = 0  # type: int
+        self.true = 0  # type: int
+        self.false = 0  # type: int
+        self.seconds = 0.0  # type: float
+
+    def evaluate(self, condition, row):  # type: (embexpr.Expr, Mapping[Text, Any]) -> bool
+        start = default_timer()
+        try:
+            value = bool(evaluate(condition, row))
+        finally:
+            self.seconds += default_timer() - start
+            self.evaluations += 1
+        if value:
+            self.true += 1
+        else:
+            self.false += 1
+        return value
+
+    @property
+    def label(self):  # type: () -> Text
+        if self.case is None:
+            return "{}: {}".format(self.kind, self.expr)
+        return "case {} {}: {}".format(self.case, self.kind, self.expr)
+
+    def to_dict(self):  # type: () -> Dict[Text, Any]
+        return {
+            "kind": self.kind,
+            "expr": self.expr,
+            "case": self.case,
+            "evaluations": self.evaluations,
+            "true": self.true,
+            "false": self.false,
+            "seconds": self.seconds,
+        }
+
+
+class QueryStats(object):
+    """The timings of a query job, with the statistics its backend reported."""
+
+    def __init__(self, query, dry_run=False):  # type: (Text, bool) -> None
+        self.query = query  # type: Text
+        self.dry_run = dry_run  # type: bool
+        # the time until the backend accepted the job, and the time spent waiting for its rows.
+        self.submit_seconds = 0.0  # type: float
+        self.fetch_seconds = 0.0  # type: float
+        self.rows = 0  # type: int
+        self.statistics = {}  # type: Dict[Text, Any]
+
+    def to_dict(self):  # type: () -> Dict[Text, Any]
+        d = {
+            "query": self.query,
+            "dry_run": self.dry_run,
+            "submit_seconds": self.submit_seconds,
+            "fetch_seconds": self.fetch_seconds,
+            "rows": self.rows,
+        }
+        d.update(self.statistics)
+        return d
+
+
+class Profile(object):
+    """Where the time of verifying a spec went: its query jobs and the evaluation of each of its conditions."""
+
+    def __init__(self):  # type: () -> None
+        self.queries = []  # type: List[QueryStats]
+        self.conditions = []  # type: List[ConditionStats]
+        self.seconds = 0.0  # type: float
+        # the time of evaluating rows, including the conditions, excluding waiting for rows.
+        self.evaluate_seconds = 0.0  # type: float
+
+    def condition(self, kind, expr, case=None):  # type: (Text, Text, Optional[int]) -> ConditionStats
+        stats = ConditionStats(kind, expr, case)
+        self.conditions.append(stats)
+        return stats
+
+    def to_dict(self):  # type: () -> Dict[Text, Any]
+        return {
+            "seconds": self.seconds,
+            "evaluate_seconds": self.evaluate_seconds,
+            "queries": [query.to_dict() for query in self.queries],
+            "conditions": [condition.to_dict() for condition in self.conditions],
+        }
+
+    def table(self):  # type: () -> List[Text]
+        """Formats the profile as text lines, the conditions sorted by the time spent on them."""
+        lines = ["{:.3f}s total, {:.3f}s evaluating rows".format(self.seconds, self.evaluate_seconds)]
+        lines.append("{:>10} {:>10} {:>10} {:>8} {:>16} {:>10} {:>9}  {}".format(
+            "submit s", "fetch s", "rows", "pages", "bytes", "slot ms", "cache hit", "query"))
+        for query in self.queries:
+            statistics = query.statistics
+            lines.append("{:>10.3f} {:>10.3f} {:>10} {:>8} {:>16} {:>10} {:>9}  {}".format(
+                query.submit_seconds,
+                query.fetch_seconds,
+                query.rows,
+                _or_dash(statistics.get("pages")),
+                _or_dash(statistics.get("total_bytes_processed")),
+                _or_dash(statistics.get("slot_millis")),
+                _or_dash(statistics.get("cache_hit")),
+                "(dry run)" if query.dry_run else query.query.strip().splitlines()[0][:40],
+            ))
+        if self.conditions:
+            lines.append("{:>10} {:>10} {:>10} {:>10}  {}".format("seconds", "evaluated", "true", "false", "condition"))
+        for condition in sorted(self.conditions, key=lambda condition: -condition.seconds):
+            lines.append("{:>10.3f} {:>10} {:>10} {:>10}  {}".format(condition.seconds, condition.evaluations,
+                                                                    condition.true, condition.false, condition.label))
+        return lines
+
+
+def _or_dash(value):  # type: (Any) -> Text
+    return "-" if value is None else "{}".format(value)
+
+
+class ProfilingJob(Job):
+    def __init__(self, job, stats):  # type: (Job, QueryStats) -> None
+        self.job = job  # type: Job
+        self.stats = stats  # type: QueryStats
+
+    @property
+    def fields(self):  # type: () -> List[Text]
+        return self.job.fields
+
+    @property
+    def total_bytes_processed(self):  # type: () -> Optional[int]
+        return self.job.total_bytes_processed
+
+    def rows(self):  # type: () -> Iterator[tuple]
+        batches = self.job.batches()
+        try:
+            while True:
+                start = default_timer()
+                batch = next(batches, None)
+                self.stats.fetch_seconds += default_timer() - start
+                if batch is None:
+                    return
+                self.stats.rows += len(batch)
+                for row in batch:
+                    yield row
+        finally:
+            self.stats.statistics = self.job.statistics()
+
+    def cancel(self):  # type: () -> None
+        self.job.cancel()
+
+    def statistics(self):  # type: () -> Dict[Text, Any]
+        return self.job.statistics()
+
+
+class ProfilingBackend(Backend):
+    """Runs queries with backend, recording each job in profile."""
+
+    def __init__(self, backend, profile):  # type: (Backend, Profile) -> None
+        self.backend = backend  # type: Backend
+        self.profile = profile  # type: Profile
+
+    def submit(self, query, params, dry_run=False, maximum_bytes_billed=None):
+        # type: (Text, List[Any], bool, Optional[int]) -> Job
+        return self._profiled(QueryStats(query, dry_run),
+                              lambda: self.backend.submit(query, params, dry_run, maximum_bytes_billed))
+
+    def read_table(self, table):  # type: (Text) -> Job
+        return self._profiled(QueryStats(table_query(table)), lambda: self.backend.read_table(table))
+
+    def materialize(self, query, params, table, expiration, maximum_bytes_billed=None):
+        # type: (Text, List[Any], Text, float, Optional[int]) -> Optional[Job]
+        start = default_timer()
+        job = self.backend.materialize(query, params, table, expiration, maximum_bytes_billed)
+        if job is not None:
+            # the query writing the table, which is recorded like the others, unless the table was reused.
+            stats = QueryStats(query)
+            stats.submit_seconds = default_timer() - start
+            stats.statistics = job.statistics()
+            self.profile.queries.append(stats)
+        return job
+
+    def _profiled(self, stats, submit):  # type: (QueryStats, Callable[[], Job]) -> Job
+        self.profile.queries.append(stats)
+        start = default_timer()
+        try:
+            job = submit()
+        finally:
+            stats.submit_seconds = default_timer() - start
+        stats.statistics = job.statistics()
+        return ProfilingJob(job, stats)
+
+
+def add_hook(hook):  # type: (Callable[[Text, Profile], None]) -> None
+    """Registers hook to be called with the path and the profile of every profiled spec, e.g. to send metrics."""
+    HOOKS.append(hook)
+
+
+def run_hooks(path, profile):  # type: (Text, Profile) -> None
+    for hook in HOOKS:
+        hook(path, profile)
+
+
+class JsonLinesHook(object):
+    """Appends each profile to a file as a line of JSON."""
+
+    def __init__(self, path):  # type: (Text) -> None
+        self.path = path  # type: Text
+
+    def __call__(self, spec_path, profile):  # type: (Text, Profile) -> None
+        d = profile.to_dict()
+        d["path"] = spec_path
+        with io.open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(d, sort_keys=True, default=repr) + "\n")
@@ -0,0 +1,78 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from typing import TYPE_CHECKING, List, Optional, Set, Text
+
+from .astutil import referenced_names
+from .pushdown import Untranslatable, literal
+
+if TYPE_CHECKING:
+    from .spec import Spec
+
+# full rows are fetched with one condition per row, which has to fit in a query.
+MAX_MATCHED_ROWS = 1000
+
+
+class Projection(object):
+    """The columns of a query result a spec needs, and the bytes BigQuery processes for all and for them."""
+
+    def __init__(self, fields, columns, total_bytes=None, projected_bytes=None):
+        # type: (List[Text], List[Text], Optional[int], Optional[int]) -> None
+        self.fields = fields  # type: List[Text]
+        self.columns = columns  # type: List[Text]
+        self.total_bytes = total_bytes  # type: Optional[int]
+        self.projected_bytes = projected_bytes  # type: Optional[int]
+        # bytes processed again by the query fetching the full rows of the failures, once it ran.
+        self.refetched_bytes = None  # type: Optional[int]
+
+    @property
+    def saved_bytes(self):  # type: () -> Optional[int]
+        """The bytes projection saved, less those of fetching the full rows, negative if it cost more."""
+        if self.total_bytes is None or self.projected_bytes is None:
+            return None
+        return self.total_bytes - self.projected_bytes - (self.refetched_bytes or 0)
+
+
+def referenced_columns(spec):  # type: (Spec) -> Optional[Set[Text]]
+    """Returns the names the conditions of the spec refer to, or None if a condition can not be parsed."""
+    exprs = [condition.expr for condition in spec.invariants]
+    for case in spec.cases:
+        exprs.extend(condition.expr for condition in case.where + case.expected)
+    try:
+        return set().union(*[referenced_names(expr) for expr in exprs])
+    except SyntaxError:
+        return None
+
+
+def projected_columns(spec, fields):  # type: (Spec, List[Text]) -> Optional[List[Text]]
+    """Returns the fields the spec needs: the ones its conditions refer to, and the ones its columns do not list.
+
+    Returns None if every field is needed.
+    """
+    names = referenced_columns(spec)
+    if names is None:
+        return None
+    columns = [field for field in fields if field in names or (spec.columns and field not in spec.columns)]
+    if not columns or len(columns) == len(fields):
+        return None
+    return columns
+
+
+def project_query(query, columns):  # type: (Text, List[Text]) -> Text
+    selected = ", ".join("`{}`".format(column) for column in columns)
+    return "SELECT {} FROM (\n{}\n)".format(selected, query.strip().rstrip(";"))
+
+
+def match_condition(row):  # type: (dict) -> Optional[Text]
+    """Builds a condition holding for the rows with the values of row, or returns None if a value has no literal."""
+    terms = []  # type: List[Text]
+    for column in sorted(row):
+        value = row[column]
+        if value is None:
+            terms.append("`{}` IS NULL".format(column))
+            continue
+        try:
+            terms.append("`{}` = {}".format(column, literal(value)))
+        except Untranslatable:
+            return None
+    return " AND ".join(terms)
@@ -0,0 +1,174 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import ast
+from typing import TYPE_CHECKING, List, Optional, Text
+
+import six
+
+from .astutil import NAME_CONSTANTS, NotConstant, constant_value, parse_condition
+
+if TYPE_CHECKING:
+    from .spec import Spec
+
+NULL = "CAST(NULL AS BOOL)"
+
+COMPARE_OPERATORS = {
+    ast.Eq: "=",
+    ast.NotEq: "!=",
+    ast.Lt: "<",
+    ast.LtE: "<=",
+    ast.Gt: ">",
+    ast.GtE: ">=",
+}
+
+BINARY_OPERATORS = {
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+}
+if six.PY3:
+    # python2 '/' floors integers, BigQuery always returns FLOAT64.
+    BINARY_OPERATORS[ast.Div] = "/"
+
+
+class Untranslatable(Exception):
+    pass
+
+
+def to_sql(condition):  # type: (Text) -> Optional[Text]
+    """Translates an embexpr condition to a BigQuery boolean expression.
+
+    The expression evaluates to the same truth value as the condition for rows without NULLs, and may evaluate
+    to NULL otherwise. Returns None if the condition uses something that has no exact BigQuery counterpart.
+    """
+    try:
+        return translate(parse_condition(condition))
+    except (SyntaxError, Untranslatable):
+        return None
+
+
+def build_filter(spec):  # type: (Spec) -> Optional[Text]
+    """Builds a WHERE clause which keeps every row that may fail an invariant or a case of the spec.
+
+    Untranslatable conditions are treated as NULL, so rows depending on them are kept and evaluated on the client.
+    Returns None if every row has to be kept.
+    """
+    terms = []  # type: List[Text]
+    for invariant in spec.invariants:
+        sql = to_sql(invariant.expr)
+        if sql is None:
+            return None
+        terms.append("({}) IS NOT TRUE".format(sql))
+
+    for case in spec.cases:
+        if not case.expected:
+            continue
+        where = _conjunction(case.where)
+        expected = _conjunction(case.expected)
+        if where is None and expected is None:
+            return None
+        terms.append("({}) IS NOT FALSE AND ({}) IS NOT TRUE".format(where or NULL, expected or NULL))
+
+    if not terms:
+        return "FALSE"
+    return "\n   OR ".join("({})".format(term) for term in terms)
+
+
+def wrap_query(query, condition):  # type: (Text, Text) -> Text
+    return "SELECT * FROM (\n{}\n) WHERE {}".format(query.strip().rstrip(";"), condition)
+
+
+def limit_query(query, limit):  # type: (Text, int) -> Text
+    return "SELECT * FROM (\n{}\n) LIMIT {}".format(query.strip().rstrip(";"), limit)
+
+
+def _conjunction(conditions):  # type: (List) -> Optional[Text]
+    if not conditions:
+        return "TRUE"
+    translated = [to_sql(condition.expr) or NULL for condition in conditions]
+    if all(sql == NULL for sql in translated):
+        return None
+    return " AND ".join("({})".format(sql) for sql in translated)
+
+
+def translate(node):  # type: (ast.AST) -> Text
+    """Translates a parsed condition, or raises Untranslatable."""
+    if isinstance(node, ast.BoolOp):
+        operator = " AND " if isinstance(node.op, ast.And) else " OR "
+        return "({})".format(operator.join(translate(value) for value in node.values))
+
+    if isinstance(node, ast.UnaryOp):
+        if isinstance(node.op, ast.Not):
+            return "(NOT {})".format(translate(node.operand))
+        if isinstance(node.op, ast.USub):
+            return "(-{})".format(translate(node.operand))
+        raise Untranslatable()
+
+    if isinstance(node, ast.BinOp):
+        operator = BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            raise Untranslatable()
+        return "({} {} {})".format(translate(node.left), operator, translate(node.right))
+
+    if isinstance(node, ast.Compare):
+        terms = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            terms.append(_translate_compare(left, op, right))
+            left = right
+        return "({})".format(" AND ".join(terms))
+
+    if isinstance(node, ast.Name) and node.id not in NAME_CONSTANTS:
+        return "`{}`".format(node.id)
+
+    try:
+        return literal(constant_value(node))
+    except NotConstant:
+        raise Untranslatable()
+
+
+def _translate_compare(left, op, right):  # type: (ast.AST, ast.AST, ast.AST) -> Text
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if not isinstance(right, (ast.List, ast.Tuple, ast.Set)) or not right.elts:
+            raise Untranslatable()
+        operator = "IN" if isinstance(op, ast.In) else "NOT IN"
+        return "{} {} ({})".format(translate(left), operator, ", ".join(translate(elt) for elt in right.elts))
+
+    operator = COMPARE_OPERATORS.get(type(op))
+    if operator is None:
+        raise Untranslatable()
+
+    if isinstance(op, (ast.Eq, ast.NotEq)):
+        suffix = "IS NULL" if isinstance(op, ast.Eq) else "IS NOT NULL"
+        if _is_none(right):
+            return "{} {}".format(translate(left), suffix)
+        if _is_none(left):
+            return "{} {}".format(translate(right), suffix)
+
+    return "{} {} {}".format(translate(left), operator, translate(right))
+
+
+def _is_none(node):  # type: (ast.AST) -> bool
+    try:
+        return constant_value(node) is None
+    except NotConstant:
+        return False
+
+
+def literal(value):  # type: (object) -> Text
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, six.integer_types):
+        return "{:d}".format(value)
+    if isinstance(value, float):
+        if value != value or value in (float("inf"), float("-inf")):
+            raise Untranslatable()
+        return repr(value)
+    if isinstance(value, six.text_type):
+        escaped = value.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n").replace("\r", "\\r")
+        # a cast keeps BigQuery from coercing the literal to DATE or TIMESTAMP, which python never does.
+        return "CAST('{}' AS STRING)".format(escaped)
+    raise Untranslatable()
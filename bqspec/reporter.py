@@ -0,0 +1,228 @@
+# coding: utf-8
+"""Machine-readable reports of verified specs, written as the specs are evaluated.
+
+Each failure is written as soon as it is found and is not kept, so reports take the same memory however many rows
+fail. The text report of the cli keeps the failures to print, up to --max-examples per case.
+"""
+from __future__ import unicode_literals
+
+import json
+import threading
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Optional, Text, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from .error import SpecError
+from .failures import total
+from .matrix import describe
+from .shard import Cost
+from .spec import Failure, Results, Spec
+
+if TYPE_CHECKING:
+    import google.cloud.bigquery as bq
+
+Verified = Tuple[Optional[Spec], List[SpecError], Results, List[Failure]]
+
+
+def has_failed(verified):  # type: (Verified) -> bool
+    _, errors, (cases_results, invariants_results), aggregates = verified
+    return bool(errors or aggregates or total(invariants_results) or any(map(total, cases_results)))
+
+
+class Reporter(object):
+    """Writes the results of specs to stream.
+
+    failure is called with every failure of a spec as soon as it is found, from the threads evaluating the specs,
+    and verified with the results of the spec once it is verified. The failures are not kept in the results, which
+    only count them. shard is the index, from 1, and the count of the shard of the specs of a sharded run.
+    """
+
+    def __init__(self, stream, shard=None):  # type: (IO[Text], Optional[Tuple[int, int]]) -> None
+        self.stream = stream  # type: IO[Text]
+        self.shard = shard  # type: Optional[Tuple[int, int]]
+        self._lock = threading.Lock()
+        # the failures written of each spec being verified, by case, or None for the invariants.
+        self._written = {}  # type: Dict[Tuple[Text, int], Dict[Optional[int], int]]
+        self.start()
+
+    def failure(self, path, spec, case, failure):  # type: (Text, Spec, Optional[int], Failure) -> None
+        with self._lock:
+            written = self._written.setdefault((path, id(spec)), {})
+            written[case] = written.get(case, 0) + 1
+            self.write_failure(path, spec, case, failure)
+
+    def verified(self, path, verified):  # type: (Text, Verified) -> bool
+        """Writes the results of a verified spec, returning whether it failed."""
+        with self._lock:
+            written = self._written.pop((path, id(verified[0])), {}) if verified[0] is not None else {}
+            self.write_verified(path, verified, written)
+            self.stream.flush()
+        return has_failed(verified)
+
+    def timing(self, path, cost):  # type: (Text, Cost) -> None
+        """Called with the cost of running the spec at path, once it is verified."""
+        with self._lock:
+            self.write_timing(path, cost)
+
+    def close(self):  # type: () -> None
+        with self._lock:
+            self.end()
+            self.stream.flush()
+
+    def start(self):  # type: () -> None
+        pass
+
+    def end(self):  # type: () -> None
+        pass
+
+    def write_failure(self, path, spec, case, failure):  # type: (Text, Spec, Optional[int], Failure) -> None
+        raise NotImplementedError
+
+    def write_verified(self, path, verified, written):
+        # type: (Text, Verified, Dict[Optional[int], int]) -> None
+        raise NotImplementedError
+
+    def write_timing(self, path, cost):  # type: (Text, Cost) -> None
+        pass
+
+
+def _params(combination):  # type: (List[bq.ScalarQueryParameter]) -> Dict[Text, Any]
+    from .backend import param_name
+
+    return {param_name(param): param.value for param in combination}
+
+
+class JsonLinesReporter(Reporter):
+    """Writes a line of JSON for every failure, and one for every verified spec::
+
+        {"event": "failure", "path": "a.yaml", "case": 0, "row": {"a": 1}, "failed": ["a > 1"]}
+        {"event": "spec", "path": "a.yaml", "passed": false, "invariants": {...}, "cases": [...], ...}
+
+    "case" is null for the invariants. Specs with a parameter matrix have the "params" of the combination.
+    The report starts with a "run" line, with the shard of a sharded run, and ends with an "end" line, so that
+    bqspec reduce can tell a complete report. Each spec also has a "timing" line, with the cost of running it.
+    """
+
+    def start(self):  # type: () -> None
+        self._write({"event": "run", "shard": list(self.shard) if self.shard is not None else None})
+
+    def end(self):  # type: () -> None
+        self._write({"event": "end"})
+
+    def write_failure(self, path, spec, case, failure):  # type: (Text, Spec, Optional[int], Failure) -> None
+        row, messages = failure
+        record = {"event": "failure", "path": path, "case": case, "row": row, "failed": messages}
+        if spec.combination is not None:
+            record["params"] = _params(spec.combination)
+        self._write(record)
+
+    def write_verified(self, path, verified, written):
+        # type: (Text, Verified, Dict[Optional[int], int]) -> None
+        spec, errors, (cases_results, invariants_results), aggregates = verified
+        record = {
+            "event": "spec",
+            "path": path,
+            "passed": not has_failed(verified),
+            "errors": [{
+                "type": error.error_type,
+                "path": error.resource_path or [],
+                "message": error.message,
+            } for error in errors],
+        }  # type: Dict[Text, Any]
+        if spec is not None:
+            record["invariants"] = {"failed_rows": total(invariants_results), "reported_rows": written.get(None, 0)}
+            record["cases"] = [{
+                "case": i,
+                "where": [condition.expr for condition in case.where],
+                "failed_rows": total(cases_results[i]),
+                "reported_rows": written.get(i, 0),
+            } for i, case in enumerate(spec.cases)]
+            record["aggregates"] = [{"row": row, "failed": messages} for row, messages in aggregates]
+            if spec.combination is not None:
+                record["params"] = _params(spec.combination)
+            if spec.sampled is not None:
+                record["sampled_rows"] = spec.sampled
+        self._write(record)
+
+    def write_timing(self, path, cost):  # type: (Text, Cost) -> None
+        self._write({"event": "timing", "path": path, "seconds": cost.seconds, "bytes_processed": cost.bytes_processed})
+
+    def write_line(self, line):  # type: (Text) -> None
+        """Writes a line of another report, e.g. of a shard when merging them."""
+        with self._lock:
+            self.stream.write(line if line.endswith("\n") else line + "\n")
+
+    def _write(self, record):  # type: (Dict[Text, Any]) -> None
+        self.stream.write(json.dumps(record, sort_keys=True, default=Text) + "\n")
+
+
+class JUnitReporter(Reporter):
+    """Writes a JUnit XML test suite, with a test case for every failure as soon as it is found.
+
+    The test cases of a spec have its path as their class name. Each failed row is a failed "invariants" or
+    "case N" test case, and once the spec is verified, its passing invariants and cases are passing test cases,
+    and the failed rows beyond those written, its aggregates and its errors are test cases too.
+    """
+
+    def start(self):  # type: () -> None
+        name = "bqspec" if self.shard is None else "bqspec shard {}/{}".format(*self.shard)
+        self.stream.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n<testsuite name={}>\n'.format(
+            quoteattr(name)))
+
+    def end(self):  # type: () -> None
+        self.stream.write("</testsuite>\n</testsuites>\n")
+
+    def write_failure(self, path, spec, case, failure):  # type: (Text, Spec, Optional[int], Failure) -> None
+        row, messages = failure
+        self._testcase(path, _name(spec, case), "failure", "; ".join(messages),
+                       json.dumps(row, sort_keys=True, default=Text))
+
+    def write_verified(self, path, verified, written):
+        # type: (Text, Verified, Dict[Optional[int], int]) -> None
+        spec, errors, (cases_results, invariants_results), aggregates = verified
+        for error in errors:
+            self._testcase(path, error.error_type, "error", error.message, ">".join(error.resource_path or []))
+        if spec is None:
+            return
+
+        parts = [(None, invariants_results)] if spec.invariants or spec.columns else []
+        parts.extend(enumerate(cases_results))
+        for case, results in parts:
+            failed_rows = total(results)
+            if not failed_rows:
+                self._testcase(path, _name(spec, case))
+            elif failed_rows > written.get(case, 0):
+                omitted = failed_rows - written.get(case, 0)
+                self._testcase(path, _name(spec, case), "failure", "{} more failed rows".format(omitted))
+
+        if spec.aggregates and not aggregates:
+            self._testcase(path, _name(spec, "aggregates"))
+        for row, messages in aggregates:
+            self._testcase(path, _name(spec, "aggregates"), "failure", "; ".join(messages),
+                           json.dumps(row, sort_keys=True, default=Text))
+
+    def _testcase(self, path, name, kind=None, message=None, text=""):
+        # type: (Text, Text, Optional[Text], Optional[Text], Text) -> None
+        attributes = "classname={} name={}".format(quoteattr(path), quoteattr(name))
+        if kind is None:
+            self.stream.write("<testcase {}/>\n".format(attributes))
+            return
+        self.stream.write("<testcase {}><{} message={}>{}</{}></testcase>\n".format(
+            attributes, kind, quoteattr(message), escape(text), kind))
+
+
+def _name(spec, case):  # type: (Spec, Any) -> Text
+    if case is None:
+        name = "invariants"
+    elif isinstance(case, int):
+        name = "case {}".format(case)
+    else:
+        name = case
+    if spec.combination is not None:
+        return "[{}] {}".format(describe(spec.combination), name)
+    return name
+
+
+REPORTERS = {
+    "jsonl": JsonLinesReporter,
+    "junit": JUnitReporter,
+}
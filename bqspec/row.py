@@ -0,0 +1,59 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Mapping, Text, Union
+
+from six.moves import builtins
+from six.moves.collections_abc import Mapping as MappingABC
+
+if TYPE_CHECKING:
+    import embexpr
+
+# the globals conditions are evaluated with, shared by every evaluation.
+GLOBALS = {"__builtins__": builtins}
+
+
+class RowView(MappingABC):
+    """A row of a query result, read as a mapping from field to value.
+
+    The rows of a result share one index from field to position, so a row costs no more than its values.
+    """
+
+    __slots__ = ("index", "values")
+
+    def __init__(self, index, values):  # type: (Dict[Text, int], tuple) -> None
+        self.index = index  # type: Dict[Text, int]
+        self.values = values  # type: tuple
+
+    def __getitem__(self, field):  # type: (Text) -> Any
+        return self.values[self.index[field]]
+
+    def __iter__(self):  # type: () -> Iterator[Text]
+        return iter(self.index)
+
+    def __len__(self):  # type: () -> int
+        return len(self.index)
+
+    def __repr__(self):  # type: () -> str
+        return repr(self.to_dict())
+
+    def to_dict(self):  # type: () -> dict
+        values = self.values
+        return {field: values[i] for field, i in self.index.items()}
+
+
+def row_views(fields, rows):  # type: (List[Text], Iterable[tuple]) -> Iterator[RowView]
+    index = {field: i for i, field in enumerate(fields)}
+    return (RowView(index, row) for row in rows)
+
+
+def evaluate(condition, row):  # type: (embexpr.Expr, Mapping[Text, Any]) -> Any
+    """Same as condition(**row), without copying row into keyword arguments for every condition."""
+    return eval(condition.code, GLOBALS, row)
+
+
+def to_record(row):  # type: (Union[RowView, dict]) -> dict
+    """Returns the row as the dict failures are reported with."""
+    if isinstance(row, RowView):
+        return row.to_dict()
+    return row
@@ -15,16 +15,45 @@ class RawCase(object):
         self.expected = expected  # type: List[Text]
 
 
+Value = Union[Text, int, float, bool, datetime.datetime, datetime.date]
+
+
+class RawRange(object):
+    def __init__(self, start=None, end=None, step=1):  # type: (Optional[Value], Optional[Value], int) -> None
+        self.start = start  # type: Optional[Value]
+        self.end = end  # type: Optional[Value]
+        self.step = step  # type: int
+
+
 class RawParam(object):
-    def __init__(self, type="", name="", value=""):  # type: (Text, Text, Text) -> None
+    def __init__(
+            self,
+            type="",  # type: Text
+            name="",  # type: Text
+            value="",  # type: Value
+            values=None,  # type: Optional[List[Value]]
+            range=None,  # type: Optional[dict]
+    ):  # type: (...) -> None
         self.type = type  # type: Text
         self.name = name  # type: Text
-        self.value = value  # type: Union[Text, int, float, bool, datetime.datetime, datetime.date]
+        self.value = value  # type: Value
+        # a param with values or a range is a dimension of the spec's parameter matrix.
+        self.values = values  # type: Optional[List[Value]]
+        self.range = RawRange(**range) if range is not None else None  # type: Optional[RawRange]
 
 
 class RawSpec(object):
-    def __init__(self, query_path, params=None, columns=None, invariants=None, cases=None):
-        # type: (Text, Optional[List[dict]], Optional[List[Text]], Optional[List[Text]], Optional[List[dict]]) -> None
+    def __init__(
+            self,
+            query_path=None,  # type: Optional[Text]
+            params=None,  # type: Optional[List[dict]]
+            columns=None,  # type: Optional[List[Text]]
+            invariants=None,  # type: Optional[List[Text]]
+            cases=None,  # type: Optional[List[dict]]
+            aggregates=None,  # type: Optional[List[Text]]
+            sample=None,  # type: Union[int, float, None]
+            table=None,  # type: Optional[Text]
+    ):  # type: (...) -> None
         if params is None:
             params = []
         if columns is None:
@@ -33,9 +62,16 @@ class RawSpec(object):
             invariants = []
         if cases is None:
             cases = []
+        if aggregates is None:
+            aggregates = []
 
-        self.query_path = query_path  # type: Text
+        # the SQL file of the query, or else the table, whose rows are verified.
+        self.query_path = query_path  # type: Optional[Text]
+        self.table = table  # type: Optional[Text]
         self.params = [RawParam(**param) for param in params]  # type: List[RawParam]
         self.columns = columns  # type: List[Text]
         self.invariants = invariants  # type: List[Text]
         self.cases = [RawCase(**case) for case in cases]  # type: List[RawCase]
+        self.aggregates = aggregates  # type: List[Text]
+        # the fraction (a float) or the number (an int) of rows the conditions are evaluated on.
+        self.sample = sample  # type: Union[int, float, None]
@@ -0,0 +1,72 @@
+# coding: utf-8
+from __future__ import division, unicode_literals
+
+import math
+from typing import Iterable, Iterator, Optional, Text, Union
+
+# rows are sampled by their hash modulo BUCKETS, so fractions are rounded to 1 / BUCKETS.
+BUCKETS = 1000000
+# the z score of the confidence bounds on violation rates.
+Z = 1.96
+CONFIDENCE = "95%"
+
+
+class Sample(object):
+    """A deterministic sample of the rows of a query: a fraction of them, or a number of them.
+
+    Rows are picked by the FARM_FINGERPRINT of their JSON, so reruns on the same rows sample the same rows.
+    """
+
+    def __init__(self, fraction=None, rows=None):  # type: (Optional[float], Optional[int]) -> None
+        self.fraction = fraction  # type: Optional[float]
+        self.rows = rows  # type: Optional[int]
+
+    def wrap(self, query):  # type: (Text) -> Text
+        query = query.strip().rstrip(";")
+        fingerprint = "FARM_FINGERPRINT(TO_JSON_STRING(`_bqspec_row`))"
+        if self.fraction is not None:
+            return "SELECT * FROM (\n{}\n) AS `_bqspec_row` WHERE ABS(MOD({}, {})) < {}".format(
+                query, fingerprint, BUCKETS, int(round(self.fraction * BUCKETS)))
+        return "SELECT * FROM (\n{}\n) AS `_bqspec_row` ORDER BY {} LIMIT {}".format(query, fingerprint, self.rows)
+
+    def __str__(self):  # type: () -> str
+        if self.fraction is not None:
+            return "{:g}% of rows".format(self.fraction * 100)
+        return "{} rows".format(self.rows)
+
+
+def to_sample(value):  # type: (Union[int, float, None]) -> Optional[Sample]
+    """Returns the sample of a spec's sample: a float is the fraction of rows, an int the number of rows."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        return Sample(fraction=value)
+    return Sample(rows=value)
+
+
+def upper_bound(failed, n, z=Z):  # type: (int, int, float) -> float
+    """The upper bound of the Wilson score interval of the rate of failed among n rows."""
+    if n == 0:
+        return 1.0
+    p = failed / n
+    center = p + z * z / (2 * n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return min(1.0, (center + margin) / (1 + z * z / n))
+
+
+class Counter(object):
+    """Passes rows through, counting them."""
+
+    def __init__(self, rows):  # type: (Iterable[tuple]) -> None
+        self.rows = iter(rows)  # type: Iterator[tuple]
+        self.count = 0  # type: int
+
+    def __iter__(self):  # type: () -> Counter
+        return self
+
+    def __next__(self):  # type: () -> tuple
+        row = next(self.rows)
+        self.count += 1
+        return row
+
+    next = __next__
@@ -0,0 +1,134 @@
+# coding: utf-8
+"""Splitting a run's specs across the nodes of a CI job, balanced by the cost of their earlier runs."""
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import os.path
+import threading
+import time
+from typing import Any, Dict, List, Optional, Text
+
+from .backend import Backend, Job
+
+VERSION = 1
+# bytes BigQuery scans in about a second, to weigh the bytes processed by a spec against its run time.
+BYTES_PER_SECOND = 1 << 30
+
+
+class Cost(object):
+    """The run time of a spec, and the bytes processed by its queries."""
+
+    def __init__(self, seconds, bytes_processed=0):  # type: (float, int) -> None
+        self.seconds = seconds  # type: float
+        self.bytes_processed = bytes_processed  # type: int
+
+    @property
+    def value(self):  # type: () -> float
+        return self.seconds + float(self.bytes_processed) / BYTES_PER_SECOND
+
+
+class Timings(object):
+    """The cost of each spec's last run, kept in a JSON file.
+
+    Every node of a sharded run must read the same file, so that they split the specs the same way.
+    """
+
+    def __init__(self, path):  # type: (Text) -> None
+        self.path = path  # type: Text
+        self.specs = {}  # type: Dict[Text, Dict[Text, Any]]
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):  # type: () -> None
+        try:
+            with io.open(self.path, encoding="utf-8") as f:
+                obj = json.loads(f.read())
+        except (IOError, OSError, ValueError):
+            # missing or broken timings only make the specs split by hash.
+            return
+        if isinstance(obj, dict) and obj.get("version") == VERSION:
+            self.specs = obj.get("specs", {})
+
+    def save(self):  # type: () -> None
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with self._lock:
+            with io.open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"version": VERSION, "specs": self.specs}, indent=2, sort_keys=True))
+            os.rename(tmp_path, self.path)
+
+    def record(self, path, cost):  # type: (Text, Cost) -> None
+        entry = {"seconds": cost.seconds, "bytes_processed": cost.bytes_processed, "time": time.time()}
+        with self._lock:
+            self.specs[os.path.normpath(path)] = entry
+
+    def cost(self, path):  # type: (Text) -> Optional[Cost]
+        entry = self.specs.get(os.path.normpath(path))
+        if entry is None:
+            return None
+        return Cost(entry["seconds"], entry["bytes_processed"])
+
+
+def assign(paths, count, timings=None):  # type: (List[Text], int, Optional[Timings]) -> List[List[Text]]
+    """Splits paths into count shards, the same way on every node given the same paths and timings.
+
+    With timings of some of the specs, the specs are assigned from the most costly one to the shard with the
+    least cost so far, those without timings costing the average of the others. Otherwise each spec goes to the
+    shard of a hash of its path.
+    """
+    paths = sorted(paths, key=os.path.normpath)
+    shards = [[] for _ in range(count)]  # type: List[List[Text]]
+    costs = {}  # type: Dict[Text, float]
+    if timings is not None:
+        for path in paths:
+            cost = timings.cost(path)
+            if cost is not None:
+                costs[path] = cost.value
+
+    if not costs:
+        for path in paths:
+            digest = hashlib.sha1(os.path.normpath(path).encode("utf-8")).hexdigest()
+            shards[int(digest, 16) % count].append(path)
+        return shards
+
+    default = sum(costs.values()) / len(costs)
+    loads = [0.0] * count
+    for path in sorted(paths, key=lambda path: -costs.get(path, default)):
+        i = loads.index(min(loads))
+        shards[i].append(path)
+        loads[i] += costs.get(path, default)
+    return [sorted(shard, key=os.path.normpath) for shard in shards]
+
+
+class MeteredBackend(Backend):
+    """Runs queries with backend, counting the bytes processed by the jobs which are not dry runs."""
+
+    def __init__(self, backend):  # type: (Backend) -> None
+        self.backend = backend  # type: Backend
+        self.jobs = []  # type: List[Job]
+
+    def submit(self, query, params, dry_run=False, maximum_bytes_billed=None):
+        # type: (Text, List[Any], bool, Optional[int]) -> Job
+        job = self.backend.submit(query, params, dry_run, maximum_bytes_billed)
+        if not dry_run:
+            self.jobs.append(job)
+        return job
+
+    def read_table(self, table):  # type: (Text) -> Job
+        job = self.backend.read_table(table)
+        self.jobs.append(job)
+        return job
+
+    def materialize(self, query, params, table, expiration, maximum_bytes_billed=None):
+        # type: (Text, List[Any], Text, float, Optional[int]) -> Optional[Job]
+        job = self.backend.materialize(query, params, table, expiration, maximum_bytes_billed)
+        if job is not None:
+            self.jobs.append(job)
+        return job
+
+    @property
+    def bytes_processed(self):  # type: () -> int
+        """The bytes processed by the jobs so far, once they are done."""
+        return sum(job.total_bytes_processed or 0 for job in self.jobs)
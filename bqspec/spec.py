@@ -1,13 +1,51 @@
 # coding: utf-8
 import codecs
-from typing import List, Optional, Text, Tuple
+import copy
+import itertools
+import json
+import operator
+import types
+from timeit import default_timer
+from typing import (TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Text,
+                    Tuple)
 
 import embexpr
-import google.cloud.bigquery as bq
-from six.moves import map
-from tqdm import tqdm
+from six.moves import builtins, map
 
+from .aggregate import RESULT_PREFIX, VALUE_PREFIX
+from .aggregate import build_query as build_aggregate_query
+from .astutil import referenced_names
+from .backend import InvalidQuery, Job, as_backend, param_name, table_query
+from .cache import CacheMissError, ResultCache
+from .condition import Condition, to_condition
+from .destination import Destination
+from .dispatch import CaseIndex
+from .failures import FIRST, UNKNOWN_COLUMN, FailureCollector, is_unknown_columns
+from .matrix import SET_COLUMN, SETS_PER_QUERY
+from .matrix import build_query as build_matrix_query
+from .matrix import is_matrix, param_values, set_params
+from .parallel import evaluate as evaluate_parallel
+from .profile import EXPECTED, INVARIANT, WHERE, Profile
+from .projection import MAX_MATCHED_ROWS, Projection, match_condition, project_query, projected_columns
+from .pushdown import build_filter, limit_query, wrap_query
+from .row import evaluate as evaluate_condition
+from .row import row_views, to_record
 from .rstruct import RawSpec
+from .sample import Counter, Sample, to_sample
+from .vectorized import evaluate as evaluate_vectorized
+
+if TYPE_CHECKING:
+    # google.cloud.bigquery takes a while to import, so it is imported when a query runs.
+    import google.cloud.bigquery as bq
+
+    from .backend import Client
+
+Failure = Tuple[dict, List[Text]]
+Results = Tuple[List[List[Failure]], List[Failure]]
+Fetched = Tuple[List[Text], Iterator[tuple]]
+
+GENERATED_PREFIX = "_bqspec_"
+_NOT_COMPILED = object()
 
 
 class Case(object):
@@ -19,11 +57,15 @@ class Case(object):
 class Spec(object):
     def __init__(
             self,
-            query_path,  # type: Text
+            query_path,  # type: Optional[Text]
             params=None,  # type: Optional[List[bq.ScalarQueryParameter]]
             columns=None,  # type: Optional[List[Text]]
             invariants=None,  # type: Optional[List[embexpr.Expr]]
-            cases=None  # type: Optional[List[Case]]
+            cases=None,  # type: Optional[List[Case]]
+            aggregates=None,  # type: Optional[List[Text]]
+            matrix=None,  # type: Optional[List[List[bq.ScalarQueryParameter]]]
+            sample=None,  # type: Optional[Sample]
+            table=None,  # type: Optional[Text]
     ):  # (...) -> None
         if params is None:
             params = []
@@ -33,54 +75,775 @@ class Spec(object):
             invariants = []
         if cases is None:
             cases = []
+        if aggregates is None:
+            aggregates = []
+        if matrix is None:
+            matrix = []
 
-        self.query_path = query_path  # type: Text
+        # the SQL file of the query, or else the table, whose rows are verified.
+        self.query_path = query_path  # type: Optional[Text]
+        self.table = table  # type: Optional[Text]
         self.params = params  # type: List[bq.ScalarQueryParameter]
+        # every combination of the matrix params, which the spec is verified with along with params.
+        self.matrix = matrix  # type: List[List[bq.ScalarQueryParameter]]
+        # the matrix params of a spec returned by expand.
+        self.combination = None  # type: Optional[List[bq.ScalarQueryParameter]]
         self.columns = columns  # type: List[Text]
         self.invariants = invariants  # type: List[embexpr.Expr]
         self.cases = cases  # type: List[Case]
+        self.aggregates = aggregates  # type: List[Text]
+        self.case_index = CaseIndex(cases)  # type: CaseIndex
+        # compiled when the spec is first evaluated, so that loading specs does not compile them.
+        self._compiled = _NOT_COMPILED  # type: Any
+        # the projection used by the last verify.
+        self.projection = None  # type: Optional[Projection]
+        # the profile of the last verify, if it was profiled.
+        self.profile = None  # type: Optional[Profile]
+        # BigQuery fails the query jobs which would bill more.
+        self.max_bytes_billed = None  # type: Optional[int]
+        # the conditions are evaluated on a sample of the rows, if set.
+        self.sample = sample  # type: Optional[Sample]
+        # the rows of the sample evaluated by the last verify.
+        self.sampled = None  # type: Optional[int]
+        # the table the result of the query is written to, and read from by later runs, if set.
+        self.destination = None  # type: Optional[Destination]
+        # the table holding the result of the query, once materialize wrote or found it.
+        self.materialized = None  # type: Optional[Text]
 
-    def execute_query(self):
+    @property
+    def source(self):  # type: () -> Text
+        """The query_path or the table of the spec, to name it in reports."""
+        return self.query_path if self.query_path is not None else self.table
+
+    def read_query(self):  # type: () -> Text
+        """The query of the spec's rows: its SQL, or a query of its table or of its materialized result."""
+        table = self.result_table()
+        if table is not None:
+            return table_query(table)
         with codecs.open(self.query_path, encoding="utf-8") as f:
-            query = f.read()
-        client = bq.Client()
+            return f.read()
+
+    def result_table(self):  # type: () -> Optional[Text]
+        """The table holding the spec's rows: its table, or the table its query result was materialized to."""
+        return self.materialized if self.materialized is not None else self.table
+
+    def query_params(self):  # type: () -> List[bq.ScalarQueryParameter]
+        """The params of the spec's queries, none once they read its materialized result."""
+        return self.params if self.materialized is None else []
+
+    def materialize(self, client=None, cache=None, destination=None):
+        # type: (Optional[Client], Optional[ResultCache], Optional[Destination]) -> Optional[Text]
+        """Writes the result of the query to the table of destination, by default the spec's destination, so that
+        the queries of the spec read that table instead of running the query. A table which already holds the
+        result and does not expire soon is reused without running the query, see Backend.materialize.
+
+        Returns the table, or None if the spec is not materialized: without a destination, with a table or a
+        matrix of params, or when replaying an offline cache.
+        """
+        if self.materialized is not None:
+            return self.materialized
+        if destination is None:
+            destination = self.destination
+        if destination is None or self.table is not None or self.matrix or self.combination is not None:
+            return None
+        if cache is not None and cache.offline:
+            return None
+        as_backend(client).materialize(self.read_query(), self.params, destination.table, destination.expiration,
+                                       self.max_bytes_billed)
+        self.materialized = destination.table
+        return self.materialized
+
+    def row_query(self):  # type: () -> Text
+        """The query whose rows the conditions are evaluated on: the query, or its sample."""
+        query = self.read_query()
+        if self.sample is not None:
+            return self.sample.wrap(query)
+        return query
+
+    def query_key(self):  # type: () -> Tuple[Text, Tuple[Text, ...]]
+        """Identifies the result of the query: specs with the same key get the same rows."""
+        lines = self.read_query().strip().rstrip(";").splitlines()
+        query = "\n".join(line.rstrip() for line in lines)
+        if self.sample is not None:
+            query = self.sample.wrap(query)
+        params = tuple(json.dumps(param.to_api_repr(), sort_keys=True, default=repr) for param in self.params)
+        return query, params
+
+    def run_query(self, client=None, query=None, dry_run=False, params=None):
+        # type: (Optional[Client], Optional[Text], bool, Optional[List[bq.ScalarQueryParameter]]) -> Job
+        """Runs the query with client, a Backend or a BigQuery client. BigQuery runs it by default."""
+        if query is None:
+            query = self.row_query()
+        if params is None:
+            params = self.query_params()
+        return as_backend(client).submit(query, params, dry_run, self.max_bytes_billed)
+
+    def fetch(self, client=None, cache=None, query=None, params=None):
+        # type: (Optional[Client], Optional[ResultCache], Optional[Text], Optional[List[Any]]) -> Fetched
+        """Fetches the fields and the rows of query, by default of the spec's rows.
+
+        The spec's rows are materialized first if it has a destination, and the rows of a table, unless sampled,
+        are read from it without running a query.
+        """
+        table = None  # type: Optional[Text]
+        if query is None:
+            self.materialize(client, cache)
+            query = self.row_query()
+            if self.sample is None:
+                table = self.result_table()
+        if params is None:
+            params = self.query_params()
+        if cache is not None:
+            key = cache.key(query, params)
+            cached = cache.load(key)
+            if cached is not None:
+                return cached
+            if cache.offline:
+                raise CacheMissError(key)
+
+        if table is not None:
+            query_job = as_backend(client).read_table(table)
+        else:
+            query_job = self.run_query(client, query, params=params)
+        fields = query_job.fields
+        rows = job_rows(query_job)
+        if cache is not None:
+            rows = cache.store(key, fields, rows)
+        return fields, rows
+
+    def fetch_failure_candidates(self, client=None, cache=None, columns=None):
+        # type: (Optional[Client], Optional[ResultCache], Optional[List[Text]]) -> Optional[Fetched]
+        """Fetches only the rows which may fail, or returns None if the conditions can not be pushed down."""
+        condition = build_filter(self)
+        if condition is None:
+            return None
+        query = wrap_query(self.row_query(), condition)
+        if columns is not None:
+            query = project_query(query, columns)
+        try:
+            return self.fetch(client, cache, query)
+        except InvalidQuery:
+            # the translated conditions do not type check against the query result.
+            return None
+
+    def dry_run(self, client=None, query=None, params=None):
+        # type: (Optional[Client], Optional[Text], Optional[List[Any]]) -> Tuple[List[Text], Optional[int]]
+        """Returns the fields of the query result and the bytes BigQuery would process for it."""
+        query_job = self.run_query(client, query, dry_run=True, params=params)
+        return query_job.fields, query_job.total_bytes_processed
+
+    def estimate(self, client=None, rows=True, pushdown=False, projection=False):
+        # type: (Optional[Client], bool, bool, bool) -> int
+        """Returns the bytes the queries of verify and verify_aggregates would process, from dry runs.
+
+        With a matrix, the queries are those of every combination. Without rows, the query of the rows is left
+        out, e.g. for a spec whose rows are fetched by another spec with the same query. With pushdown and
+        projection, the queries of the rows are those verify runs with them, see estimate_rows.
+        """
+        estimated = 0
+        queries = []  # type: List[Text]
+        if rows and (self.invariants or self.cases or self.columns):
+            if self.matrix:
+                queries.append(self.row_query())
+            else:
+                estimated += self.estimate_rows(client, pushdown, projection)
+        if self.aggregates:
+            queries.append(build_aggregate_query(self.read_query(), self.aggregates)[0])
+        for query in queries:
+            if not self.matrix:
+                estimated += self.dry_run(client, query)[1] or 0
+                continue
+            for matrix_query, params in self.matrix_queries(query):
+                estimated += self.dry_run(client, matrix_query, params)[1] or 0
+        return estimated
+
+    def estimate_rows(self, client=None, pushdown=False, projection=False):
+        # type: (Optional[Client], bool, bool) -> int
+        """Returns the bytes the queries of the rows in verify would process, from dry runs.
+
+        With projection, the query fetching the full rows of failures is counted, as if some rows failed: it
+        processes as many bytes as the whole query. With pushdown, the query of the rows which may fail is
+        counted, with the query of the first row reporting unknown columns if there are some.
+        """
+        if not self.invariants and not self.cases:
+            return self.dry_run(client, limit_query(self.read_query(), 1))[1] or 0
+        fields, total_bytes = self.dry_run(client, self.row_query())
+        columns = projected_columns(self, fields) if projection else None
+        estimated = 0
+        query = self.row_query()
+        if columns is not None:
+            query = project_query(query, columns)
+            fields = columns
+            # see fetch_full_rows.
+            estimated += total_bytes or 0
+        condition = build_filter(self) if pushdown and self.sample is None else None
+        if condition is not None:
+            filtered = wrap_query(self.row_query(), condition)
+            if columns is not None:
+                filtered = project_query(filtered, columns)
+            try:
+                estimated += self.dry_run(client, filtered)[1] or 0
+            except InvalidQuery:
+                # verify reads every row instead, see fetch_failure_candidates.
+                pass
+            else:
+                if self.columns and any(field not in self.columns for field in fields):
+                    estimated += self.dry_run(client, limit_query(query, 1))[1] or 0
+                return estimated
+        if columns is None:
+            return estimated + (total_bytes or 0)
+        return estimated + (self.dry_run(client, query)[1] or 0)
+
+    @property
+    def compiled(self):  # type: () -> Optional[Compiled]
+        """The conditions fused by compile_conditions."""
+        if self._compiled is _NOT_COMPILED:
+            self._compiled = compile_conditions(self)
+        return self._compiled
+
+    def expand(self):  # type: () -> List[Spec]
+        """Returns a spec for every combination of the matrix params, with the params and the combination."""
+        compiled = self.compiled
+        specs = []  # type: List[Spec]
+        for combination in self.matrix:
+            spec = copy.copy(self)
+            spec._compiled = compiled
+            spec.params = self.params + combination
+            spec.matrix = []
+            spec.combination = combination
+            specs.append(spec)
+        return specs
+
+    def matrix_queries(self, query):  # type: (Text) -> List[Tuple[Text, List[bq.ScalarQueryParameter]]]
+        """Builds the queries running query with every combination of the matrix params, with their params.
+
+        Each query runs SETS_PER_QUERY combinations, and its rows start with SET_COLUMN, the index of their
+        combination among those of the query.
+        """
+        names = [param_name(param) for param in self.matrix[0]]
+        queries = []
+        for start in range(0, len(self.matrix), SETS_PER_QUERY):
+            sets = self.matrix[start:start + SETS_PER_QUERY]
+            queries.append((build_matrix_query(query, names, len(sets)), self.params + set_params(sets)))
+        return queries
+
+    def project(self, client=None):  # type: (Optional[Client]) -> Optional[Projection]
+        """Finds the columns of the query result the conditions need, or returns None if they need every column."""
+        query = self.row_query()
+        fields, total_bytes = self.dry_run(client, query)
+        columns = projected_columns(self, fields)
+        if columns is None:
+            return None
+        _, projected_bytes = self.dry_run(client, project_query(query, columns))
+        return Projection(fields, columns, total_bytes, projected_bytes)
+
+    def fetch_full_rows(self, results, client=None, cache=None):
+        # type: (Results, Optional[Client], Optional[ResultCache]) -> None
+        """Replaces the projected rows of the failures with full rows of the query result having their values.
+
+        Rows with values which can not be written as literals, and rows beyond MAX_MATCHED_ROWS, are left projected.
+        """
+        cases, messages = results
+        rows = {id(row): row for failures in cases + [messages] for row, _ in failures}
+        # the row reported with unknown columns is the first row of the query, which may be a failed row too.
+        first_rows = {id(row) for row, failed in messages if is_unknown_columns(failed)}
+        conditions = {}  # type: Dict[int, Text]
+        for key, row in rows.items():
+            condition = match_condition(row)
+            if condition is not None:
+                conditions[key] = condition
+            if len(conditions) >= MAX_MATCHED_ROWS:
+                break
+        if not conditions:
+            return
+
+        condition = "\n   OR ".join("({})".format(condition) for condition in sorted(set(conditions.values())))
+        query = wrap_query(self.row_query(), condition)
+        if self.projection is not None and not (cache is not None and cache.offline):
+            # the query scans the full rows again, which counts against the bytes the projection saved.
+            self.projection.refetched_bytes = self.dry_run(client, query)[1]
+        fields, full_rows = self.fetch(client, cache, query)
+        found = {}  # type: Dict[int, dict]
+        try:
+            for full_row in to_dicts(fields, full_rows):
+                # each full row is given to one failed row: failed rows with the same projected values are
+                # different rows of the result, so they get different full rows.
+                given = False
+                for key in conditions:
+                    if key in found or (given and key not in first_rows):
+                        continue
+                    if all(full_row[column] == value for column, value in rows[key].items()):
+                        found[key] = full_row
+                        given = given or key not in first_rows
+                if len(found) == len(conditions):
+                    break
+        finally:
+            _close(full_rows)
+
+        for failures in cases + [messages]:
+            for i, (row, failed) in enumerate(failures):
+                if id(row) in found:
+                    failures[i] = (found[id(row)], failed)
+
+    def execute_query(self, client=None, cache=None, destination=None):
+        # type: (Optional[Client], Optional[ResultCache], Optional[Destination]) -> Iterator[dict]
+        """Returns the rows of the query. With destination, or the spec's destination, they are written to its
+        table, or read from it if an earlier run wrote them and it has not expired, see materialize.
+        """
+        self.materialize(client, cache, destination)
+        fields, rows = self.fetch(client, cache)
+        return to_dicts(fields, rows)
+
+    def verify(
+            self,
+            client=None,  # type: Optional[Client]
+            progress=True,  # type: bool
+            cache=None,  # type: Optional[ResultCache]
+            pushdown=False,  # type: bool
+            vectorized=False,  # type: bool
+            max_examples=None,  # type: Optional[int]
+            sampling=FIRST,  # type: Text
+            max_failures=None,  # type: Optional[int]
+            projection=False,  # type: bool
+            fetched=None,  # type: Optional[Fetched]
+            profile=None,  # type: Optional[Profile]
+            workers=1,  # type: int
+            on_failure=None,  # type: Optional[Callable[[Optional[int], Failure], None]]
+    ):  # type: (...) -> Results
+        """Runs the query and evaluates the conditions on its rows.
+
+        Every case and the invariants keep at most max_examples failures, sampled by sampling, along with their
+        exact count. Once max_failures failures are found, the query job is cancelled.
+
+        With projection, only the columns the conditions need are fetched, and full rows are fetched for the
+        kept failures afterwards. It needs dry runs, so it is skipped when replaying a cache offline.
+
+        fetched is the result of the query, fetched by the caller, to evaluate instead of running the query.
+        pushdown and projection do not apply to it.
+
+        With a destination, the result of the query is materialized first, and the queries read its table.
+
+        With profile, every condition is evaluated on its own to record its counts and time, which is slower.
+        With more than one worker, rows are evaluated in batches by that many processes.
+        With a sample, the rows of the sample are counted in sampled. pushdown does not apply, since it would
+        leave the passing rows of the sample uncounted.
+
+        With on_failure, the failures are passed to it as they are found, with their case or None for the
+        invariants, and the results only count them. sampling must be FIRST then. projection does not apply, since
+        the failures would be passed on with their projected rows, before their full rows are fetched.
+        """
+        collector = FailureCollector(len(self.cases), max_examples, sampling, max_failures, on_failure)
+        self.profile = profile
+        self.sampled = None
+        if fetched is None:
+            self.materialize(client, cache)
+        if self.sample is not None:
+            pushdown = False
+        if on_failure is not None:
+            projection = False
+        if not self.invariants and not self.cases:
+            # only the aggregates are checked, which verify_aggregates does in BigQuery.
+            self.projection = None
+            if self.columns:
+                if fetched is None:
+                    fetched = self.fetch(client, cache, limit_query(self.read_query(), 1))
+                fields, rows = fetched
+                for row in to_dicts(fields, rows):
+                    collector.add_invariants(self.unknown_columns(row))
+                    break
+            if fetched is not None:
+                _close(fetched[1])
+            return collector.results()
+
+        self.projection = None
+        columns = None  # type: Optional[List[Text]]
+        filtered = False
+        if fetched is None:
+            if projection and not (cache is not None and cache.offline):
+                self.projection = self.project(client)
+            columns = self.projection.columns if self.projection is not None else None
+
+            fetched = self.fetch_failure_candidates(client, cache, columns) if pushdown else None
+            filtered = fetched is not None
+            if not filtered:
+                query = project_query(self.row_query(), columns) if columns is not None else None
+                fetched = self.fetch(client, cache, query)
+        fields, rows = fetched
+        if filtered and self.columns and any(field not in self.columns for field in fields):
+            # the unknown columns are reported with the first row of the query, as without pushdown, not with the
+            # first row which may fail.
+            query = self.row_query()
+            if columns is not None:
+                query = project_query(query, columns)
+            try:
+                first_fields, first_rows = self.fetch(client, cache, limit_query(query, 1))
+                for row in to_dicts(first_fields, first_rows):
+                    collector.add_invariants(self.unknown_columns(row))
+            except Exception:
+                _close(rows)
+                raise
+
+        from tqdm import tqdm
+        start = default_timer()
+        waited = _fetch_seconds(profile)
+        counted = Counter(rows) if self.sample is not None else rows
+        check_columns = not filtered
+        try:
+            if profile is not None:
+                self.evaluate_profiled(row_views(fields, tqdm(counted, disable=not progress)), profile, collector,
+                                       check_columns)
+            elif workers > 1:
+                evaluate_parallel(self, fields, tqdm(counted, disable=not progress), workers, collector,
+                                  check_columns=check_columns)
+            elif vectorized:
+                evaluate_vectorized(self, fields, tqdm(counted, disable=not progress), collector=collector,
+                                    check_columns=check_columns)
+            else:
+                self.evaluate_tuples(fields, tqdm(counted, disable=not progress), collector, check_columns)
+        finally:
+            _close(rows)
+            self.sampled = counted.count if isinstance(counted, Counter) else None
+            if profile is not None:
+                profile.evaluate_seconds += default_timer() - start - (_fetch_seconds(profile) - waited)
+
+        if columns is not None:
+            self.fetch_full_rows(collector.results(), client, cache)
+        return collector.results()
+
+    def verify_aggregates(self, client=None, cache=None):
+        # type: (Optional[Client], Optional[ResultCache]) -> List[Failure]
+        """Evaluates the aggregates in one query, returning the aggregate values with the failed aggregates."""
+        if not self.aggregates:
+            return []
+        self.materialize(client, cache)
+        query, values = build_aggregate_query(self.read_query(), self.aggregates)
+        fields, rows = self.fetch(client, cache, query)
+        failures = []  # type: List[Failure]
+        for row in to_dicts(fields, rows):
+            failures.extend(self.aggregate_failures(row, values))
+        return failures
+
+    def verify_matrix_aggregates(self, client=None, cache=None):
+        # type: (Optional[Client], Optional[ResultCache]) -> List[List[Failure]]
+        """Same as verify_aggregates for every combination of the matrix, in one query per SETS_PER_QUERY."""
+        if not self.aggregates:
+            return [[] for _ in self.matrix]
+        query, values = build_aggregate_query(self.read_query(), self.aggregates)
+        failures = []  # type: List[List[Failure]]
+        for matrix_query, params in self.matrix_queries(query):
+            fields, rows = self.fetch(client, cache, matrix_query, params)
+            by_set = {row[SET_COLUMN]: self.aggregate_failures(row, values) for row in to_dicts(fields, rows)}
+            failures.extend(by_set[i] for i in range(len(by_set)))
+        return failures
 
-        query_job = client.query(query)
-        query_job.use_legacy_sql = False
-        query_job.query_parameters = self.params
-        query_job.run()
+    def aggregate_failures(self, row, values):  # type: (dict, List[Text]) -> List[Failure]
+        """Returns the aggregate values with the failed aggregates, from a row of the aggregate query."""
+        computed = {value: row[VALUE_PREFIX + str(i)] for i, value in enumerate(values)}
+        failed = [aggregate for i, aggregate in enumerate(self.aggregates) if not row[RESULT_PREFIX + str(i)]]
+        if not failed:
+            return []
+        return [(computed, failed)]
 
-        def convert_dict(row):
-            return {field.name: row[i] for i, field in enumerate(query_job.schema)}
+    def evaluate(self, rows, collector=None, check_columns=True):
+        # type: (Iterable[Mapping[Text, Any]], Optional[FailureCollector], bool) -> Results
+        """Evaluates the conditions on rows, dicts or RowViews. Failed RowViews are reported as dicts.
 
-        return map(convert_dict, query_job.rows)
+        Unless check_columns is False, the first row is checked for columns unknown to the spec.
+        """
+        if collector is None:
+            collector = FailureCollector(len(self.cases))
+        first = check_columns
+        for row in rows:
+            if collector.stopped:
+                break
+            if first and self.columns:
+                first = False
+                unknown = self.unknown_columns(to_record(row))
+                if unknown:
+                    collector.add_invariants(unknown)
+
+            record = None  # type: Optional[dict]
+            failed = [invariant.expr for invariant in self.invariants if not evaluate_condition(invariant, row)]
+            if failed:
+                record = to_record(row)
+                collector.add_invariants((record, failed))
 
-    def verify(self):  # type: () -> Tuple[List[List[Tuple[dict, List[Text]]]], List[Tuple[dict, List[Text]]]]
-        cases = [[] for _ in range(len(self.cases))]
-        messages = []
-        first = True
-        for row in tqdm(self.execute_query()):
+            for i in self.case_index.matches(row):
+                unexpected = [
+                    condition.expr for condition in self.cases[i].expected if not evaluate_condition(condition, row)
+                ]
+                if unexpected:
+                    if record is None:
+                        record = to_record(row)
+                    collector.add_case(i, (record, unexpected))
+        return collector.results()
+
+    def evaluate_profiled(self, rows, profile, collector=None, check_columns=True):
+        # type: (Iterable[Mapping[Text, Any]], Profile, Optional[FailureCollector], bool) -> Results
+        """Same as evaluate, but records the evaluations of every condition in profile.
+
+        Cases are not looked up in the case index: the where conditions of every case are evaluated on every row.
+        """
+        if collector is None:
+            collector = FailureCollector(len(self.cases))
+        invariants = [(condition, profile.condition(INVARIANT, condition.expr)) for condition in self.invariants]
+        cases = [([(condition, profile.condition(WHERE, condition.expr, i)) for condition in case.where],
+                  [(condition, profile.condition(EXPECTED, condition.expr, i)) for condition in case.expected])
+                 for i, case in enumerate(self.cases)]
+        first = check_columns
+        for row in rows:
+            if collector.stopped:
+                break
             if first and self.columns:
                 first = False
-                unknown_columns = [key for key in row.keys() if key not in self.columns]
-                if unknown_columns:
-                    messages.append(
-                        (row, ['"{}" is unknown column'.format(unknown_column) for unknown_column in unknown_columns]))
+                unknown = self.unknown_columns(to_record(row))
+                if unknown:
+                    collector.add_invariants(unknown)
 
-            failed = [invariant.expr for invariant in self.invariants if not invariant(**row)]
+            record = None  # type: Optional[dict]
+            failed = [condition.expr for condition, stats in invariants if not stats.evaluate(condition, row)]
             if failed:
-                messages.append((row, failed))
+                record = to_record(row)
+                collector.add_invariants((record, failed))
 
-            for i, case in enumerate(self.cases):
-                if all(condition(**row) for condition in case.where):
-                    unexpected = [condition.expr for condition in case.expected if not condition(**row)]
+            for i, (where, expected) in enumerate(cases):
+                if all(stats.evaluate(condition, row) for condition, stats in where):
+                    unexpected = [condition.expr for condition, stats in expected if not stats.evaluate(condition, row)]
                     if unexpected:
-                        cases[i].append((row, unexpected))
-        return cases, messages
+                        if record is None:
+                            record = to_record(row)
+                        collector.add_case(i, (record, unexpected))
+        return collector.results()
+
+    def evaluate_tuples(self, fields, rows, collector=None, check_columns=True):
+        # type: (List[Text], Iterable[tuple], Optional[FailureCollector], bool) -> Results
+        """Same as evaluate, but takes row tuples and runs the compiled conditions on them."""
+        check = self.bind(fields)
+        if check is None:
+            return self.evaluate(row_views(fields, rows), collector, check_columns)
+
+        if collector is None:
+            collector = FailureCollector(len(self.cases))
+        conditions = self.compiled.conditions
+        first = check_columns
+        for row in rows:
+            if collector.stopped:
+                break
+            if first and self.columns:
+                first = False
+                unknown = self.unknown_columns(to_dict(fields, row))
+                if unknown:
+                    collector.add_invariants(unknown)
+
+            failed = check(row)
+            if not failed:
+                continue
+
+            record = to_dict(fields, row)
+            invariants = []  # type: List[Text]
+            unexpected = {}  # type: Dict[int, List[Text]]
+            for k in failed:
+                case, expr = conditions[k]
+                if case is None:
+                    invariants.append(expr)
+                else:
+                    unexpected.setdefault(case, []).append(expr)
+            if invariants:
+                collector.add_invariants((record, invariants))
+            for case in sorted(unexpected):
+                collector.add_case(case, (record, unexpected[case]))
+        return collector.results()
+
+    def bind(self, fields):  # type: (List[Text]) -> Optional[Callable[[tuple], List[int]]]
+        """Returns a function which takes a row tuple of fields and returns the failed compiled conditions.
+
+        Returns None if the conditions are not compiled or refer to names which are neither fields nor builtins.
+        """
+        compiled = self.compiled
+        if compiled is None:
+            return None
+
+        positions = {field: i for i, field in enumerate(fields)}
+        extras = []  # type: List[object]
+        arg_positions = []  # type: List[int]
+        for name in compiled.names:
+            if name in positions:
+                arg_positions.append(positions[name])
+            elif hasattr(builtins, name):
+                arg_positions.append(len(fields) + len(extras))
+                extras.append(getattr(builtins, name))
+            else:
+                return None
+
+        tables = []
+        for columns, table, indices in self.case_index.tables:
+            if any(column not in positions for column in columns):
+                return None
+            tables.append((tuple_getter([positions[column] for column in columns]), table, indices))
+
+        get_args = tuple_getter(arg_positions)
+        if extras:
+            get_args = (lambda get, extras: lambda row: get(tuple(row) + extras))(get_args, tuple(extras))
+
+        functions = compiled.functions()
+        check = functions[GENERATED_PREFIX + "check"]
+        where = functions[GENERATED_PREFIX + "where"]
+
+        def bound(row):
+            args = get_args(row)
+            matched = []
+            for get_key, table, indices in tables:
+                try:
+                    matched.extend(table.get(get_key(row), ()))
+                except TypeError:
+                    # an unhashable value, let the conditions decide.
+                    matched.extend(i for i in indices if where[i](*args))
+            return check(matched, *args)
+
+        return bound
+
+    def unknown_columns(self, row):  # type: (dict) -> Optional[Failure]
+        unknown_columns = [key for key in row.keys() if key not in self.columns]
+        if not unknown_columns:
+            return None
+        return row, [UNKNOWN_COLUMN.format(unknown_column) for unknown_column in unknown_columns]
+
+
+def _close(rows):  # type: (Iterable[tuple]) -> None
+    close = getattr(rows, "close", None)
+    if close is not None:
+        close()
+
+
+def _fetch_seconds(profile):  # type: (Optional[Profile]) -> float
+    if profile is None:
+        return 0.0
+    return sum(query.fetch_seconds for query in profile.queries)
+
+
+def job_rows(query_job):  # type: (Job) -> Iterator[tuple]
+    """Iterates the rows of the job, and cancels the job if the iteration is abandoned."""
+    done = False
+    try:
+        for row in query_job.rows():
+            yield row
+        done = True
+    finally:
+        if not done:
+            query_job.cancel()
+
+
+def to_dict(fields, row):  # type: (List[Text], Sequence) -> dict
+    return {field: row[i] for i, field in enumerate(fields)}
+
+
+def to_dicts(fields, rows):  # type: (List[Text], Iterable[tuple]) -> Iterator[dict]
+    def convert_dict(row):
+        return to_dict(fields, row)
+
+    return map(convert_dict, rows)
+
+
+def tuple_getter(positions):  # type: (List[int]) -> Callable[[Sequence], tuple]
+    if not positions:
+        return lambda row: ()
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda row: (row[position], )
+    return operator.itemgetter(*positions)
+
+
+class Compiled(object):
+    """All conditions of a spec fused into generated python code.
+
+    The generated ``check(matched, *values)`` takes the indexed cases matched by a row and the row's values of
+    ``names``, and returns the indices of the failed conditions in ``conditions``. The generated ``where`` maps
+    each indexed case to a function evaluating its where with the same arguments.
+    """
+
+    def __init__(self, code, names, conditions):
+        # type: (types.CodeType, List[Text], List[Tuple[Optional[int], Text]]) -> None
+        self.code = code  # type: types.CodeType
+        self.names = names  # type: List[Text]
+        self.conditions = conditions  # type: List[Tuple[Optional[int], Text]]
+
+    def functions(self):  # type: () -> dict
+        namespace = {"__builtins__": builtins}
+        exec(self.code, namespace)
+        return namespace
+
+
+def compile_conditions(spec):  # type: (Spec) -> Optional[Compiled]
+    """Generates and compiles one function evaluating every invariant and case of the spec.
+
+    Returns None if the conditions can not be compiled together, or if a condition was not parsed and checked by
+    embexpr, see bqspec.condition: its text is pasted into the generated code, so it must only hold the names,
+    calls and operators embexpr allows. Such conditions are evaluated one by one, and fail as embexpr does.
+    """
+    parsed = list(spec.invariants)
+    for case in spec.cases:
+        parsed.extend(case.where + case.expected)
+    if not all(isinstance(condition, Condition) for condition in parsed):
+        return None
+    exprs = [condition.expr for condition in parsed]
+    try:
+        names = sorted(set().union(*[referenced_names(expr) for expr in exprs]))
+    except SyntaxError:
+        return None
+    if any(name.startswith(GENERATED_PREFIX) for name in names):
+        return None
+
+    p = GENERATED_PREFIX
+    args = ", ".join(names)
+    conditions = []  # type: List[Tuple[Optional[int], Text]]
+    lines = []  # type: List[Text]
+
+    def append_checks(case, expected, indent):  # type: (Optional[int], List[embexpr.Expr], Text) -> None
+        for condition in expected:
+            lines.extend([indent + "if not (", condition.expr, indent + "):"])
+            lines.append("{}    {}failed.append({})".format(indent, p, len(conditions)))
+            conditions.append((case, condition.expr))
+
+    def conjunction(where):  # type: (List[embexpr.Expr]) -> Text
+        return " and ".join("(\n{}\n)".format(condition.expr) for condition in where)
+
+    indexed = {i for _, _, indices in spec.case_index.tables for i in indices}
+    for i in sorted(indexed):
+        case = spec.cases[i]
+        lines.append("def {}where_{}({}):".format(p, i, args))
+        lines.append("    return bool({})".format(conjunction(case.where)))
+        lines.append("def {}expected_{}({}):".format(p, i, args))
+        lines.append("    {}failed = []".format(p))
+        append_checks(i, case.expected, "    ")
+        lines.append("    return {}failed".format(p))
+    for kind in ("where", "expected"):
+        lines.append("{0}{1} = {{{2}}}".format(p, kind, ", ".join("{0}: {1}{2}_{0}".format(i, p, kind)
+                                                                 for i in sorted(indexed))))
+
+    lines.append("def {0}check({1}):".format(p, ", ".join([p + "matched"] + names)))
+    lines.append("    {}failed = []".format(p))
+    append_checks(None, spec.invariants, "    ")
+    for i, case in enumerate(spec.cases):
+        if i in indexed or not case.expected:
+            continue
+        if case.where:
+            lines.append("    if {}:".format(conjunction(case.where)))
+            append_checks(i, case.expected, "        ")
+        else:
+            append_checks(i, case.expected, "    ")
+    lines.append("    for {0}i in {0}matched:".format(p))
+    lines.append("        {0}failed.extend({0}expected[{0}i]({1}))".format(p, args))
+    lines.append("    return {}failed".format(p))
+
+    try:
+        code = compile("\n".join(lines) + "\n", "<bqspec>", "exec")
+    except SyntaxError:
+        return None
+    return Compiled(code, names, conditions)
 
 
 def to_conditions(conditions):  # type: (List[Text]) -> List[embexpr.Expr]
-    return [embexpr.Expr(condition) for condition in conditions]
+    return [to_condition(condition) for condition in conditions]
 
 
 def from_dict(d):  # type: (dict) -> Spec
@@ -88,12 +851,20 @@ def from_dict(d):  # type: (dict) -> Spec
 
 
 def from_struct(raw_spec):  # type: (RawSpec) -> Spec
+    import google.cloud.bigquery as bq
+
     query_path = raw_spec.query_path
     params = [
         bq.ScalarQueryParameter(param.name.encode("latin-1"), param.type.encode("latin-1"), param.value)
-        for param in raw_spec.params
+        for param in raw_spec.params if not is_matrix([param])
     ]
+    dimensions = [param for param in raw_spec.params if is_matrix([param])]
+    matrix = [[
+        bq.ScalarQueryParameter(param.name.encode("latin-1"), param.type.encode("latin-1"), value)
+        for param, value in zip(dimensions, combination)
+    ] for combination in itertools.product(*[param_values(param) for param in dimensions])] if dimensions else []
     invariants = to_conditions(raw_spec.invariants)
     cases = [Case(to_conditions(case.where), to_conditions(case.expected)) for case in raw_spec.cases]
 
-    return Spec(query_path, params, raw_spec.columns, invariants, cases)
+    return Spec(query_path, params, raw_spec.columns, invariants, cases, raw_spec.aggregates, matrix,
+                to_sample(raw_spec.sample), raw_spec.table)
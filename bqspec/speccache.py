@@ -0,0 +1,142 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import os
+import os.path
+import sys
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from six.moves import cPickle as pickle
+
+from .__version__ import __version__
+from .condition import parse, preload
+from .error import SpecError
+from .loader import load_yaml
+from .rcpath import resource_val
+from .rstruct import RawSpec
+from .validator import validate_schema, validate_values
+from .validator.values import validate_file_path
+
+VERSION = 1
+PICKLE_PROTOCOL = 2
+
+
+class SpecCache(object):
+    """Specs validated by earlier runs, kept in a file along with the marshalled code of their conditions.
+
+    A spec is reused while its YAML has the same mtime and size, or else the same SHA-256. The file is only
+    reused by the same version of bqspec and of Python, since it holds their compiled code.
+    """
+
+    def __init__(self, path):  # type: (Text) -> None
+        self.path = path  # type: Text
+        # the YAML of each spec, by its absolute path, with its mtime, size, SHA-256 and conditions.
+        self.specs = {}  # type: Dict[Text, Dict[Text, Any]]
+        # the marshalled code of every condition of the specs, by its text.
+        self.conditions = {}  # type: Dict[Text, bytes]
+        self.dirty = False
+        self.load()
+
+    def load(self):  # type: () -> None
+        try:
+            with open(self.path, "rb") as f:
+                obj = pickle.load(f)
+        except Exception:
+            # a missing or broken cache only makes every spec load from scratch.
+            return
+        if isinstance(obj, dict) and obj.get("version") == _version():
+            self.specs = obj["specs"]
+            self.conditions = obj["conditions"]
+
+    def save(self):  # type: () -> None
+        if not self.dirty:
+            return
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": _version(),
+                "specs": self.specs,
+                "conditions": self.conditions,
+            }, f, PICKLE_PROTOCOL)
+        os.rename(tmp_path, self.path)
+        self.dirty = False
+
+    def get(self, path):  # type: (Text) -> Optional[dict]
+        """Returns the validated YAML of the spec at path, or None if it is not cached or changed.
+
+        The YAML is read and hashed only if its mtime or size changed.
+        """
+        entry = self.specs.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if (entry["mtime"], entry["size"]) == (stat.st_mtime, stat.st_size):
+            return self._hit(entry)
+        if hashlib.sha256(_read(path)).hexdigest() != entry["digest"]:
+            return None
+        entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+        self.dirty = True
+        return self._hit(entry)
+
+    def _hit(self, entry):  # type: (Dict[Text, Any]) -> dict
+        for text in entry["conditions"]:
+            preload(text, self.conditions[text])
+        return entry["obj"]
+
+    def put(self, path, content, obj, raw_spec):  # type: (Text, bytes, dict, RawSpec) -> None
+        """Caches the YAML obj of the valid spec at path, which was read as content."""
+        texts = list(raw_spec.invariants)
+        for case in raw_spec.cases:
+            texts.extend(case.where)
+            texts.extend(case.expected)
+        for text in texts:
+            if text not in self.conditions:
+                self.conditions[text] = parse(text).marshal()
+        stat = os.stat(path)
+        self.specs[os.path.abspath(path)] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "digest": hashlib.sha256(content).hexdigest(),
+            "obj": obj,
+            "conditions": sorted(set(texts)),
+        }
+        self.dirty = True
+
+
+def _version():  # type: () -> Tuple[int, Text, Text]
+    return VERSION, __version__, sys.version
+
+
+def _read(path):  # type: (Text) -> bytes
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def validate_spec(path, cache=None):  # type: (Text, Optional[SpecCache]) -> Tuple[Optional[RawSpec], List[SpecError]]
+    """Reads and validates the spec at path. Its conditions are parsed once, see bqspec.condition.
+
+    With cache, a spec which was valid in an earlier run is not parsed or validated again, only its query_path
+    is checked.
+    """
+    obj = cache.get(path) if cache is not None else None
+    if obj is not None:
+        raw_spec = RawSpec(**obj)
+        if raw_spec.query_path is None:
+            return raw_spec, []
+        return raw_spec, validate_file_path(raw_spec.query_path, ["query_path", resource_val])
+
+    content = _read(path)
+    obj = load_yaml(io.BytesIO(content))
+    errors = validate_schema(obj)
+    if errors:
+        return None, errors
+
+    raw_spec = RawSpec(**obj)
+    errors = validate_values(raw_spec)
+    if errors:
+        return None, errors
+    if cache is not None:
+        cache.put(path, content, obj, raw_spec)
+    return raw_spec, []
@@ -0,0 +1,94 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import os.path
+import threading
+import time
+from typing import Any, Dict, Optional, Text
+
+import six
+
+from .loader import load_yaml
+
+VERSION = 1
+
+
+def spec_digest(path):  # type: (Text) -> Text
+    """Hashes the inputs of a spec: its YAML, its query_path SQL and its params."""
+    h = hashlib.sha256()
+    content = _read(path)
+    h.update(content or b"")
+    try:
+        obj = load_yaml(io.BytesIO(content)) if content is not None else None
+    except Exception:
+        obj = None
+    if isinstance(obj, dict):
+        query_path = obj.get("query_path")
+        if isinstance(query_path, six.string_types):
+            h.update(b"\0")
+            h.update(_read(query_path) or b"")
+        h.update(b"\0")
+        h.update(json.dumps(obj.get("params"), sort_keys=True, default=repr).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _read(path):  # type: (Text) -> Optional[bytes]
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+class State(object):
+    """The digest of each spec's inputs and whether the spec passed with them, kept in a JSON file."""
+
+    def __init__(self, path, token=None):  # type: (Text, Optional[Text]) -> None
+        self.path = path  # type: Text
+        self.token = token  # type: Optional[Text]
+        self.specs = {}  # type: Dict[Text, Dict[Text, Any]]
+        # whether specs were recorded since the state was saved.
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):  # type: () -> None
+        content = _read(self.path)
+        if content is None:
+            return
+        try:
+            obj = json.loads(content.decode("utf-8"))
+        except ValueError:
+            # a broken state only makes every spec run again.
+            return
+        if isinstance(obj, dict) and obj.get("version") == VERSION:
+            self.specs = obj.get("specs", {})
+
+    def save(self):  # type: () -> None
+        """Writes the recorded specs to the file, replacing it at once."""
+        with self._lock:
+            if not self.dirty:
+                return
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with io.open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"version": VERSION, "specs": self.specs}, indent=2, sort_keys=True))
+            os.rename(tmp_path, self.path)
+            self.dirty = False
+
+    def changed(self, path):  # type: (Text) -> bool
+        """Returns False if the spec passed in its last run, with the same inputs and freshness token."""
+        entry = self.specs.get(os.path.normpath(path))
+        if entry is None or not entry.get("passed") or entry.get("token") != self.token:
+            return True
+        return entry.get("digest") != spec_digest(path)
+
+    def record(self, path, passed):  # type: (Text, bool) -> None
+        """Records whether the spec passed with its current inputs. It is written to the file by save."""
+        entry = {"digest": spec_digest(path), "token": self.token, "passed": passed, "time": time.time()}
+        with self._lock:
+            self.specs[os.path.normpath(path)] = entry
+            self.dirty = True
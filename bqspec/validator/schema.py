@@ -54,15 +54,20 @@ def validate_schema(obj, resource_path=None):  # type: (Any, Optional[ResourcePa
 
     raw_spec = obj  # type: dict
 
-    required = {"query_path"}
-    optional = {"params", "columns"}
-    either_or_both = {"cases", "invariants"}
-    known = required | optional | either_or_both
+    exclusive = {"query_path", "table"}
+    optional = {"params", "columns", "sample"}
+    either_or_both = {"cases", "invariants", "aggregates"}
+    known = exclusive | optional | either_or_both
 
-    if "query_path" not in raw_spec:
+    given = exclusive & set(raw_spec)
+    if not given:
         errors.append(missing_error("query_path", resource_path))
-    elif not isinstance(raw_spec["query_path"], six.text_type):
-        errors.append(type_error("query_path", "unicode", resource_path + ["query_path", resource_val]))
+    elif len(given) > 1:
+        message = "top level object requires only one of: {}".format(",".join(sorted(exclusive)))
+        errors.append(schema_error(message, resource_path))
+    for key in sorted(given):
+        if not isinstance(raw_spec[key], six.text_type):
+            errors.append(type_error(key, "unicode", resource_path + [key, resource_val]))
 
     if "params" in raw_spec:
         params = raw_spec["params"]
@@ -83,9 +88,17 @@ def validate_schema(obj, resource_path=None):  # type: (Any, Optional[ResourcePa
                         type_error("columns's element", "unicode",
                                    resource_path + ["columns", resource_index(i), resource_val]))
 
+    if "sample" in raw_spec:
+        sample = raw_spec["sample"]
+        if not isinstance(sample, (int, float)) or isinstance(sample, bool):
+            errors.append(type_error("sample", "(int,float)", resource_path + ["sample", resource_val]))
+
     if "invariants" in raw_spec:
         errors.extend(validate_conditions_schema("invariants", raw_spec["invariants"], resource_path))
 
+    if "aggregates" in raw_spec:
+        errors.extend(validate_conditions_schema("aggregates", raw_spec["aggregates"], resource_path))
+
     if "cases" in raw_spec:
         cases = raw_spec["cases"]
         if not isinstance(cases, list):
@@ -112,7 +125,8 @@ def validate_param_schema(obj, resource_path):  # type: (Any, ResourcePath) -> L
     raw_param = obj  # type: dict
 
     required = {"type", "name"}
-    known = required | {"value"}
+    exclusive = {"value", "values", "range"}
+    known = required | exclusive
 
     for key in required:
         if key not in raw_param:
@@ -120,13 +134,26 @@ def validate_param_schema(obj, resource_path):  # type: (Any, ResourcePath) -> L
         elif not isinstance(raw_param[key], six.text_type):
             errors.append(type_error(key, "unicode", resource_path + [key, resource_val]))
 
-    if "value" not in raw_param:
+    given = exclusive & set(raw_param)
+    if not given:
         errors.append(missing_error("value", resource_path, parent="param"))
-    else:
-        value = raw_param["value"]
-        if not isinstance(value, (six.text_type, int, float, bool, datetime.datetime, datetime.date)):
-            errors.append(
-                type_error("value", "(unicode,int,float,bool,datetime,date)", resource_path + ["value", resource_val]))
+    elif len(given) > 1:
+        errors.append(schema_error("param requires only one of: {}".format(",".join(sorted(exclusive))), resource_path))
+
+    if "value" in raw_param:
+        errors.extend(validate_param_value_schema("value", raw_param["value"], resource_path + ["value", resource_val]))
+
+    if "values" in raw_param:
+        values = raw_param["values"]
+        if not isinstance(values, list) or not values:
+            errors.append(type_error("values", "non-empty sequence", resource_path + ["values", resource_val]))
+        else:
+            for i, value in enumerate(values):
+                p = resource_path + ["values", resource_index(i), resource_val]
+                errors.extend(validate_param_value_schema("values's element", value, p))
+
+    if "range" in raw_param:
+        errors.extend(validate_range_schema(raw_param["range"], resource_path + ["range"]))
 
     for key in raw_param:
         if key not in known:
@@ -135,6 +162,38 @@ def validate_param_schema(obj, resource_path):  # type: (Any, ResourcePath) -> L
     return errors
 
 
+def validate_param_value_schema(name, value, resource_path):  # type: (Text, Any, ResourcePath) -> List[SpecError]
+    if not isinstance(value, (six.text_type, int, float, bool, datetime.datetime, datetime.date)):
+        return [type_error(name, "(unicode,int,float,bool,datetime,date)", resource_path)]
+    return []
+
+
+def validate_range_schema(obj, resource_path):  # type: (Any, ResourcePath) -> List[SpecError]
+    errors = assert_type(obj, dict, "range", "mapping", resource_path + [resource_val])
+    if errors:
+        return errors
+
+    raw_range = obj  # type: dict
+
+    required = {"start", "end"}
+    known = required | {"step"}
+
+    for key in sorted(required):
+        if key not in raw_range:
+            errors.append(missing_error(key, resource_path, parent="range"))
+        else:
+            errors.extend(validate_param_value_schema(key, raw_range[key], resource_path + [key, resource_val]))
+
+    if "step" in raw_range and (not isinstance(raw_range["step"], int) or isinstance(raw_range["step"], bool)):
+        errors.append(type_error("step", "int", resource_path + ["step", resource_val]))
+
+    for key in raw_range:
+        if key not in known:
+            errors.append(unknown_property_error(key, resource_path))
+
+    return errors
+
+
 def validate_case_schema(obj, resource_path):  # type: (Any, ResourcePath) -> List[SpecError]
     errors = assert_type(obj, dict, "case", "mapping", resource_path + [resource_val])
     if errors:
@@ -2,12 +2,16 @@
 from __future__ import unicode_literals
 
 import os.path
-from typing import List, Optional, Text
+from typing import List, Optional, Text, Union
 
 import embexpr
 
+from bqspec.aggregate import InvalidAggregate, to_sql
+from bqspec.backend import is_table
 from bqspec.bqtype import SUPPORT_TYPES
+from bqspec.condition import parse
 from bqspec.error import SpecError
+from bqspec.matrix import MAX_COMBINATIONS, RANGE_TYPES, combinations
 from bqspec.rcpath import ResourcePath, resource_index, resource_val
 from bqspec.rstruct import RawParam, RawSpec
 
@@ -32,10 +36,20 @@ def validate_values(raw_spec, resource_path=None):  # type: (RawSpec, Optional[R
     if resource_path is None:
         resource_path = []
 
-    errors = validate_file_path(raw_spec.query_path, resource_path + ["query_path", resource_val])
+    errors = []  # type: List[SpecError]
+    if raw_spec.query_path is not None:
+        errors.extend(validate_file_path(raw_spec.query_path, resource_path + ["query_path", resource_val]))
+    if raw_spec.table is not None:
+        errors.extend(validate_table_values(raw_spec, resource_path))
 
     for i, param in enumerate(raw_spec.params):
-        errors.extend(validate_param_values(param, resource_path + ["params", resource_index(i), resource_val]))
+        errors.extend(validate_param_values(param, resource_path + ["params", resource_index(i)]))
+    if not errors and combinations(raw_spec.params) > MAX_COMBINATIONS:
+        message = "{} combinations of params, over the limit of {}".format(combinations(raw_spec.params),
+                                                                          MAX_COMBINATIONS)
+        errors.append(value_error(message, resource_path + ["params", resource_val]))
+
+    errors.extend(validate_sample_values(raw_spec.sample, resource_path + ["sample", resource_val]))
 
     errors.extend(validate_conditions_values("invariants", raw_spec.invariants, resource_path))
 
@@ -44,20 +58,70 @@ def validate_values(raw_spec, resource_path=None):  # type: (RawSpec, Optional[R
         errors.extend(validate_conditions_values("where", case.where, p))
         errors.extend(validate_conditions_values("expected", case.expected, p))
 
+    values = []  # type: List[Text]
+    for i, aggregate in enumerate(raw_spec.aggregates):
+        try:
+            to_sql(aggregate, values)
+        except InvalidAggregate as e:
+            errors.append(value_error(e.message, resource_path + ["aggregates", resource_index(i), resource_val]))
+
+    return errors
+
+
+def validate_table_values(raw_spec, resource_path):  # type: (RawSpec, ResourcePath) -> List[SpecError]
+    errors = []  # type: List[SpecError]
+    if not is_table(raw_spec.table):
+        message = "table must be dataset.table or project.dataset.table: {}".format(raw_spec.table)
+        errors.append(value_error(message, resource_path + ["table", resource_val]))
+    if raw_spec.params:
+        errors.append(value_error("params are not supported with table", resource_path + ["params", resource_val]))
     return errors
 
 
 def validate_param_values(param, resource_path):  # type: (RawParam, ResourcePath) -> List[SpecError]
     errors = []  # type: List[SpecError]
     if param.type.upper() not in SUPPORT_TYPES:
-        errors.append(value_error("unsupported type: {}".format(param.type), resource_path))
-    else:
-        t = SUPPORT_TYPES[param.type.upper()]
-        if not isinstance(param.value, t):
-            errors.append(value_error("value is invalid {}".format(param.type), resource_path))
+        errors.append(value_error("unsupported type: {}".format(param.type), resource_path + [resource_val]))
+        return errors
+
+    t = SUPPORT_TYPES[param.type.upper()]
+    if param.values is not None:
+        for i, value in enumerate(param.values):
+            if not isinstance(value, t):
+                p = resource_path + ["values", resource_index(i), resource_val]
+                errors.append(value_error("value is invalid {}".format(param.type), p))
+    elif param.range is not None:
+        errors.extend(validate_range_values(param, resource_path + ["range"]))
+    elif not isinstance(param.value, t):
+        errors.append(value_error("value is invalid {}".format(param.type), resource_path + [resource_val]))
+    return errors
+
+
+def validate_range_values(param, resource_path):  # type: (RawParam, ResourcePath) -> List[SpecError]
+    if param.type.upper() not in RANGE_TYPES:
+        message = "range is not supported for {}, only for {}".format(param.type, ",".join(sorted(RANGE_TYPES)))
+        return [value_error(message, resource_path + [resource_val])]
+
+    errors = []  # type: List[SpecError]
+    t = SUPPORT_TYPES[param.type.upper()]
+    for key in ("start", "end"):
+        if not isinstance(getattr(param.range, key), t):
+            errors.append(value_error("{} is invalid {}".format(key, param.type), resource_path + [key, resource_val]))
+    if param.range.step < 1:
+        errors.append(value_error("step must be positive", resource_path + ["step", resource_val]))
+    if not errors and param.range.start > param.range.end:
+        errors.append(value_error("start is after end", resource_path + [resource_val]))
     return errors
 
 
+def validate_sample_values(sample, resource_path):  # type: (Union[int, float, None], ResourcePath) -> List[SpecError]
+    if isinstance(sample, float) and not 0 < sample <= 1:
+        return [value_error("a fraction of rows must be in (0, 1]", resource_path)]
+    if isinstance(sample, int) and sample < 1:
+        return [value_error("a number of rows must be positive", resource_path)]
+    return []
+
+
 def validate_conditions_values(container, conditions, resource_path):
     # type: (Text, List[Text], ResourcePath) -> List[SpecError]
     errors = []  # type: List[SpecError]
@@ -70,7 +134,8 @@ def validate_conditions_values(container, conditions, resource_path):
 
 def validate_condition_values(condition, resource_path):  # type: (Text, ResourcePath) -> List[SpecError]
     try:
-        embexpr.parse(condition)
+        # parsed once: the spec is built from the same parsed condition.
+        parse(condition)
         return []
     except embexpr.ParseError as e:
         return [value_error(e.message, resource_path)]
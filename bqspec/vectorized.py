@@ -0,0 +1,293 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import ast
+import operator
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Text, Tuple
+
+import six
+
+from .astutil import NotConstant, constant_value, is_column, parse_condition
+from .failures import FailureCollector
+from .parallel import batches
+from .row import evaluate as evaluate_condition
+
+# imported by available(), as numpy takes a while to import.
+numpy = None  # type: Any
+
+if TYPE_CHECKING:
+    import embexpr
+    from .spec import Results, Spec
+
+BATCH_SIZE = 10000
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+# numpy computes these like python when an operand is a float, but not on fixed width integers.
+FLOAT_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+}
+if six.PY3:
+    FLOAT_OPERATORS[ast.Div] = operator.truediv
+
+# only exact when every element goes through python.
+OBJECT_OPERATORS = {
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+
+class Unvectorizable(Exception):
+    pass
+
+
+def available():  # type: () -> bool
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+    return True
+
+
+def evaluate(spec, fields, rows, batch_size=BATCH_SIZE, collector=None, check_columns=True):
+    # type: (Spec, List[Text], Iterable[tuple], int, Optional[FailureCollector], bool) -> Results
+    """Evaluates the spec column-wise over batches of row tuples.
+
+    Gives the same results as Spec.evaluate. Conditions numpy can not evaluate exactly like python
+    are evaluated row by row with their Expr. Dicts are only built for the failed rows.
+    """
+    if not available():
+        raise ImportError("numpy is required to evaluate vectorized")
+    if collector is None:
+        collector = FailureCollector(len(spec.cases))
+    nodes = {}  # type: Dict[Text, Optional[ast.AST]]
+    first = check_columns
+    for rows_batch in batches(rows, batch_size):
+        if collector.stopped:
+            break
+        batch = Batch(fields, rows_batch, nodes)
+        if first and spec.columns:
+            first = False
+            unknown = spec.unknown_columns(batch.dict(0))
+            if unknown:
+                collector.add_invariants(unknown)
+
+        everything = numpy.arange(len(batch))
+        failed_invariants = [(invariant.expr, ~batch.truth(invariant, everything)) for invariant in spec.invariants]
+
+        failed_cases = []  # type: List[Tuple[int, List[Tuple[Text, Any]]]]
+        for i, case in enumerate(spec.cases):
+            if not case.expected:
+                continue
+            take = everything
+            for condition in case.where:
+                take = take[batch.truth(condition, take)]
+                if not len(take):
+                    break
+            if not len(take):
+                continue
+
+            unexpected = []
+            for condition in case.expected:
+                mask = numpy.zeros(len(batch), dtype=bool)
+                mask[take] = ~batch.truth(condition, take)
+                unexpected.append((condition.expr, mask))
+            failed_cases.append((i, unexpected))
+
+        masks = [mask for _, mask in failed_invariants]
+        masks.extend(mask for _, unexpected in failed_cases for _, mask in unexpected)
+        if not masks:
+            continue
+
+        for r in numpy.flatnonzero(numpy.logical_or.reduce(masks)):
+            if collector.stopped:
+                break
+            record = batch.dict(r)
+            failed = [expr for expr, mask in failed_invariants if mask[r]]
+            if failed:
+                collector.add_invariants((record, failed))
+            for i, unexpected in failed_cases:
+                failed = [expr for expr, mask in unexpected if mask[r]]
+                if failed:
+                    collector.add_case(i, (record, failed))
+    return collector.results()
+
+
+class Batch(object):
+    """Row tuples whose columns are converted to numpy arrays on first use."""
+
+    def __init__(self, fields, rows, nodes):  # type: (List[Text], List[tuple], Dict[Text, Optional[ast.AST]]) -> None
+        self.fields = fields  # type: List[Text]
+        self.rows = rows  # type: List[tuple]
+        self.nodes = nodes  # type: Dict[Text, Optional[ast.AST]]
+        self.positions = {field: i for i, field in enumerate(fields)}  # type: Dict[Text, int]
+        self._columns = {}  # type: Dict[Text, Any]
+        self._dicts = {}  # type: Dict[int, dict]
+
+    def __len__(self):  # type: () -> int
+        return len(self.rows)
+
+    def dict(self, i):  # type: (int) -> dict
+        if i not in self._dicts:
+            row = self.rows[i]
+            self._dicts[i] = {field: row[j] for j, field in enumerate(self.fields)}
+        return self._dicts[i]
+
+    def column(self, name):  # type: (Text) -> Any
+        if name not in self._columns:
+            if name not in self.positions:
+                raise Unvectorizable()
+            position = self.positions[name]
+            self._columns[name] = to_array([row[position] for row in self.rows])
+        return self._columns[name]
+
+    def truth(self, condition, take):  # type: (embexpr.Expr, Any) -> Any
+        """Returns the truth of the condition for the rows at take, as a bool array."""
+        node = self.node(condition.expr)
+        if node is not None:
+            try:
+                with numpy.errstate(all="raise"):
+                    return to_truth(self.evaluate(node, take), len(take))
+            except Exception:
+                # anything numpy rejects is left to python, which also raises the errors users expect.
+                pass
+        return numpy.array([bool(evaluate_condition(condition, self.dict(i))) for i in take], dtype=bool)
+
+    def node(self, expr):  # type: (Text) -> Optional[ast.AST]
+        if expr not in self.nodes:
+            try:
+                self.nodes[expr] = parse_condition(expr)
+            except SyntaxError:
+                self.nodes[expr] = None
+        return self.nodes[expr]
+
+    def evaluate(self, node, take):  # type: (ast.AST, Any) -> Any
+        if is_column(node):
+            return self.column(node.id)[take]
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self.evaluate(node.operand, take)
+            if isinstance(node.op, ast.Not):
+                return ~to_truth(operand, len(take))
+            if isinstance(node.op, ast.USub):
+                return -operand if is_float(operand) else -to_object(operand)
+            raise Unvectorizable()
+
+        if isinstance(node, ast.BinOp):
+            left, right = self.evaluate(node.left, take), self.evaluate(node.right, take)
+            op = type(node.op)
+            if op in FLOAT_OPERATORS and is_number(left) and is_number(right) and (is_float(left) or is_float(right)):
+                # python converts the other operand to float too.
+                return FLOAT_OPERATORS[op](left, right)
+            if op in FLOAT_OPERATORS or op in OBJECT_OPERATORS:
+                f = FLOAT_OPERATORS.get(op) or OBJECT_OPERATORS[op]
+                return f(to_object(left), to_object(right))
+            raise Unvectorizable()
+
+        if isinstance(node, ast.Compare):
+            result = None
+            left = self.evaluate(node.left, take)
+            for i, (op, comparator) in enumerate(zip(node.ops, node.comparators)):
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    if i != len(node.ops) - 1:
+                        raise Unvectorizable()
+                    right = self.evaluate_container(comparator, take)
+                else:
+                    right = self.evaluate(comparator, take)
+                truth = to_truth(compare(op, left, right), len(take))
+                result = truth if result is None else result & truth
+                left = right
+            return result
+
+        try:
+            value = constant_value(node)
+        except NotConstant:
+            raise Unvectorizable()
+        if isinstance(value, six.integer_types) and not isinstance(value, bool):
+            if not INT64_MIN <= value <= INT64_MAX:
+                raise Unvectorizable()
+        return value
+
+    def evaluate_container(self, node, take):  # type: (ast.AST, Any) -> List[Any]
+        if not isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            raise Unvectorizable()
+        return [self.evaluate(elt, take) for elt in node.elts]
+
+
+def compare(op, left, right):  # type: (ast.AST, Any, Any) -> Any
+    if isinstance(op, (ast.In, ast.NotIn)):
+        found = False
+        for element in right:
+            found = found | to_truth(compare(ast.Eq(), left, element), None)
+        return ~found if isinstance(op, ast.NotIn) else found
+
+    f = COMPARE_OPERATORS.get(type(op))  # type: Optional[Callable[[Any, Any], Any]]
+    if f is None:
+        raise Unvectorizable()
+    if not (is_number(left) and is_number(right)) or is_integer(left) != is_integer(right):
+        # numpy compares integers with floats as float64 and other types not at all, python compares exactly.
+        left, right = to_object(left), to_object(right)
+    return f(left, right)
+
+
+def to_array(values):  # type: (List[Any]) -> Any
+    types = set(map(type, values))
+    if types == {float}:
+        return numpy.array(values, dtype=numpy.float64)
+    if types == {bool}:
+        return numpy.array(values, dtype=bool)
+    if types and types <= set(six.integer_types) and INT64_MIN <= min(values) and max(values) <= INT64_MAX:
+        return numpy.array(values, dtype=numpy.int64)
+
+    array = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def to_object(value):  # type: (Any) -> Any
+    if isinstance(value, numpy.ndarray) and value.dtype != object:
+        return value.astype(object)
+    return value
+
+
+def to_truth(value, size):  # type: (Any, Optional[int]) -> Any
+    if not isinstance(value, numpy.ndarray):
+        if size is None:
+            return bool(value)
+        return numpy.full(size, bool(value), dtype=bool)
+    if value.dtype == bool:
+        return value
+    return value.astype(bool)
+
+
+def is_number(value):  # type: (Any) -> bool
+    if isinstance(value, numpy.ndarray):
+        return value.dtype.kind in "biuf"
+    return isinstance(value, (six.integer_types, float))
+
+
+def is_integer(value):  # type: (Any) -> bool
+    if isinstance(value, numpy.ndarray):
+        return value.dtype.kind in "biu"
+    return isinstance(value, six.integer_types)
+
+
+def is_float(value):  # type: (Any) -> bool
+    if isinstance(value, numpy.ndarray):
+        return value.dtype.kind == "f"
+    return isinstance(value, float)